@@ -0,0 +1,43 @@
+"""Denormalized document star count
+
+Revision ID: 3f1a9c2d7b64
+Revises: 892cfac0b729
+Create Date: 2025-06-10 11:04:37.512093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2d7b64'
+down_revision: Union[str, None] = '892cfac0b729'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.add_column(
+            sa.Column('star_count', sa.Integer(), nullable=False, server_default='0')
+        )
+
+    # Backfill the counter from the existing stars
+    op.execute(
+        """
+        UPDATE documents
+        SET star_count = (
+            SELECT COUNT(*) FROM document_stars
+            WHERE document_stars.document_id = documents.id
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.drop_column('star_count')
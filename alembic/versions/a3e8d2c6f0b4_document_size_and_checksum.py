@@ -0,0 +1,32 @@
+"""Document size and checksum
+
+Revision ID: a3e8d2c6f0b4
+Revises: f1b2c3d4e5a6
+Create Date: 2025-06-20 14:03:55.218640
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3e8d2c6f0b4'
+down_revision: Union[str, None] = 'f1b2c3d4e5a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('documents', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size_bytes', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('checksum', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('documents', schema=None) as batch_op:
+        batch_op.drop_column('checksum')
+        batch_op.drop_column('size_bytes')
@@ -0,0 +1,39 @@
+"""Document trending scores
+
+Revision ID: a72e5d0c4b19
+Revises: 3f1a9c2d7b64
+Create Date: 2025-06-12 09:18:52.730415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a72e5d0c4b19'
+down_revision: Union[str, None] = '3f1a9c2d7b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('document_trending',
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('star_count', sa.Integer(), nullable=False),
+    sa.Column('views', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('document_id')
+    )
+    op.create_index('ix_document_trending_score', 'document_trending', ['score', 'document_id'], unique=False)
+    # Rows are seeded by the first trending refresh after deploy
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_document_trending_score', table_name='document_trending')
+    op.drop_table('document_trending')
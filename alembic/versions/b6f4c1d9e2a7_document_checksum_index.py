@@ -0,0 +1,28 @@
+"""Index documents by content checksum
+
+Revision ID: b6f4c1d9e2a7
+Revises: a3e8d2c6f0b4
+Create Date: 2025-06-21 11:40:18.736204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f4c1d9e2a7'
+down_revision: Union[str, None] = 'a3e8d2c6f0b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_documents_checksum', 'documents', ['checksum'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_documents_checksum', table_name='documents')
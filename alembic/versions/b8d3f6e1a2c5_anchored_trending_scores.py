@@ -0,0 +1,33 @@
+"""Trending scores anchored to a fixed epoch
+
+Revision ID: b8d3f6e1a2c5
+Revises: e4a9c2d7b5f3
+Create Date: 2025-07-21 10:04:17.236581
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d3f6e1a2c5'
+down_revision: Union[str, None] = 'e4a9c2d7b5f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Decayed scores cannot be converted without the half-life, rows are reseeded by the next trending refresh
+    op.execute("DELETE FROM document_trending")
+    with op.batch_alter_table('document_trending') as batch_op:
+        batch_op.alter_column('score', existing_type=sa.Float(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM document_trending")
+    with op.batch_alter_table('document_trending') as batch_op:
+        batch_op.alter_column('score', existing_type=sa.Float(), nullable=False)
@@ -0,0 +1,39 @@
+"""User document stats rollup
+
+Revision ID: c5d8e1f2a937
+Revises: a72e5d0c4b19
+Create Date: 2025-06-13 16:41:05.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e1f2a937'
+down_revision: Union[str, None] = 'a72e5d0c4b19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_document_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('total_documents', sa.Integer(), nullable=False),
+    sa.Column('private_documents', sa.Integer(), nullable=False),
+    sa.Column('total_views', sa.Integer(), nullable=False),
+    sa.Column('total_stars', sa.Integer(), nullable=False),
+    sa.Column('total_revisions', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Rollups are created lazily on the first stats read of each user
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_document_stats')
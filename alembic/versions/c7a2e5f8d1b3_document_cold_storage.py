@@ -0,0 +1,41 @@
+"""Track document storage codec and last access for cold storage
+
+Revision ID: c7a2e5f8d1b3
+Revises: b6f4c1d9e2a7
+Create Date: 2025-06-28 09:12:44.508317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a2e5f8d1b3'
+down_revision: Union[str, None] = 'b6f4c1d9e2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.add_column(sa.Column('storage_codec', sa.String(), server_default='IDENTITY', nullable=False))
+        batch_op.add_column(sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+
+    # Existing files count as last read when they were uploaded
+    op.execute("UPDATE documents SET last_accessed_at = uploaded_at")
+    op.execute("UPDATE documents SET last_accessed_at = CURRENT_TIMESTAMP WHERE last_accessed_at IS NULL")
+
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.alter_column('last_accessed_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_documents_codec_accessed', ['storage_codec', 'last_accessed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.drop_index('ix_documents_codec_accessed')
+        batch_op.drop_column('last_accessed_at')
+        batch_op.drop_column('storage_codec')
@@ -0,0 +1,42 @@
+"""Indexes for hot queries
+
+Revision ID: d4b7f6a1e3c8
+Revises: c5d8e1f2a937
+Create Date: 2025-06-16 10:27:44.905318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b7f6a1e3c8'
+down_revision: Union[str, None] = 'c5d8e1f2a937'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_documents_key_version', 'documents', ['document_key', 'version'], unique=False)
+    op.create_index('ix_documents_user_active_uploaded', 'documents', ['user_id', 'is_active', 'uploaded_at'], unique=False)
+    op.create_index('ix_documents_explore', 'documents', ['is_active', 'is_private_document', 'views', 'id'], unique=False)
+    op.create_index('ix_documents_latest', 'documents', ['is_active', 'is_private_document', 'uploaded_at', 'id'], unique=False)
+    op.create_index('ix_document_stars_document_id', 'document_stars', ['document_id'], unique=False)
+    op.create_index('ix_conversations_user_archived_updated', 'conversations', ['user_id', 'is_archived', 'updated_at'], unique=False)
+    op.create_index('ix_conversations_document_id', 'conversations', ['document_id'], unique=False)
+    op.create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_created', table_name='messages')
+    op.drop_index('ix_conversations_document_id', table_name='conversations')
+    op.drop_index('ix_conversations_user_archived_updated', table_name='conversations')
+    op.drop_index('ix_document_stars_document_id', table_name='document_stars')
+    op.drop_index('ix_documents_latest', table_name='documents')
+    op.drop_index('ix_documents_explore', table_name='documents')
+    op.drop_index('ix_documents_user_active_uploaded', table_name='documents')
+    op.drop_index('ix_documents_key_version', table_name='documents')
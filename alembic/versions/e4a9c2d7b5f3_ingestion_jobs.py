@@ -0,0 +1,53 @@
+"""Persistent ingestion job queue
+
+Revision ID: e4a9c2d7b5f3
+Revises: d2f6b8a4c9e1
+Create Date: 2025-07-09 10:05:37.661294
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9c2d7b5f3'
+down_revision: Union[str, None] = 'd2f6b8a4c9e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('ingestion_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('document_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['document_id'], ['documents.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('document_id')
+    )
+    op.create_index('ix_ingestion_jobs_status_available', 'ingestion_jobs', ['status', 'available_at'], unique=False)
+
+    # Active documents that were waiting on an ingestion that never ran are queued
+    op.execute(
+        "INSERT INTO ingestion_jobs (document_id, status, attempts, available_at, created_at, updated_at) "
+        "SELECT id, 'PENDING', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM documents "
+        "WHERE is_active AND ingestion_status IN ('PENDING', 'IN_PROGRESS')"
+    )
+    op.execute(
+        "UPDATE documents SET ingestion_status = 'PENDING' "
+        "WHERE is_active AND ingestion_status = 'IN_PROGRESS'"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ingestion_jobs_status_available', table_name='ingestion_jobs')
+    op.drop_table('ingestion_jobs')
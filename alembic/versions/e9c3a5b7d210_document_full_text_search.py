@@ -0,0 +1,50 @@
+"""Document full-text search
+
+Revision ID: e9c3a5b7d210
+Revises: d4b7f6a1e3c8
+Create Date: 2025-06-18 14:52:19.046631
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c3a5b7d210'
+down_revision: Union[str, None] = 'd4b7f6a1e3c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Only titles can be backfilled, document text is indexed on upload
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE TABLE document_search ("
+            "document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE, "
+            "search_vector TSVECTOR NOT NULL)"
+        )
+        op.execute("CREATE INDEX ix_document_search_vector ON document_search USING GIN (search_vector)")
+        op.execute(
+            "INSERT INTO document_search (document_id, search_vector) "
+            "SELECT id, setweight(to_tsvector('english', title), 'A') FROM documents "
+            "WHERE is_active AND NOT is_private_document"
+        )
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE document_search "
+            "USING fts5(title, content, tokenize='porter unicode61')"
+        )
+        op.execute(
+            "INSERT INTO document_search (rowid, title, content) "
+            "SELECT id, title, '' FROM documents "
+            "WHERE is_active = 1 AND is_private_document = 0"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TABLE document_search")
@@ -0,0 +1,41 @@
+"""One active version per document key
+
+Revision ID: f1b2c3d4e5a6
+Revises: e9c3a5b7d210
+Create Date: 2025-06-19 09:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b2c3d4e5a6'
+down_revision: Union[str, None] = 'e9c3a5b7d210'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Reuploads that raced before this index existed can leave several
+    # active versions of a key, keep only the newest one active
+    op.execute(
+        "UPDATE documents SET is_active = false "
+        "WHERE is_active AND EXISTS ("
+        "SELECT 1 FROM documents AS newer "
+        "WHERE newer.document_key = documents.document_key "
+        "AND newer.is_active AND (newer.version > documents.version "
+        "OR (newer.version = documents.version AND newer.id > documents.id)))"
+    )
+    op.create_index(
+        'uq_documents_active_key', 'documents', ['document_key'], unique=True,
+        sqlite_where=sa.text('is_active = 1'), postgresql_where=sa.text('is_active = true')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_documents_active_key', table_name='documents')
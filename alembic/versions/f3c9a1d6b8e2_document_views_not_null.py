@@ -0,0 +1,32 @@
+"""Document views are never NULL
+
+Revision ID: f3c9a1d6b8e2
+Revises: b8d3f6e1a2c5
+Create Date: 2025-07-22 14:31:06.815402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c9a1d6b8e2'
+down_revision: Union[str, None] = 'b8d3f6e1a2c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NULL sorts last in the explore feed and breaks its keyset cursors, unviewed documents have 0 views
+    op.execute("UPDATE documents SET views = 0 WHERE views IS NULL")
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.alter_column('views', existing_type=sa.Integer(), nullable=False, server_default='0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.alter_column('views', existing_type=sa.Integer(), nullable=True, server_default=None)
@@ -0,0 +1,52 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+
+class CacheBackend(ABC):
+    """
+        Minimal async cache interface, so the in-process LRU can be swapped
+        for a shared backend (e.g. Redis) without touching the services
+    """
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def invalidate(self, prefix: str = "") -> None:
+        """Drops every entry whose key starts with `prefix`"""
+        pass
+
+
+class LRUCache(CacheBackend):
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, prefix: str = "") -> None:
+        if not prefix:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 class PaginationConstants:
     USERS_PER_PAGE = 10
     DOCUMENTS_PER_PAGE = 20
@@ -5,3 +7,70 @@ class PaginationConstants:
 class FreeTierLimitations:
     MAX_UPLOAD_DOCUMENTS = 3
     DOCUMENT_TOKEN_LIMIT = 100,000
+
+class UploadLimits:
+    CHUNK_SIZE = 1024 * 1024
+    # Largest accepted upload per account type, enforced while the body streams in
+    MAX_BYTES = {
+        "BASIC": 20 * 1024 * 1024,
+        "PREMIUM": 500 * 1024 * 1024,
+        "MODERATOR": 500 * 1024 * 1024,
+    }
+    # Resumable uploads a user can have open at once, each reserves disk space
+    MAX_UPLOAD_SESSIONS = 5
+
+class TrendingConstants:
+    STAR_WEIGHT = 1.0
+    VIEW_WEIGHT = 0.2
+    # Stored scores are relative to this instant, changing it or the half-life needs a rescore
+    EPOCH = datetime(2025, 1, 1)
+
+class BatchLimits:
+    MAX_STAR_DOCUMENTS = 500
+    MAX_DOCUMENT_KEYS = 250
+
+class SearchConstants:
+    # Only the beginning of large documents goes into the full-text index
+    MAX_INDEXED_BYTES = 2 * 1024 * 1024
+
+class ExportConstants:
+    # Rows fetched per round trip of the export cursor and sent per chunk
+    CHUNK_ROWS = 1000
+
+class ColdStorageConstants:
+    # Documents compressed per query of the cold storage sweep
+    BATCH_SIZE = 100
+    # A download only rewrites last_accessed_at when it is older than this
+    TOUCH_INTERVAL_SECONDS = 3600
+
+class UploadSessionConstants:
+    # Expired sessions removed per run of the expiry task
+    EXPIRY_BATCH_SIZE = 100
+
+class IngestionConstants:
+    # Documents one status stream can follow
+    MAX_STREAMED_DOCUMENTS = 100
+    # Followed documents looked up per query when resyncing status streams
+    RESYNC_BATCH_SIZE = 500
+    # Comment line sent on idle status streams, so proxies keep them open
+    STREAM_HEARTBEAT_SECONDS = 15
+
+class EmbeddingConstants:
+    # Characters per retrieval chunk, and shared with the next chunk
+    CHUNK_CHARS = 1000
+    CHUNK_OVERLAP = 150
+    # Chunks embedded per call, bounds the float32 matrix held at once
+    EMBED_BATCH = 2048
+    # Rows of an index dequantized and scored per matrix product
+    SEARCH_BLOCK_ROWS = 16384
+    MAX_OPEN_INDEXES = 64
+
+class PassageIndexConstants:
+    # IVF lists per square root of the rows of a segment
+    LISTS_PER_SQRT_ROWS = 1.0
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLE_PER_LIST = 64
+    ASSIGN_BLOCK_ROWS = 65536
+    # Segments merged at once when there are more than PASSAGE_INDEX_MAX_SEGMENTS
+    MERGE_FACTOR = 8
+    MAX_RESULTS = 50
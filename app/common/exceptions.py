@@ -42,6 +42,30 @@ class DocumentMissingException(HTTPException):
     def __init__(self, document_name):
         super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=f"Document not found: {document_name}")
 
+class DocumentVersionConflictException(HTTPException):
+    def __init__(self, document_key):
+        super().__init__(status_code=status.HTTP_409_CONFLICT, detail=f"Document was modified concurrently: {document_key}")
+
+class UploadTooLargeException(HTTPException):
+    def __init__(self, max_bytes):
+        super().__init__(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit of your account"
+        )
+
+class UploadSessionMissingException(HTTPException):
+    def __init__(self, upload_id):
+        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=f"Upload session not found: {upload_id}")
+
+class UploadOffsetConflictException(HTTPException):
+    def __init__(self, offset, message: str = "Upload is at a different offset"):
+        # The offset the client has to resume from is also sent as a header
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"{message}: {offset}",
+            headers={"Upload-Offset": str(offset)}
+        )
+
 class DocumentIngestionException(HTTPException):
     def __init__(self, message):
         super().__init__(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=f"Document Ingestion Error: {message}")
@@ -50,3 +74,10 @@ class InvalidConversationException(HTTPException):
     def __init__(self):
         super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=f"Invalid Conversation ID")
 
+class InvalidPaginationCursor(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid pagination cursor")
+
+class LLMUnavailableException(HTTPException):
+    def __init__(self, message):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"LLM unavailable: {message}")
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator, Iterable, List, Mapping
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.common.constants import ExportConstants
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _encode_ndjson(rows: Iterable[Mapping], columns: List[str]) -> bytes:
+    return "".join(
+        json.dumps({column: _plain(row[column]) for column in columns}, separators=(",", ":")) + "\n"
+        for row in rows
+    ).encode()
+
+def _encode_csv(rows: Iterable[Mapping], columns: List[str]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([_plain(row[column]) for column in columns] for row in rows)
+    return buffer.getvalue().encode()
+
+async def stream_rows(
+        db: AsyncSession, query: Select, export_format: ExportFormat,
+        chunk_rows: int = ExportConstants.CHUNK_ROWS) -> AsyncIterator[bytes]:
+    """
+        Yields `query` serialized as NDJSON or CSV, one chunk per partition
+        of a server-side cursor, so memory stays flat however many rows
+        there are. The session is closed once the stream is exhausted or
+        the client goes away.
+    """
+    columns = list(query.selected_columns.keys())
+    encode = _encode_csv if export_format == ExportFormat.CSV else _encode_ndjson
+    try:
+        if export_format == ExportFormat.CSV:
+            yield _encode_csv([dict(zip(columns, columns))], columns)
+
+        result = await db.stream(query.execution_options(yield_per=chunk_rows))
+        async for partition in result.mappings().partitions():
+            yield encode(partition, columns)
+    finally:
+        await db.close()
+
+def export_response(db: AsyncSession, query: Select, export_format: ExportFormat, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_rows(db, query, export_format),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format.value}"'}
+    )
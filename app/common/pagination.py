@@ -0,0 +1,34 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from app.common.exceptions import InvalidPaginationCursor
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    """
+        Packs the sort key of the last row of a page, plus its id as the
+        tie-breaker, into an opaque url-safe token
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    payload = json.dumps([sort_value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_type: type) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if sort_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        elif sort_type is float:
+            sort_value = float(sort_value)
+        elif not isinstance(sort_value, sort_type) or isinstance(sort_value, bool):
+            raise ValueError(sort_value)
+        if not isinstance(row_id, int):
+            raise ValueError(row_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise InvalidPaginationCursor()
+    return sort_value, row_id
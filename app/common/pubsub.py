@@ -0,0 +1,64 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Set
+
+class Subscription:
+    """
+        Messages published to the topics of one subscriber. Only the latest
+        message of each topic is kept, so a slow reader skips intermediate
+        states instead of letting a queue grow, and memory stays bounded by
+        the number of topics.
+    """
+    def __init__(self, topics: Iterable[Hashable]):
+        self.topics = frozenset(topics)
+        self._latest: Dict[Hashable, Any] = {}
+        self._ready = asyncio.Event()
+
+    def _deliver(self, topic: Hashable, message: Any) -> None:
+        self._latest[topic] = message
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Dict[Hashable, Any]:
+        """Latest message of every topic published to since the last call, empty after `timeout`"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._ready.clear()
+        messages, self._latest = self._latest, {}
+        return messages
+
+
+class PubSub:
+    """
+        In-process publish/subscribe on the event loop of the worker.
+        Publishing never blocks and costs one dict write per subscriber of
+        the topic. Messages published by other worker processes are not
+        seen, subscribers needing those resync from the database.
+    """
+    def __init__(self):
+        self._subscribers: Dict[Hashable, Set[Subscription]] = defaultdict(set)
+
+    def publish(self, topic: Hashable, message: Any) -> int:
+        subscribers = self._subscribers.get(topic, ())
+        for subscription in subscribers:
+            subscription._deliver(topic, message)
+        return len(subscribers)
+
+    @contextmanager
+    def subscribe(self, topics: Iterable[Hashable]) -> Iterator[Subscription]:
+        subscription = Subscription(topics)
+        for topic in subscription.topics:
+            self._subscribers[topic].add(subscription)
+        try:
+            yield subscription
+        finally:
+            for topic in subscription.topics:
+                self._subscribers[topic].discard(subscription)
+                if not self._subscribers[topic]:
+                    del self._subscribers[topic]
+
+    def topics(self) -> List[Hashable]:
+        """Topics with at least one subscriber"""
+        return list(self._subscribers)
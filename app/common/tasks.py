@@ -0,0 +1,55 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+from app.common.logger import logger
+
+class PeriodicTask:
+    """
+        Runs `func` every `interval` seconds on the event loop of the worker
+        until stopped. A failing run is logged and retried on the next tick.
+    """
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Background task '{self.name}' failed")
+            await asyncio.sleep(self.interval)
+
+
+background_tasks: List[PeriodicTask] = []
+
+def register_periodic_task(name: str, interval: float, func: Callable[[], Awaitable]) -> PeriodicTask:
+    task = PeriodicTask(name, interval, func)
+    background_tasks.append(task)
+    return task
+
+def start_background_tasks():
+    for task in background_tasks:
+        task.start()
+
+async def stop_background_tasks():
+    for task in background_tasks:
+        await task.stop()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -15,6 +15,98 @@ class Settings(BaseSettings):
 
     CORS_ALLOWED_ORIGINS: str = "*"
 
+    # Trending feed: activity loses half of its weight every half-life
+    TRENDING_HALF_LIFE_HOURS: float = 24
+    TRENDING_REFRESH_SECONDS: int = 300
+
+    # Document views are buffered in memory and written at this interval
+    VIEW_COUNT_FLUSH_SECONDS: int = 10
+
+    # Public document feeds are cached in-process between invalidations
+    FEED_CACHE_TTL_SECONDS: int = 30
+    FEED_CACHE_MAX_ENTRIES: int = 1024
+
+    # Uploaded files: "content_addressed" keeps one copy per distinct content,
+    # "local" one file per document version, "delta" stores versions as deltas
+    # against the previous one with a full copy every DELTA_KEYFRAME_INTERVAL
+    # (and for versions over DELTA_MAX_SIZE_MB, delta coding holds both in memory),
+    # "s3" keeps them in S3_BUCKET (STORAGE_PATH is then the key prefix)
+    STORAGE_BACKEND: str = "content_addressed"
+    STORAGE_PATH: str = "uploads"
+    DELTA_KEYFRAME_INTERVAL: int = 10
+    DELTA_MAX_SIZE_MB: int = 64
+
+    # Any S3 compatible server (MinIO, Ceph, ...) through S3_ENDPOINT_URL,
+    # AWS itself when it is left empty
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_BUCKET: str = ""
+    S3_REGION: str = "us-east-1"
+    S3_ACCESS_KEY_ID: str = ""
+    S3_SECRET_ACCESS_KEY: str = ""
+    S3_PART_SIZE_MB: int = 8
+    S3_UPLOAD_CONCURRENCY: int = 4
+    S3_MAX_CONNECTIONS: int = 32
+
+    # Local files not downloaded for COLD_STORAGE_AFTER_DAYS are gzipped in the
+    # background, unless that saves less than 1 - COLD_STORAGE_MIN_RATIO
+    COLD_STORAGE_AFTER_DAYS: int = 30
+    COLD_STORAGE_SWEEP_SECONDS: int = 3600
+    COLD_STORAGE_MIN_RATIO: float = 0.9
+
+    # Chunks of resumable uploads are kept on local disk under UPLOAD_SESSION_PATH
+    # until the upload completes, or UPLOAD_SESSION_EXPIRE_HOURS after the last one
+    UPLOAD_SESSION_PATH: str = "uploads/sessions"
+    UPLOAD_SESSION_EXPIRE_HOURS: int = 24
+    UPLOAD_SESSION_SWEEP_SECONDS: int = 900
+
+    # Ingestion jobs run in a pool of INGESTION_CONCURRENCY per worker process,
+    # failed or timed out jobs are retried with exponential backoff
+    INGESTION_CONCURRENCY: int = 4
+    INGESTION_JOB_TIMEOUT_SECONDS: int = 300
+    INGESTION_MAX_ATTEMPTS: int = 5
+    INGESTION_RETRY_BACKOFF_SECONDS: float = 10.0
+    INGESTION_POLL_SECONDS: float = 5.0
+    # Status streams are pushed the transitions of this worker's pool, and
+    # resync every INGESTION_STATUS_RESYNC_SECONDS for those of other workers
+    INGESTION_STATUS_RESYNC_SECONDS: float = 5.0
+
+    # LLM calls go to LLM_BACKEND: "simulated" runs the simulator in process,
+    # "http" calls the server at LLM_URL (e.g. scripts/llm_simulator.py).
+    # Ingestion and conversations each get LLM_MAX_CONCURRENCY calls in flight
+    # per worker, a call waiting LLM_QUEUE_TIMEOUT_SECONDS for one fails
+    LLM_BACKEND: str = "simulated"
+    LLM_URL: str = "http://localhost:8100"
+    LLM_MAX_CONNECTIONS: int = 32
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    LLM_TIMEOUT_SECONDS: float = 120.0
+    LLM_MAX_ATTEMPTS: int = 3
+    LLM_RETRY_BACKOFF_SECONDS: float = 0.5
+    # Timing of the simulated LLM, latencies as "fixed:SECONDS",
+    # "uniform:LOW,HIGH" or "lognormal:MEDIAN,P95"
+    LLM_SIM_INGEST_SECONDS: str = "uniform:3,10"
+    LLM_SIM_FIRST_TOKEN_SECONDS: str = "lognormal:0.4,1.5"
+    LLM_SIM_TOKENS_PER_SECOND: float = 50.0
+    LLM_SIM_ERROR_RATE: float = 0.0
+
+    # Ingested documents are split into chunks embedded by EMBEDDER into
+    # indexes under EMBEDDING_INDEX_PATH, stored as "int8" or "float16"
+    EMBEDDER: str = "hashing"
+    EMBEDDING_DIMENSIONS: int = 384
+    EMBEDDING_QUANTIZATION: str = "int8"
+    EMBEDDING_INDEX_PATH: str = "indexes"
+    RETRIEVAL_TOP_K: int = 5
+
+    # Approximate index over the passages of all public documents, searched
+    # in the PASSAGE_INDEX_NPROBE nearest lists of every segment
+    PASSAGE_INDEX_PATH: str = "passage_index"
+    PASSAGE_INDEX_NPROBE: int = 8
+    PASSAGE_INDEX_MAX_SEGMENTS: int = 16
+    PASSAGE_INDEX_MERGE_SECONDS: int = 60
+
+    # Lifetime of the presigned URLs downloads are redirected to
+    DOWNLOAD_URL_EXPIRE_SECONDS: int = 300
+
     # Required for scripts to run
     API_URL: str = "http://localhost:8000"
 
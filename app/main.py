@@ -6,9 +6,12 @@ from sqlalchemy.engine.url import make_url
 
 from app.common.database import engine
 from app.common.logger import logger
+from app.common.pagination import NEXT_CURSOR_HEADER
+from app.common.tasks import start_background_tasks, stop_background_tasks
 from app.common.middleware import AccessLogMiddleware
 from app.config import settings
 from app.api.router import router
+from app.modules.documents.service import chat_llm, flush_view_counts, ingestion_llm, ingestion_pool, storage
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -22,7 +25,16 @@ async def lifespan(app: FastAPI):
         initialize_tables()
         logger.warn("No DATABASE_URL provided, Using sqlite3")
 
+    start_background_tasks()
+    ingestion_pool.start()
     yield
+    await ingestion_pool.stop()
+    await stop_background_tasks()
+    # Views still buffered in memory would be lost with the worker
+    await flush_view_counts()
+    await storage.close()
+    await ingestion_llm.close()
+    await chat_llm.close()
     await engine.dispose()
 
 app = FastAPI(
@@ -40,6 +52,7 @@ app.add_middleware(CORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 @app.get("/")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Enum, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Enum, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -25,6 +25,11 @@ class Conversation(Base):
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
     document = relationship("Document", back_populates="conversations")
 
+    __table_args__ = (
+        Index("ix_conversations_user_archived_updated", "user_id", "is_archived", "updated_at"),
+        Index("ix_conversations_document_id", "document_id"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -37,3 +42,7 @@ class Message(Base):
 
     conversation = relationship("Conversation", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
+
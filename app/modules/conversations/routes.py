@@ -1,5 +1,6 @@
 from typing import List
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from uuid import UUID
 from app.modules.conversations.service import ConversationService
 from app.modules.conversations.schemas import ConversationCreateRequest, MessageCreate, ConversationDetail, \
@@ -14,6 +15,7 @@ class ConversationRoutes:
         self.router.post(   ''                              )(self.start_new_conversation)
         self.router.get(    '/{convo_id}'                   )(self.get_conversation)
         self.router.post(   '/{convo_id}'                   )(self.add_message)
+        self.router.post(   '/{convo_id}/stream'            )(self.stream_message)
         self.router.delete( '/{convo_id}'                   )(self.delete_conversation)
         self.router.post(   '/{convo_id}/archive'           )(self.archive_conversation)
 
@@ -35,6 +37,17 @@ class ConversationRoutes:
             ) -> MessageRead:
         return await service.post_message(convo_id, data)
 
+    async def stream_message(
+            self, convo_id: UUID, data: MessageCreate,
+            service: ConversationService = Depends(ConversationService)
+            ) -> StreamingResponse:
+        events = await service.stream_message(convo_id, data)
+        return StreamingResponse(
+            events, media_type="text/event-stream",
+            # Proxies must pass every token on as it comes
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
     async def get_conversation(
             self, convo_id: UUID,
             service: ConversationService = Depends(ConversationService)
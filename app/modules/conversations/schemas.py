@@ -17,6 +17,9 @@ class MessageRead(MessageCreate):
         "from_attributes": True
     }
 
+class MessageToken(BaseModel):
+    content: str
+
 class ConversationCreateRequest(BaseModel):
     document_id: int
     title: str | None = None
@@ -1,17 +1,20 @@
+import asyncio
+import json
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
+from typing import AsyncIterator
 
 
-from app.common.database import get_db
+from app.common.database import async_session, get_db
 from app.common.dependencies import get_current_user
-from app.common.exceptions import InvalidConversationException
+from app.common.exceptions import InvalidConversationException, LLMUnavailableException
+from app.common.logger import logger
 from app.modules.conversations import crud
-from app.modules.conversations.models import Role
-from app.modules.conversations.schemas import ConversationCreateRequest, MessageCreate
+from app.modules.conversations.models import Conversation, Role
+from app.modules.conversations.schemas import ConversationCreateRequest, MessageCreate, MessageRead, MessageToken
 from app.modules.users.models import User
-from app.modules.documents.service import IngestionService
-from app.modules.documents.crud import add_views
+from app.modules.documents.service import IngestionService, view_counter
 
 class ConversationService:
     def __init__(
@@ -23,7 +26,7 @@ class ConversationService:
         self.user = current_user
 
     async def create_conversation(self, data: ConversationCreateRequest):
-        await add_views(self.db, data.document_id)
+        view_counter.add(data.document_id)
         return await crud.create_conversation(self.db, self.user.id, data)
 
     async def list_conversations(self):
@@ -43,6 +46,7 @@ class ConversationService:
         await crud.add_message(self.db, convo_id, data)
 
         ai_reply = await IngestionService.query_document(
+            self.db,
             document_id=convo.document_id,
             query=data.content
         )
@@ -59,6 +63,54 @@ class ConversationService:
 
         return db_record
 
+    async def stream_message(self, convo_id, data: MessageCreate) -> AsyncIterator[str]:
+        """
+            Server-Sent Events of the reply to a message: a `token` event per
+            token as the LLM generates them, then a `message` event with the
+            assistant message, which is only stored once the answer is whole.
+            An `error` event ends the stream if the LLM fails meanwhile.
+        """
+        convo = await self.get_conversation(convo_id)
+        # Started before anything is stored, an unavailable LLM answers 503
+        tokens = await IngestionService.stream_query_document(
+            self.db,
+            document_id=convo.document_id,
+            query=data.content
+        )
+        try:
+            await crud.add_message(self.db, convo_id, data)
+            # Generation can take minutes, the stream must not hold a connection
+            await self.db.close()
+        except BaseException:
+            await tokens.aclose()
+            raise
+        return self._reply_events(convo, tokens)
+
+    @staticmethod
+    async def _reply_events(convo: Conversation, tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield f"event: token\ndata: {MessageToken(content=token).model_dump_json()}\n\n"
+        except LLMUnavailableException as error:
+            # The response has started, the error can only be sent as an event
+            yield f"event: error\ndata: {json.dumps({'detail': error.detail})}\n\n"
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # The response is cancelled when the client disconnects, which stops the generation
+            logger.info(f"Reply in conversation {convo.id} cancelled after {len(parts)} tokens")
+            raise
+        finally:
+            await tokens.aclose()
+
+        async with async_session() as db:
+            db_record = await crud.add_message(db, convo.id, MessageCreate(role=Role.LLM, content="".join(parts)))
+            convo.updated_at = datetime.now()
+            db.add(convo)
+            await db.commit()
+        yield f"event: message\ndata: {MessageRead.model_validate(db_record).model_dump_json()}\n\n"
+
     async def get_messages(self, convo_id):
         return await crud.get_messages(self.db, convo_id)
 
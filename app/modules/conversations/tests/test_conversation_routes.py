@@ -0,0 +1,70 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app.modules.conversations.models import Role
+from app.modules.conversations.service import ConversationService
+from app.modules.documents import service
+from app.modules.documents.llm import SimulatedLLMClient
+from app.modules.documents.llm_simulator import LLMSimulator
+from app.modules.documents.models import Document
+
+@pytest.mark.asyncio
+async def test_stream_conversation_reply(client, db, auth_headers, session_factory, monkeypatch):
+    text = "The lighthouse keeper counted  the ships every night.\n\nThe fog came in at dawn."
+    uploaded = (await client.put(
+        "/documents/stream", headers=auth_headers, params={"title": "Keeper.txt"}, content=text.encode()
+    )).json()
+    await service.process_document_ingestion(await db.get(Document, uploaded["id"]))
+
+    convo = (await client.post(
+        "/conversations", headers=auth_headers, json={"document_id": uploaded["id"]})).json()
+    response = await client.post(
+        f"/conversations/{convo['id']}/stream", headers=auth_headers,
+        json={"role": "user", "content": "What did the lighthouse keeper count?"}
+    )
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (event.split("\n")[0][len("event: "):], json.loads(event.split("\n")[1][len("data: "):]))
+        for event in response.text.split("\n\n") if event
+    ]
+    tokens = [data["content"] for name, data in events if name == "token"]
+    assert len(tokens) > 5 and "".join(tokens) == text
+    name, message = events[-1]
+    assert name == "message" and message["content"] == text and message["role"] == Role.LLM.value
+
+    messages = (await client.get(f"/conversations/{convo['id']}", headers=auth_headers)).json()
+    assert [message["content"] for message in messages] == ["What did the lighthouse keeper count?", text]
+
+    # With the LLM saturated the stream is refused with a 503, before anything is stored
+    busy = SimulatedLLMClient(
+        LLMSimulator("fixed:0", "fixed:0", 0), max_concurrency=1, queue_timeout=0.05, timeout=1, max_attempts=1,
+        retry_backoff=0)
+    monkeypatch.setattr(service, "chat_llm", busy)
+    held = busy.generate("Holding the only slot", ["one two"])
+    await held.__anext__()
+    response = await client.post(
+        f"/conversations/{convo['id']}/stream", headers=auth_headers, json={"role": "user", "content": "Busy?"})
+    assert response.status_code == 503
+    await held.aclose()
+    messages = (await client.get(f"/conversations/{convo['id']}", headers=auth_headers)).json()
+    assert len(messages) == 2
+
+    # A client going away mid-answer stops the generation, nothing is stored
+    closed = False
+    async def generate():
+        nonlocal closed
+        try:
+            for token in ("Never ", "finished"):
+                yield token
+        finally:
+            closed = True
+    events = ConversationService._reply_events(SimpleNamespace(id=convo["id"]), generate())
+    assert "Never" in await events.__anext__()
+    await events.aclose()
+    assert closed
+    messages = (await client.get(f"/conversations/{convo['id']}", headers=auth_headers)).json()
+    assert len(messages) == 2
+
+    await client.delete(f"/documents/{uploaded['document_key']}", headers=auth_headers)
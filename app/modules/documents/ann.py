@@ -0,0 +1,279 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+from app.common.constants import PassageIndexConstants
+
+class PassageHit(NamedTuple):
+    document_id: int
+    position: int
+    score: float
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means on a sample of `vectors`, unit length centroids"""
+    sample_size = min(len(vectors), nlist * PassageIndexConstants.KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(PassageIndexConstants.KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        # Lists left empty are reseeded with random sample points
+        empty = ~np.bincount(assignment, minlength=nlist).astype(bool)
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # In blocks, the full (vectors x centroids) score matrix can be gigabytes
+    block = PassageIndexConstants.ASSIGN_BLOCK_ROWS
+    return np.concatenate([
+        np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block)
+    ])
+
+
+class Segment:
+    """
+        Immutable inverted-file (IVF) segment, memory-mapped from disk. Rows
+        are grouped by their nearest centroid, so probing a list reads one
+        contiguous range:
+
+            centroids.npy     (lists, dimensions) float32
+            list_offsets.npy  (lists + 1) row ranges of the lists
+            vectors.npy       (rows, dimensions) int8, scaled per row by
+            scales.npy        float32
+            passages.npy      (rows, 2) int64 document id and chunk position
+            documents.npy     distinct document ids of the segment
+    """
+    def __init__(self, path: str, seq: int):
+        self.path = path
+        self.seq = seq
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+        self.passages = np.load(os.path.join(path, "passages.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def write(path: str, vectors: np.ndarray, passages: np.ndarray) -> None:
+        rng = np.random.default_rng(len(vectors))
+        nlist = max(1, int(np.sqrt(len(vectors)) * PassageIndexConstants.LISTS_PER_SQRT_ROWS))
+        centroids = train_centroids(vectors, min(nlist, len(vectors)), rng)
+        assignment = assign_lists(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=list_offsets[1:])
+
+        vectors = vectors[order]
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+
+        temp_path = f"{path}.tmp"
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, "centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(temp_path, "list_offsets.npy"), list_offsets)
+        np.save(os.path.join(temp_path, "vectors.npy"), np.round(vectors / scales[:, None]).astype(np.int8))
+        np.save(os.path.join(temp_path, "scales.npy"), scales.astype(np.float32))
+        np.save(os.path.join(temp_path, "passages.npy"), passages[order].astype(np.int64))
+        np.save(os.path.join(temp_path, "documents.npy"), np.unique(passages[:, 0]).astype(np.int64))
+        os.rename(temp_path, path)
+
+    def dense(self) -> np.ndarray:
+        return self.vectors.astype(np.float32) * self.scales[:, None]
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores and row numbers of the best `k` rows in the `nprobe` lists nearest to `query`"""
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in lists])
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.float32), rows
+
+        # Lists are contiguous, sorting the rows keeps the reads sequential
+        rows.sort()
+        scores = (self.vectors[rows].astype(np.float32) @ query) * self.scales[rows]
+        if len(rows) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            scores, rows = scores[top], rows[top]
+        return scores, rows
+
+
+class PassageIndex:
+    """
+        Approximate nearest neighbour index over the passages of many
+        documents, as a set of IVF segments listed in `manifest.json`.
+
+        Every `add` writes a small segment of its own and `merge` combines
+        the smallest ones into a larger, retrained segment in the background,
+        like the segments of a log-structured index. Removed documents are
+        tombstoned with the sequence number at removal, hiding their rows in
+        older segments while a later `add` of the same document stays
+        visible; merges drop the hidden rows for good.
+
+        The manifest is updated under an exclusive file lock, so the worker
+        processes of one deployment can share an index directory.
+    """
+    def __init__(self, base_path: str, nprobe: int, max_segments: int, merge_factor: int):
+        self.base_path = base_path
+        self.nprobe = nprobe
+        self.max_segments = max_segments
+        self.merge_factor = merge_factor
+        self._manifest_version = None
+        self._segments: Tuple[Segment, ...] = ()
+        self._tombstones: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.base_path, exist_ok=True)
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.base_path, "manifest.json")
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"next_seq": 0, "segments": [], "tombstones": {}}
+
+    def _write_manifest(self, manifest: dict) -> None:
+        temp_path = f"{self._manifest_path}.{uuid4().hex}"
+        with open(temp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self._manifest_path)
+
+    @contextmanager
+    def _locked_manifest(self):
+        """Exclusive read-modify-write of the manifest, across threads and processes"""
+        with self._lock, open(os.path.join(self.base_path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._read_manifest()
+            yield manifest
+            self._write_manifest(manifest)
+
+    def _current(self) -> Tuple[Tuple[Segment, ...], Dict[int, int]]:
+        """Segments and tombstones of the manifest on disk, reloaded when it changed"""
+        try:
+            stat = os.stat(self._manifest_path)
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return (), {}
+        with self._lock:
+            if version != self._manifest_version:
+                manifest = self._read_manifest()
+                loaded = {segment.path: segment for segment in self._segments}
+                self._segments = tuple(
+                    loaded.get(os.path.join(self.base_path, entry["name"])) or
+                    Segment(os.path.join(self.base_path, entry["name"]), entry["seq"])
+                    for entry in manifest["segments"]
+                )
+                self._tombstones = {int(key): seq for key, seq in manifest["tombstones"].items()}
+                self._manifest_version = version
+            return self._segments, self._tombstones
+
+    def add(self, document_id: int, vectors: np.ndarray) -> None:
+        """Indexes the passages of a document, replacing any indexed before"""
+        name = f"segment-{uuid4().hex}"
+        passages = np.stack([np.full(len(vectors), document_id), np.arange(len(vectors))], axis=1)
+        Segment.write(os.path.join(self.base_path, name), vectors.astype(np.float32), passages)
+
+        with self._locked_manifest() as manifest:
+            seq = manifest["next_seq"]
+            manifest["next_seq"] = seq + 1
+            manifest["tombstones"][str(document_id)] = seq
+            manifest["segments"].append({"name": name, "seq": seq, "rows": len(vectors)})
+
+    def remove(self, document_ids: List[int]) -> None:
+        with self._locked_manifest() as manifest:
+            seq = manifest["next_seq"]
+            manifest["next_seq"] = seq + 1
+            for document_id in document_ids:
+                manifest["tombstones"][str(document_id)] = seq
+
+    def _is_live(self, tombstones: Dict[int, int], document_id: int, segment: Segment) -> bool:
+        return segment.seq >= tombstones.get(document_id, -1)
+
+    def _live_rows(self, tombstones: Dict[int, int], segment: Segment) -> np.ndarray:
+        document_ids, inverse = np.unique(segment.passages[:, 0], return_inverse=True)
+        hidden_before = np.array([tombstones.get(int(document_id), -1) for document_id in document_ids])
+        return segment.seq >= hidden_before[inverse]
+
+    def _pruned_tombstones(self, segments: List[dict], tombstones: Dict[str, int]) -> Dict[str, int]:
+        """The tombstones still hiding rows, of documents in a segment older than the tombstone"""
+        if not tombstones:
+            return {}
+        document_ids = np.array([int(key) for key in tombstones])
+        seqs = np.array(list(tombstones.values()))
+        needed = np.zeros(len(document_ids), dtype=bool)
+        for entry in segments:
+            documents = np.load(os.path.join(self.base_path, entry["name"], "documents.npy"))
+            needed |= (entry["seq"] < seqs) & np.isin(document_ids, documents)
+        return {key: seq for (key, seq), keep in zip(tombstones.items(), needed) if keep}
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> List[PassageHit]:
+        segments, tombstones = self._current()
+        nprobe = nprobe or self.nprobe
+        hits = []
+        for segment in segments:
+            # Over-fetched, some of the rows may be tombstoned
+            scores, rows = segment.search(query, k * 2, nprobe)
+            for score, (document_id, position) in zip(scores, segment.passages[rows]):
+                if self._is_live(tombstones, int(document_id), segment):
+                    hits.append(PassageHit(int(document_id), int(position), float(score)))
+        hits.sort(key=lambda hit: hit.score, reverse=True)
+        return hits[:k]
+
+    def merge(self) -> bool:
+        """
+            Combines the `merge_factor` smallest segments once there are more
+            than `max_segments`. The merged segment takes the highest sequence
+            number of its parts, so tombstones issued meanwhile still apply.
+            Tombstones left with nothing to hide are dropped, the manifest
+            only keeps those of rows still on disk.
+        """
+        manifest = self._read_manifest()
+        if len(manifest["segments"]) <= self.max_segments:
+            return False
+        parts = sorted(manifest["segments"], key=lambda entry: entry["rows"])[:self.merge_factor]
+        tombstones = {int(key): seq for key, seq in manifest["tombstones"].items()}
+
+        vectors, passages = [], []
+        for entry in parts:
+            segment = Segment(os.path.join(self.base_path, entry["name"]), entry["seq"])
+            live = self._live_rows(tombstones, segment)
+            vectors.append(segment.dense()[live])
+            passages.append(np.asarray(segment.passages)[live])
+        vectors, passages = np.concatenate(vectors), np.concatenate(passages)
+
+        merged = None
+        if len(vectors):
+            merged = {"name": f"segment-{uuid4().hex}", "seq": max(entry["seq"] for entry in parts), "rows": len(vectors)}
+            Segment.write(os.path.join(self.base_path, merged["name"]), vectors, passages)
+
+        names = {entry["name"] for entry in parts}
+        with self._locked_manifest() as manifest:
+            if not names <= {entry["name"] for entry in manifest["segments"]}:
+                # Merged by another process meanwhile
+                if merged:
+                    shutil.rmtree(os.path.join(self.base_path, merged["name"]), ignore_errors=True)
+                return False
+            manifest["segments"] = [entry for entry in manifest["segments"] if entry["name"] not in names]
+            if merged:
+                manifest["segments"].append(merged)
+            manifest["tombstones"] = self._pruned_tombstones(manifest["segments"], manifest["tombstones"])
+
+        # Open memory maps of searches in flight stay valid after the unlink
+        for name in names:
+            shutil.rmtree(os.path.join(self.base_path, name), ignore_errors=True)
+        return True
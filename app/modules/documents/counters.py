@@ -0,0 +1,33 @@
+from collections import Counter
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.modules.documents import crud
+
+class ViewCountBuffer:
+    """
+        Write-behind buffer for document views. Views are aggregated per
+        document in memory and written by `flush` as a single increment per
+        document, instead of a row update on every conversation start.
+    """
+    def __init__(self):
+        self._pending = Counter()
+
+    def add(self, document_id: int, count: int = 1):
+        self._pending[document_id] += count
+
+    def pending(self, document_id: int) -> int:
+        return self._pending[document_id]
+
+    async def flush(self, db: AsyncSession) -> int:
+        if not self._pending:
+            return 0
+
+        # Swapped before the first await, views added meanwhile go to the next batch
+        batch, self._pending = self._pending, Counter()
+        try:
+            await crud.add_views(db, dict(batch))
+        except Exception:
+            await db.rollback()
+            self._pending.update(batch)
+            raise
+        return sum(batch.values())
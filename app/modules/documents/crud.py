@@ -1,13 +1,57 @@
+import math
+from datetime import datetime
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import and_, desc, func, select, delete, update
-from typing import List, Optional
+from sqlalchemy import DateTime, Float, and_, bindparam, case, desc, func, literal, or_, select, delete, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Dict, List, Optional
 
 from sqlalchemy.orm import aliased
 
-from app.common.exceptions import UserNotFoundException
+from app.common.constants import TrendingConstants
+from app.common.exceptions import DocumentVersionConflictException, UserNotFoundException
+from app.common.pagination import decode_cursor
 from app.modules.conversations.models import Conversation
-from app.modules.documents.models import Document, DocumentStar
+from app.modules.documents.models import Document, DocumentStar, IngestionJob, IngestionStatus, DocumentTrending, StorageCodec, \
+        UploadSession, UserDocumentStats
+
+# Sort keys of the public feeds, the document id breaks ties in all of them
+EXPLORE_FEED_ORDER = Document.views
+TRENDING_FEED_ORDER = DocumentTrending.score
+LATEST_FEED_ORDER = Document.uploaded_at
+
+
+def _paginate(query, sort_column, limit: int, offset: int, cursor: Optional[str] = None,
+              tie_breaker=Document.id):
+    """
+        Orders `query` by `sort_column` descending and pages it by keyset
+        when a cursor is given (so deep pages cost the same as the first
+        one), falling back to the legacy offset otherwise
+    """
+    if cursor:
+        if isinstance(sort_column.type, DateTime):
+            sort_type = datetime
+        elif isinstance(sort_column.type, Float):
+            sort_type = float
+        else:
+            sort_type = int
+        sort_value, document_id = decode_cursor(cursor, sort_type)
+        query = query.where(
+            or_(
+                sort_column < sort_value,
+                and_(sort_column == sort_value, tie_breaker < document_id)
+            )
+        )
+        offset = 0
+
+    return (
+        query
+        .order_by(desc(sort_column), desc(tie_breaker))
+        .offset(offset)
+        .limit(limit)
+    )
+
 
 async def create_document(
     db: AsyncSession,
@@ -16,7 +60,10 @@ async def create_document(
     title: str,
     file_path: str,
     version: int,
-    is_private: bool
+    is_private: bool,
+    checksum: Optional[str] = None,
+    size_bytes: Optional[int] = None,
+    ingestion_status: str = IngestionStatus.PENDING.name
 ) -> Document:
     document = Document(
         user=user,
@@ -24,46 +71,207 @@ async def create_document(
         title=title,
         file_path=file_path,
         version=version,
-        is_private_document=is_private
+        is_private_document=is_private,
+        checksum=checksum,
+        size_bytes=size_bytes,
+        ingestion_status=ingestion_status
     )
     db.add(document)
+    if ingestion_status == IngestionStatus.PENDING.name:
+        db.add(IngestionJob(document=document))
     await db.commit()
     await db.refresh(document)
     return document
 
 
-async def invalidate_document(db: AsyncSession, document_id: int) -> Optional[Document]:
+async def create_document_version(
+    db: AsyncSession,
+    previous: Document,
+    user,
+    title: str,
+    file_path: str,
+    is_private: bool,
+    checksum: Optional[str] = None,
+    size_bytes: Optional[int] = None,
+    ingestion_status: str = IngestionStatus.PENDING.name
+) -> Document:
+    """
+        Retires the active version of a document key and inserts its
+        successor in one transaction. The partial unique index on active
+        keys turns a concurrent reupload of the same key into a conflict
+        instead of two active heads.
+    """
+    # A rollback expires `previous`, read everything needed up front
+    previous_id, document_key, version = previous.id, previous.document_key, previous.version
+    try:
+        retired = await db.execute(
+            update(Document)
+            .where(Document.id == previous_id, Document.is_active == True)
+            .values(is_active=False)
+        )
+        if retired.rowcount != 1:
+            await db.rollback()
+            raise DocumentVersionConflictException(document_key)
+
+        await db.execute(
+            update(Conversation)
+            .where(Conversation.document_id == previous_id)
+            .values(document_id=None)
+        )
+        # A retired version that was not ingested yet is not worth ingesting anymore
+        await _terminate_ingestion(db, [previous_id], [IngestionStatus.PENDING.name])
+        document = Document(
+            user=user,
+            document_key=document_key,
+            title=title,
+            file_path=file_path,
+            version=version + 1,
+            is_private_document=is_private,
+            checksum=checksum,
+            size_bytes=size_bytes,
+            ingestion_status=ingestion_status
+        )
+        db.add(document)
+        if ingestion_status == IngestionStatus.PENDING.name:
+            db.add(IngestionJob(document=document))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise DocumentVersionConflictException(document_key)
+
+    await db.refresh(document)
+    return document
+
+
+async def get_document_by_key(db: AsyncSession, doc_key: str) -> Optional[Document]:
+    result = await db.execute(
+        select(Document).where(
+            and_(
+                Document.document_key == doc_key,
+                Document.is_active == True
+            ))
+        )
+    return result.scalars().first()
+
+
+async def get_document_files(db: AsyncSession, doc_key: str):
+    """Id, file and checksum of every version of a document, active or not"""
+    result = await db.execute(
+        select(Document.id, Document.file_path, Document.checksum).where(Document.document_key == doc_key))
+    return result.all()
+
+
+async def get_referenced_checksums(db: AsyncSession, checksums: List[str]) -> set:
+    """The checksums in `checksums` some document version still has"""
+    result = await db.execute(select(Document.checksum).where(Document.checksum.in_(checksums)).distinct())
+    return set(result.scalars().all())
+
+
+async def is_content_ingested(db: AsyncSession, checksum: str) -> bool:
+    result = await db.execute(
+        select(Document.id)
+        .where(
+            Document.checksum == checksum,
+            Document.ingestion_status == IngestionStatus.COMPLETED.name
+        )
+        .limit(1)
+    )
+    return result.scalar() is not None
+
+
+async def get_cold_documents(db: AsyncSession, accessed_before: datetime, limit: int) -> List[Document]:
+    """Uncompressed versions, active or not, whose file was last read before `accessed_before`"""
+    result = await db.execute(
+        select(Document)
+        .where(
+            Document.storage_codec == StorageCodec.IDENTITY.name,
+            Document.last_accessed_at < accessed_before
+        )
+        .order_by(Document.last_accessed_at)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def set_document_storage(db: AsyncSession, document_id: int, file_path: str, codec: str) -> None:
     await db.execute(
         update(Document)
         .where(Document.id == document_id)
-        .values(is_active=False)
+        .values(file_path=file_path, storage_codec=codec)
     )
     await db.commit()
 
-async def invalidate_conversations(db: AsyncSession, document_id: int) -> Optional[Document]:
+
+async def touch_documents(db: AsyncSession, document_ids: List[int]) -> None:
+    if not document_ids:
+        return
     await db.execute(
-        update(Conversation)
-        .where(Conversation.document_id == document_id)
-        .values(document_id=None)
+        update(Document)
+        .where(Document.id.in_(document_ids))
+        .values(last_accessed_at=datetime.now())
     )
     await db.commit()
 
-async def get_document_by_key(db: AsyncSession, doc_key: str) -> Optional[Document]:
+
+async def get_documents_by_keys(db: AsyncSession, doc_keys: List[str], user_id: int) -> List[Document]:
+    # Same access rule as a single lookup: private documents only for their owner
     result = await db.execute(
         select(Document).where(
-            and_(
-                Document.document_key == doc_key,
-                Document.is_active == True
-            ))
+            Document.document_key.in_(doc_keys),
+            Document.is_active == True,
+            or_(Document.is_private_document == False, Document.user_id == user_id)
         )
-    return result.scalars().first()
+    )
+    documents = result.scalars().all()
+
+    starred_ids = await get_starred_document_ids(db, user_id, [doc.id for doc in documents])
+    for doc in documents:
+        setattr(doc, "total_stars", doc.star_count)
+        setattr(doc, "user_starred", doc.id in starred_ids)
+
+    return documents
+
+
+async def get_public_documents_by_ids(db: AsyncSession, document_ids: List[int]) -> List[Document]:
+    if not document_ids:
+        return []
+    result = await db.execute(
+        select(Document).where(
+            Document.id.in_(document_ids),
+            Document.is_active == True,
+            Document.is_private_document == False
+        )
+    )
+    by_id = {doc.id: doc for doc in result.scalars().all()}
+
+    documents = [by_id[doc_id] for doc_id in document_ids if doc_id in by_id]
+    for doc in documents:
+        setattr(doc, "total_stars", doc.star_count)
+    return documents
 
 
 async def delete_document(db: AsyncSession, doc_key: str) -> None:
+    await db.execute(
+        delete(IngestionJob)
+        .where(IngestionJob.document_id.in_(select(Document.id).where(Document.document_key == doc_key)))
+    )
     await db.execute(delete(Document).where(Document.document_key == doc_key))
     await db.commit()
 
 
+async def get_starred_document_ids(db: AsyncSession, user_id: Optional[int], document_ids: List[int]) -> set:
+    if not user_id or not document_ids:
+        return set()
+    result = await db.execute(
+        select(DocumentStar.document_id)
+        .where(
+            DocumentStar.user_id == user_id,
+            DocumentStar.document_id.in_(document_ids)
+        )
+    )
+    return set(result.scalars().all())
+
+
 async def get_user_documents(db: AsyncSession, user_id: int) -> List[Document]:
     result = await db.execute(
         select(Document)
@@ -80,111 +288,133 @@ async def get_user_documents(db: AsyncSession, user_id: int) -> List[Document]:
 
     doc_ids = [doc.id for doc in documents]
 
-    star_counts_result = await db.execute(
-        select(
-            DocumentStar.document_id,
-            func.count(DocumentStar.user_id).label("total_stars")
-        )
-        .where(DocumentStar.document_id.in_(doc_ids))
-        .group_by(DocumentStar.document_id)
-    )
-    star_counts = {row.document_id: row.total_stars for row in star_counts_result}
-
     # Fetch whether user starred these docs
-    user_starred_result = await db.execute(
-        select(DocumentStar.document_id)
-        .where(
-            DocumentStar.user_id == user_id,
-            DocumentStar.document_id.in_(doc_ids)
-        )
-    )
-    user_starred_ids = set(user_starred_result.scalars().all())
+    user_starred_ids = await get_starred_document_ids(db, user_id, doc_ids)
 
     for doc in documents:
-        setattr(doc, "total_stars", star_counts.get(doc.id, 0))
+        setattr(doc, "total_stars", doc.star_count)
         setattr(doc, "user_starred", doc.id in user_starred_ids)
 
     return documents
 
-async def add_views(db: AsyncSession, document_id: int) -> None:
-    result = await db.execute(select(Document).where(Document.id == document_id))
-    document = result.scalar_one_or_none()
+async def add_views(db: AsyncSession, view_counts: Dict[int, int]) -> None:
+    """
+        Applies buffered view counts as one atomic increment per document,
+        so concurrent writers never read-modify-write the same row
+    """
+    if not view_counts:
+        return
+    params = [{"_document_id": doc_id, "_views": count} for doc_id, count in view_counts.items()]
 
-    if document is None:
-        raise ValueError("Document not found")
+    documents = Document.__table__
+    await db.execute(
+        documents.update()
+        .where(documents.c.id == bindparam("_document_id"))
+        .values(views=documents.c.views + bindparam("_views")),
+        params
+    )
 
-    document.views += 1
-    await db.flush()
+    rollups = UserDocumentStats.__table__
+    owner = (
+        select(documents.c.user_id)
+        .where(documents.c.id == bindparam("_document_id"), documents.c.is_active == True)
+        .scalar_subquery()
+    )
+    await db.execute(
+        rollups.update()
+        .where(rollups.c.user_id == owner)
+        .values(total_views=rollups.c.total_views + bindparam("_views")),
+        params
+    )
     await db.commit()
 
 
-async def get_document_stats(db: AsyncSession, user_id: int):
-    total_count_stmt = select(func.count()).select_from(Document).where(
-        and_(
-            Document.user_id == user_id,
-            Document.is_active == True
+async def compute_document_stats(db: AsyncSession, user_id: int) -> dict:
+    is_active = Document.is_active == True
+    result = await db.execute(
+        select(
+            func.count(case((is_active, 1))).label("total_documents"),
+            func.count(case((and_(is_active, Document.is_private_document == True), 1))).label("private_documents"),
+            func.coalesce(func.sum(case((is_active, Document.views), else_=0)), 0).label("total_views"),
+            func.coalesce(func.sum(case((is_active, Document.star_count), else_=0)), 0).label("total_stars"),
+            func.count(case((Document.is_active == False, 1))).label("total_revisions"),
         )
+        .where(Document.user_id == user_id)
     )
-    total_count_result = await db.execute(total_count_stmt)
-    total_documents = total_count_result.scalar_one()
+    return {"user_id": user_id, **result.one()._asdict()}
 
-    private_count_stmt = select(func.count()).select_from(Document).where(
-        and_(
-            Document.user_id == user_id,
-            Document.is_active == True,
-            Document.is_private_document == True
-        )
-    )
-    private_count_result = await db.execute(private_count_stmt)
-    private_documents = private_count_result.scalar_one()
 
-    total_views_stmt = select(func.coalesce(func.sum(Document.views), 0)).where(
-        and_(
-            Document.user_id == user_id,
-            Document.is_active == True
-        )
-    )
-    total_views_result = await db.execute(total_views_stmt)
-    total_views = total_views_result.scalar_one()
+def _stats_as_dict(stats: UserDocumentStats) -> dict:
+    return {
+        "user_id": stats.user_id,
+        "total_documents": stats.total_documents,
+        "private_documents": stats.private_documents,
+        "total_views": stats.total_views,
+        "total_stars": stats.total_stars,
+        "total_revisions": stats.total_revisions,
+    }
 
-    total_stars_stmt = select(func.count()).select_from(
-        DocumentStar
-    ).join(Document).where(
-        and_(
-            Document.user_id == user_id,
+
+async def refresh_user_document_stats(db: AsyncSession, user_id: int) -> dict:
+    stats = await compute_document_stats(db, user_id)
+    rollup = await db.get(UserDocumentStats, user_id)
+    if rollup is None:
+        rollup = UserDocumentStats(user_id=user_id)
+        db.add(rollup)
+    for field, value in stats.items():
+        setattr(rollup, field, value)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request created the rollup first, it holds the same numbers
+        await db.rollback()
+    return stats
+
+
+async def get_document_stats(db: AsyncSession, user_id: int) -> dict:
+    rollup = await db.get(UserDocumentStats, user_id, populate_existing=True)
+    if rollup is None:
+        return await refresh_user_document_stats(db, user_id)
+    return _stats_as_dict(rollup)
+
+
+def _owner_stats_delta(document_ids, **deltas):
+    """
+        UPDATE applying `deltas` to the rollups of the owners of the given
+        active documents, meant to run inside the caller's transaction.
+        Owners without a rollup row are skipped, theirs is computed on read.
+    """
+    owned_count = (
+        select(func.count(Document.id))
+        .where(
+            Document.id.in_(document_ids),
+            Document.user_id == UserDocumentStats.user_id,
             Document.is_active == True
         )
+        .correlate(UserDocumentStats)
+        .scalar_subquery()
     )
-    total_stars = (await db.execute(total_stars_stmt)).scalar_one()
-
-    total_revisions_stmt = select(func.count()).select_from(Document).where(
-        and_(
-            Document.user_id == user_id,
-            Document.is_active == False
-        )
+    owners = select(Document.user_id).where(Document.id.in_(document_ids), Document.is_active == True)
+    return (
+        update(UserDocumentStats)
+        .where(UserDocumentStats.user_id.in_(owners))
+        .values({
+            getattr(UserDocumentStats, field): getattr(UserDocumentStats, field) + owned_count * delta
+            for field, delta in deltas.items()
+        })
+        .execution_options(synchronize_session=False)
     )
-    total_revisions_result = await db.execute(total_revisions_stmt)
-    total_revisions = total_revisions_result.scalar_one()
 
-    return {
-        "user_id": user_id,
-        "total_documents": total_documents,
-        "private_documents": private_documents,
-        "total_views": total_views,
-        "total_stars": total_stars,
-        "total_revisions": total_revisions,
-    }
 
-async def fetch_explore_documents(db: AsyncSession, user_id: Optional[int], limit: int, offset: int):
-    document_query = (
+async def fetch_explore_documents(
+        db: AsyncSession, user_id: Optional[int], limit: int, offset: int, cursor: Optional[str] = None):
+    document_query = _paginate(
         select(Document)
         .where(
             Document.is_active == True,
             Document.is_private_document == False
-        )
-        .order_by(desc(Document.views))
-        .offset(offset)
-        .limit(limit)
+        ),
+        EXPLORE_FEED_ORDER, limit, offset, cursor
     )
 
     result = await db.execute(document_query)
@@ -195,177 +425,495 @@ async def fetch_explore_documents(db: AsyncSession, user_id: Optional[int], limi
 
     doc_ids = [doc.id for doc in documents]
 
-    starred_ids = set()
-    if user_id:
-        star_result = await db.execute(
-            select(DocumentStar.document_id)
-            .where(
-                DocumentStar.user_id == user_id,
-                DocumentStar.document_id.in_(doc_ids)
-            )
-        )
-        starred_ids = set(star_result.scalars().all())
-
-    total_stars_result = await db.execute(
-        select(DocumentStar.document_id, func.count(DocumentStar.user_id).label("stars_count"))
-        .where(DocumentStar.document_id.in_(doc_ids))
-        .group_by(DocumentStar.document_id)
-    )
-    stars_count_map = {doc_id: count for doc_id, count in total_stars_result.all()}
+    starred_ids = await get_starred_document_ids(db, user_id, doc_ids)
 
     for doc in documents:
         setattr(doc, "user_starred", doc.id in starred_ids)
-        setattr(doc, "total_stars", stars_count_map.get(doc.id, 0))
+        setattr(doc, "total_stars", doc.star_count)
 
     return documents
 
 
-async def fetch_trending_documents(db: AsyncSession, user_id: int, limit: int, offset: int):
-    star_counts_subq = (
-        select(
-            DocumentStar.document_id,
-            func.count(DocumentStar.user_id).label("star_count")
-        )
-        .group_by(DocumentStar.document_id)
-        .order_by(desc("star_count"))
-        .limit(limit)
-        .offset(offset)
-        .subquery()
-    )
-
-    documents_stmt = (
-        select(Document, star_counts_subq.c.star_count)
-        .join(star_counts_subq, Document.id == star_counts_subq.c.document_id)
-        .order_by(desc(star_counts_subq.c.star_count))
+async def fetch_trending_documents(
+        db: AsyncSession, user_id: int, limit: int, offset: int, cursor: Optional[str] = None):
+    documents_stmt = _paginate(
+        select(Document, DocumentTrending.score)
+        .join(DocumentTrending, DocumentTrending.document_id == Document.id)
+        .where(
+            DocumentTrending.score.is_not(None),
+            Document.is_active == True,
+            Document.is_private_document == False
+        ),
+        TRENDING_FEED_ORDER, limit, offset, cursor,
+        tie_breaker=DocumentTrending.document_id
     )
 
     result = await db.execute(documents_stmt)
     rows = result.all()
 
     documents = []
-    doc_ids = []
-    star_map = {}
-
-    for doc, star_count in rows:
-        doc.total_stars = star_count or 0
+    for doc, score in rows:
+        doc.score = score
         documents.append(doc)
-        doc_ids.append(doc.id)
-        star_map[doc.id] = doc.total_stars
+    doc_ids = [doc.id for doc in documents]
 
-    if user_id and doc_ids:
-        user_starred_stmt = (
-            select(DocumentStar.document_id)
-            .where(
-                DocumentStar.user_id == user_id,
-                DocumentStar.document_id.in_(doc_ids)
-            )
-        )
-        user_starred_result = await db.execute(user_starred_stmt)
-        starred_doc_ids = {row[0] for row in user_starred_result.fetchall()}
-    else:
-        starred_doc_ids = set()
+    starred_doc_ids = await get_starred_document_ids(db, user_id, doc_ids)
 
     for doc in documents:
         doc.user_starred = doc.id in starred_doc_ids
-        doc.total_stars = star_map.get(doc.id, 0)
+        doc.total_stars = doc.star_count
 
     return documents
 
 
-async def fetch_latest_documents(db: AsyncSession, user_id: Optional[int], limit: int, offset: int):
-    latest_version_subq = (
+def trending_exponent(at: datetime, half_life_hours: float) -> float:
+    """Half-lives elapsed between the trending epoch and `at`"""
+    return (at - TrendingConstants.EPOCH).total_seconds() / 3600 / half_life_hours
+
+
+def decayed_trending_score(score: Optional[float], half_life_hours: float, now: datetime) -> float:
+    """The activity a stored trending score stands for, decayed to `now`"""
+    if score is None:
+        return 0.0
+    return 2 ** (score - trending_exponent(now, half_life_hours))
+
+
+async def refresh_trending_scores(
+        db: AsyncSession,
+        half_life_hours: float,
+        star_weight: float,
+        view_weight: float,
+        now: Optional[datetime] = None
+    ) -> int:
+    """
+        Adds the stars and views each public document gained since the
+        previous refresh to its trending score. Scores are anchored to
+        `TrendingConstants.EPOCH`, activity at time t weighing 2^(t / half
+        life), so they all decay at the same rate without being rewritten
+        and the order of the feed holds as time passes. They are stored as
+        log2 of that, which never overflows. Only the documents with new
+        activity, or no longer public, are written. Returns the number of
+        documents that were rescored.
+    """
+    now = now or datetime.now()
+    exponent = trending_exponent(now, half_life_hours)
+
+    # Scores of documents that went private, were replaced or deleted are dropped
+    public_documents = select(Document.id).where(
+        Document.is_active == True,
+        Document.is_private_document == False
+    )
+    await db.execute(
+        delete(DocumentTrending)
+        .where(DocumentTrending.document_id.not_in(public_documents))
+        .execution_options(synchronize_session=False)
+    )
+
+    changed = await db.execute(
         select(
-            Document.document_key,
-            func.max(Document.version).label("latest_version")
+            Document.id, Document.star_count, Document.views,
+            DocumentTrending.star_count, DocumentTrending.views, DocumentTrending.score,
+            DocumentTrending.document_id
+        )
+        .join(DocumentTrending, DocumentTrending.document_id == Document.id, isouter=True)
+        .where(
+            Document.is_active == True,
+            Document.is_private_document == False,
+            or_(
+                DocumentTrending.document_id.is_(None),
+                DocumentTrending.star_count != Document.star_count,
+                DocumentTrending.views != Document.views
+            )
         )
-        .where(Document.is_private_document == False)
-        .group_by(Document.document_key)
-        .subquery()
     )
 
-    documents_query = (
-        select(Document)
-        .join(
-            latest_version_subq,
-            (Document.document_key == latest_version_subq.c.document_key) &
-            (Document.version == latest_version_subq.c.latest_version)
+    new_rows, updated_rows = [], []
+    for document_id, stars, views, last_stars, last_views, score, tracked in changed.all():
+        activity = star_weight * (stars - (last_stars or 0)) + view_weight * (views - (last_views or 0))
+        value = (2 ** (score - exponent) if score is not None else 0.0) + activity
+        row = {
+            "document_id": document_id,
+            # Documents without positive activity have no score and are left out of the feed
+            "score": math.log2(value) + exponent if value > 0 else None,
+            "star_count": stars,
+            "views": views,
+            "refreshed_at": now,
+        }
+        (updated_rows if tracked is not None else new_rows).append(row)
+
+    if new_rows:
+        await db.execute(DocumentTrending.__table__.insert(), new_rows)
+    if updated_rows:
+        table = DocumentTrending.__table__
+        await db.execute(
+            table.update()
+            .where(table.c.document_id == bindparam("_document_id"))
+            .values(
+                score=bindparam("score"),
+                star_count=bindparam("star_count"),
+                views=bindparam("views"),
+                refreshed_at=bindparam("refreshed_at"),
+            ),
+            [{**row, "_document_id": row["document_id"]} for row in updated_rows]
         )
-        .order_by(desc(Document.uploaded_at))
-        .limit(limit)
-        .offset(offset)
+
+    await db.commit()
+    return len(new_rows) + len(updated_rows)
+
+
+async def fetch_latest_documents(
+        db: AsyncSession, user_id: Optional[int], limit: int, offset: int, cursor: Optional[str] = None):
+    # Every document key has exactly one active row, its latest version
+    documents_query = _paginate(
+        select(Document)
+        .where(
+            Document.is_active == True,
+            Document.is_private_document == False
+        ),
+        LATEST_FEED_ORDER, limit, offset, cursor
     )
 
     result = await db.execute(documents_query)
     documents = result.scalars().all()
     doc_ids = [doc.id for doc in documents]
 
-    starred_doc_ids = set()
-    if user_id and doc_ids:
-        starred_result = await db.execute(
-            select(DocumentStar.document_id)
-            .where(
-                DocumentStar.user_id == user_id,
-                DocumentStar.document_id.in_(doc_ids)
-            )
-        )
-        starred_doc_ids = set(row[0] for row in starred_result.all())
-
-    total_stars_map = {}
-    if doc_ids:
-        stars_result = await db.execute(
-            select(DocumentStar.document_id, func.count().label("count"))
-            .where(DocumentStar.document_id.in_(doc_ids))
-            .group_by(DocumentStar.document_id)
-        )
-        total_stars_map = {doc_id: count for doc_id, count in stars_result.all()}
+    starred_doc_ids = await get_starred_document_ids(db, user_id, doc_ids)
 
     for doc in documents:
         doc.user_starred = doc.id in starred_doc_ids
-        doc.total_stars = total_stars_map.get(doc.id, 0)
+        doc.total_stars = doc.star_count
 
     return documents
 
 
 async def get_document_stars_public(db: AsyncSession, document_id):
-    total_stars_stmt = select(func.count()).select_from(DocumentStar).where(Document.id == document_id)
-    total_stars_result = await db.execute(total_stars_stmt)
-    stars = total_stars_result.scalar_one()
+    result = await db.execute(select(Document.star_count).where(Document.id == document_id))
+    stars = result.scalar_one_or_none() or 0
     return {"star_count": stars}
 
 async def get_document_stars(db: AsyncSession, document_id, user_id):
-    total_stars = await db.execute(
-        select(DocumentStar).where(DocumentStar.document_id == document_id)
-    )
-    count = total_stars.scalars().all()
-    count = len(count)
+    total_stars = await db.execute(select(Document.star_count).where(Document.id == document_id))
+    count = total_stars.scalar_one_or_none() or 0
 
     user_star_q = await db.execute(
-        select(DocumentStar).where(DocumentStar.document_id == document_id, DocumentStar.user_id == user_id)
+        select(DocumentStar.id).where(DocumentStar.document_id == document_id, DocumentStar.user_id == user_id)
     )
-    user_star = user_star_q.scalars().first() is not None
+    user_star = user_star_q.first() is not None
 
     return {"total_stars": count, "user_starred": user_star}
 
 
+def _dialect_insert(db: AsyncSession):
+    # ON CONFLICT support lives in the dialect specific insert constructs
+    if db.bind.dialect.name == "postgresql":
+        return postgresql_insert
+    return sqlite_insert
+
+
+async def _bump_star_counts(db: AsyncSession, document_ids: List[int], delta: int) -> None:
+    if not document_ids:
+        return
+    await db.execute(
+        update(Document)
+        .where(Document.id.in_(document_ids))
+        .values(star_count=Document.star_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(_owner_stats_delta(document_ids, total_stars=delta))
+
+
+async def update_document_stars(
+        db: AsyncSession, user_id: int, star_ids: List[int], unstar_ids: List[int]) -> List[dict]:
+    """
+        Stars and unstars many documents for one user with a single
+        INSERT ... ON CONFLICT DO NOTHING and a single DELETE, then returns
+        the resulting star state of every named document the user can see,
+        active and public or their own
+    """
+    visible = and_(
+        Document.is_active == True,
+        or_(Document.is_private_document == False, Document.user_id == user_id)
+    )
+    stars = DocumentStar.__table__
+    if star_ids:
+        # Selecting from documents skips ids that do not exist or are hidden from the user
+        result = await db.execute(
+            _dialect_insert(db)(stars)
+            .from_select(
+                ["user_id", "document_id"],
+                select(literal(user_id), Document.id).where(Document.id.in_(star_ids), visible)
+            )
+            .on_conflict_do_nothing(index_elements=["user_id", "document_id"])
+            .returning(stars.c.document_id)
+        )
+        await _bump_star_counts(db, result.scalars().all(), 1)
+
+    if unstar_ids:
+        result = await db.execute(
+            delete(stars)
+            .where(stars.c.user_id == user_id, stars.c.document_id.in_(unstar_ids))
+            .returning(stars.c.document_id)
+        )
+        await _bump_star_counts(db, result.scalars().all(), -1)
+
+    await db.commit()
+
+    document_ids = list(set(star_ids) | set(unstar_ids))
+    if not document_ids:
+        return []
+    counts = await db.execute(
+        select(Document.id, Document.star_count).where(Document.id.in_(document_ids), visible)
+    )
+    starred_ids = await get_starred_document_ids(db, user_id, document_ids)
+    return [
+        {"document_id": doc_id, "user_starred": doc_id in starred_ids, "total_stars": star_count}
+        for doc_id, star_count in counts.all()
+    ]
+
+
 async def set_document_stars(db: AsyncSession, document_id: int, user_id: int):
-    try:
-        star = DocumentStar(user_id=user_id, document_id=document_id)
-        db.add(star)
-        await db.commit()
-    except IntegrityError:
-        await db.rollback()
+    await update_document_stars(db, user_id, [document_id], [])
     return {"message": "Star added (if not already starred)"}
 
 
 async def delete_document_stars(db: AsyncSession, document_id: int, user_id: int):
-    try:
+    await update_document_stars(db, user_id, [], [document_id])
+    return {"message": "Star removed (if present)"}
+
+
+async def reconcile_star_counts(db: AsyncSession) -> int:
+    """
+        Repairs `Document.star_count` wherever it drifted from the actual
+        number of DocumentStar rows (e.g. stars removed by a user cascade
+        delete). Returns the number of documents that were corrected.
+    """
+    actual_count = (
+        select(func.count(DocumentStar.id))
+        .where(DocumentStar.document_id == Document.id)
+        .correlate(Document)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(Document)
+        .where(Document.star_count != actual_count)
+        .values(star_count=actual_count)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        # Star totals in the rollups are stale now, they get recomputed on next read
+        await db.execute(delete(UserDocumentStats))
+    await db.commit()
+    return result.rowcount
+
+
+async def create_upload_session(
+    db: AsyncSession,
+    upload_id: str,
+    user_id: int,
+    title: str,
+    is_private: bool,
+    total_bytes: int,
+    expires_at: datetime,
+    document_key: Optional[str] = None
+) -> UploadSession:
+    upload = UploadSession(
+        id=upload_id,
+        user_id=user_id,
+        title=title,
+        is_private_document=is_private,
+        document_key=document_key,
+        total_bytes=total_bytes,
+        expires_at=expires_at
+    )
+    db.add(upload)
+    await db.commit()
+    await db.refresh(upload)
+    return upload
+
+
+async def get_upload_session(db: AsyncSession, upload_id: str, user_id: int) -> Optional[UploadSession]:
+    result = await db.execute(
+        select(UploadSession).where(
+            UploadSession.id == upload_id,
+            UploadSession.user_id == user_id,
+            UploadSession.expires_at > datetime.now()
+        )
+    )
+    return result.scalars().first()
+
+
+async def count_upload_sessions(db: AsyncSession, user_id: int) -> int:
+    result = await db.execute(
+        select(func.count(UploadSession.id)).where(
+            UploadSession.user_id == user_id,
+            UploadSession.expires_at > datetime.now()
+        )
+    )
+    return result.scalar()
+
+
+async def advance_upload_session(
+        db: AsyncSession, upload_id: str, offset: int, received_bytes: int, expires_at: datetime) -> bool:
+    """
+        Moves the session from `offset` to `received_bytes`. False when
+        another request got there first or the upload is being completed.
+    """
+    result = await db.execute(
+        update(UploadSession)
+        .where(
+            UploadSession.id == upload_id,
+            UploadSession.received_bytes == offset,
+            UploadSession.is_completing == False
+        )
+        .values(received_bytes=received_bytes, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def set_upload_session_completing(
+        db: AsyncSession, upload_id: str, completing: bool, expires_at: datetime) -> bool:
+    """Claims (or releases) a fully received upload for the request assembling it"""
+    result = await db.execute(
+        update(UploadSession)
+        .where(
+            UploadSession.id == upload_id,
+            UploadSession.received_bytes == UploadSession.total_bytes,
+            UploadSession.is_completing == (not completing)
+        )
+        .values(is_completing=completing, expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def delete_upload_session(db: AsyncSession, upload_id: str) -> None:
+    await db.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+    await db.commit()
+
+
+async def delete_expired_upload_sessions(db: AsyncSession, limit: int) -> List[str]:
+    """Removes up to `limit` expired sessions and returns their ids, for their chunks to be deleted"""
+    result = await db.execute(
+        select(UploadSession.id)
+        .where(UploadSession.expires_at <= datetime.now())
+        .limit(limit)
+    )
+    upload_ids = result.scalars().all()
+    if upload_ids:
+        await db.execute(delete(UploadSession).where(UploadSession.id.in_(upload_ids)))
+        await db.commit()
+    return upload_ids
+
+
+async def _set_ingestion_status(db: AsyncSession, document_id: int, status: str) -> None:
+    await db.execute(
+        update(Document)
+        .where(Document.id == document_id)
+        .values(ingestion_status=status)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _terminate_ingestion(db: AsyncSession, document_ids: List[int], statuses: List[str]) -> List[int]:
+    """Terminates the jobs of `document_ids` still in one of `statuses`, returns the documents affected"""
+    result = await db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.document_id.in_(document_ids), IngestionJob.status.in_(statuses))
+        .values(status=IngestionStatus.TERMINATED.name)
+        .returning(IngestionJob.document_id)
+    )
+    terminated = result.scalars().all()
+    if terminated:
         await db.execute(
-            delete(DocumentStar).where(
-                DocumentStar.user_id == user_id,
-                DocumentStar.document_id == document_id
+            update(Document)
+            .where(Document.id.in_(terminated))
+            .values(ingestion_status=IngestionStatus.TERMINATED.name)
+            .execution_options(synchronize_session=False)
+        )
+    return terminated
+
+
+async def claim_ingestion_jobs(db: AsyncSession, limit: int, lease_until: datetime) -> List[IngestionJob]:
+    """
+        Takes up to `limit` due jobs, including the ones whose lease ran out,
+        and holds them until `lease_until`. Each claim only succeeds if the
+        job is still as it was read, so concurrent workers never share one.
+    """
+    now = datetime.now()
+    result = await db.execute(
+        select(IngestionJob.id, IngestionJob.status, IngestionJob.attempts)
+        .where(
+            IngestionJob.status.in_([IngestionStatus.PENDING.name, IngestionStatus.IN_PROGRESS.name]),
+            IngestionJob.available_at <= now
+        )
+        .order_by(IngestionJob.available_at)
+        .limit(limit)
+    )
+
+    claimed = []
+    for job_id, status, attempts in result.all():
+        # Every claim counts an attempt, which makes it the version of the job
+        claim = await db.execute(
+            update(IngestionJob)
+            .where(
+                IngestionJob.id == job_id,
+                IngestionJob.status == status,
+                IngestionJob.attempts == attempts
+            )
+            .values(
+                status=IngestionStatus.IN_PROGRESS.name,
+                attempts=IngestionJob.attempts + 1,
+                available_at=lease_until
             )
+            .returning(IngestionJob.id, IngestionJob.document_id, IngestionJob.attempts)
         )
-        await db.commit()
-    except Exception:
-        await db.rollback()
-    return {"message": "Star removed (if present)"}
+        job = claim.first()
+        if job:
+            await _set_ingestion_status(db, job.document_id, IngestionStatus.IN_PROGRESS.name)
+            claimed.append(job)
+    await db.commit()
+    return claimed
+
+
+async def finish_ingestion_job(
+        db: AsyncSession, job_id: int, document_id: int, status: str, error: Optional[str] = None) -> bool:
+    """Records the outcome of a claimed job. False if it was cancelled meanwhile."""
+    result = await db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == job_id, IngestionJob.status == IngestionStatus.IN_PROGRESS.name)
+        .values(status=status, last_error=error)
+    )
+    if result.rowcount == 1:
+        await _set_ingestion_status(db, document_id, status)
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def retry_ingestion_job(
+        db: AsyncSession, job_id: int, document_id: int, available_at: datetime, error: str) -> bool:
+    result = await db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == job_id, IngestionJob.status == IngestionStatus.IN_PROGRESS.name)
+        .values(status=IngestionStatus.PENDING.name, available_at=available_at, last_error=error)
+    )
+    if result.rowcount == 1:
+        await _set_ingestion_status(db, document_id, IngestionStatus.PENDING.name)
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def get_ingestion_statuses(db: AsyncSession, document_ids: List[int]) -> Dict[int, str]:
+    """Ingestion status of every document of `document_ids` that still exists"""
+    result = await db.execute(
+        select(Document.id, Document.ingestion_status).where(Document.id.in_(document_ids)))
+    return dict(result.all())
+
+
+async def cancel_ingestion_job(db: AsyncSession, document_id: int) -> bool:
+    terminated = await _terminate_ingestion(
+        db, [document_id], [IngestionStatus.PENDING.name, IngestionStatus.IN_PROGRESS.name])
+    await db.commit()
+    return bool(terminated)
@@ -0,0 +1,75 @@
+import struct
+import zlib
+from itertools import accumulate
+
+# A delta is a zlib compressed sequence of operations rebuilding the target
+# from the base: COPY(offset, length) of base bytes or INSERT(length) of the
+# literal bytes that follow the operation
+_COPY, _INSERT = 0, 1
+_OPERATION = struct.Struct(">BQQ")
+
+# Copying a short line that does not continue the previous copy costs more
+# than inserting it
+MIN_COPY_BYTES = 24
+
+def encode_delta(base: bytes, target: bytes) -> bytes:
+    """
+        Line anchored delta of `target` against `base`, suited to the text
+        documents that get revised (scripts, papers). Binary content without
+        line breaks degrades to a compressed full copy.
+    """
+    base_lines = base.splitlines(keepends=True)
+    line_offsets = list(accumulate(map(len, base_lines), initial=0))
+    first_seen = {}
+    for index, line in enumerate(base_lines):
+        first_seen.setdefault(line, index)
+
+    operations = bytearray()
+    inserted = bytearray()
+    copy_start = copy_end = None
+    next_line = None  # base line following the current copy
+
+    def flush_copy():
+        if copy_start is not None:
+            operations.extend(_OPERATION.pack(_COPY, copy_start, copy_end - copy_start))
+
+    def flush_insert():
+        if inserted:
+            operations.extend(_OPERATION.pack(_INSERT, len(inserted), 0))
+            operations.extend(inserted)
+            inserted.clear()
+
+    for line in target.splitlines(keepends=True):
+        if next_line is not None and next_line < len(base_lines) and base_lines[next_line] == line:
+            copy_end = line_offsets[next_line + 1]
+            next_line += 1
+            continue
+
+        index = first_seen.get(line)
+        if index is not None and len(line) >= MIN_COPY_BYTES:
+            flush_copy()
+            flush_insert()
+            copy_start, copy_end, next_line = line_offsets[index], line_offsets[index + 1], index + 1
+        else:
+            flush_copy()
+            copy_start = copy_end = next_line = None
+            inserted.extend(line)
+
+    flush_copy()
+    flush_insert()
+    return zlib.compress(bytes(operations), 6)
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    operations = memoryview(zlib.decompress(delta))
+    base = memoryview(base)
+    target = bytearray()
+    position = 0
+    while position < len(operations):
+        operation, first, second = _OPERATION.unpack_from(operations, position)
+        position += _OPERATION.size
+        if operation == _COPY:
+            target.extend(base[first:first + second])
+        else:
+            target.extend(operations[position:position + first])
+            position += first
+    return bytes(target)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Optional
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+
+from app.config import settings
+from app.modules.documents.models import Document, StorageCodec
+from app.modules.documents.storage import Storage
+
+# One range of bytes, `start-end`, `start-` or `-suffix`
+SINGLE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+        FileResponse that hands the file to the server when it supports the
+        ASGI zero-copy send extension, so the kernel copies the bytes
+        (sendfile) instead of the worker. Only whole files and single
+        ranges are sent that way. HEAD requests, several ranges, invalid
+        ones and servers without the extension (uvicorn) get the regular
+        FileResponse with its chunked reads.
+    """
+    async def __call__(self, scope, receive, send):
+        if "http.response.zerocopysend" not in scope.get("extensions", {}) or scope["method"].upper() == "HEAD":
+            return await super().__call__(scope, receive, send)
+
+        stat_result = self.stat_result or await asyncio.to_thread(os.stat, self.path)
+        self.set_stat_headers(stat_result)
+        file_size = stat_result.st_size
+        status, start, end = self.status_code, 0, file_size
+
+        request_headers = Headers(scope=scope)
+        http_range = request_headers.get("range")
+        http_if_range = request_headers.get("if-range")
+        if http_range is not None and http_if_range in (None, self.headers["last-modified"], self.headers["etag"]):
+            match = SINGLE_RANGE.fullmatch(http_range.strip())
+            if match and any(match.groups()):
+                first, last = match.groups()
+                start = int(first) if first else file_size - int(last)
+                end = int(last) + 1 if first and last and int(last) < file_size else file_size
+            if not match or not any(match.groups()) or not 0 <= start < end:
+                # FileResponse answers these, with 400 or 416 when they are invalid
+                self.stat_result = stat_result
+                return await super().__call__(scope, receive, send)
+            status = 206
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+            self.headers["content-length"] = str(end - start)
+
+        file = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+            await send({
+                "type": "http.response.zerocopysend", "file": file,
+                "offset": start, "count": end - start, "more_body": False,
+            })
+        finally:
+            file.close()
+        if self.background is not None:
+            await self.background()
+
+
+def _is_not_modified(request_headers: Headers, etag: Optional[str], last_modified: int) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # Takes precedence over If-Modified-Since, compared weakly
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or (etag is not None and etag in tags)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return last_modified <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def document_download_response(
+        storage: Storage, document: Document, request_headers: Headers, public: bool) -> Response:
+    """
+        Sends the stored file of `document`: a redirect to a presigned URL
+        when the backend has one, the file from disk when it is stored as
+        is, or a stream through the backend otherwise, decompressing cold
+        files on the way. A stored version never changes, so its checksum
+        is the ETag.
+    """
+    last_modified = int(document.uploaded_at.timestamp())
+    etag = f'"{document.checksum}"' if document.checksum else None
+    headers = {
+        "Cache-Control": "public, no-cache" if public else "private, no-cache",
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+    }
+    if etag:
+        headers["ETag"] = etag
+
+    if _is_not_modified(request_headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    url = await storage.presigned_url(document.file_path, settings.DOWNLOAD_URL_EXPIRE_SECONDS, document.title)
+    if url:
+        # The URL expires, the redirect itself must not be cached
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": "private, no-store"})
+
+    media_type = guess_type(document.title)[0] or "application/octet-stream"
+    codec = document.storage_codec or StorageCodec.IDENTITY.name
+    path = storage.local_path(document.file_path) if codec == StorageCodec.IDENTITY.name else None
+    if path:
+        return ZeroCopyFileResponse(path, headers=headers, media_type=media_type, filename=document.title)
+
+    headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(document.title)}"
+    if document.size_bytes is not None:
+        headers["Content-Length"] = str(document.size_bytes)
+    return StreamingResponse(storage.read_stream(document.file_path, codec), headers=headers, media_type=media_type)
@@ -0,0 +1,335 @@
+import os
+import re
+import shutil
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+import numpy as np
+
+from app.common.constants import EmbeddingConstants
+from app.config import settings
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Preferred places to end a chunk, best first
+CHUNK_BOUNDARIES = ("\n\n", "\n", ". ", " ")
+
+class TextChunker:
+    """
+        Splits text into chunks of at most `chunk_chars`, ending each at a
+        paragraph, line, sentence or word boundary in its second half when
+        there is one. Consecutive chunks share about `overlap` characters,
+        so a passage cut in two is still found whole in one of them.
+
+        Text is fed piece by piece and only the unfinished tail, under
+        `chunk_chars` characters, is kept between pieces. The chunks are
+        the same however the text is split into pieces.
+    """
+    def __init__(self, chunk_chars: int, overlap: int):
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        self._tail = ""
+
+    def feed(self, text: str, final: bool = False) -> List[str]:
+        """Chunks completed by `text`, and the rest of them when `final`"""
+        text = self._tail + text
+        chunks = []
+        start, length = 0, len(text)
+        while start < length:
+            end = start + self.chunk_chars
+            if end >= length:
+                # Where the last chunk ends depends on text still to come
+                if not final:
+                    break
+                end = length
+            else:
+                for boundary in CHUNK_BOUNDARIES:
+                    cut = text.rfind(boundary, start + self.chunk_chars // 2, end)
+                    if cut != -1:
+                        end = cut + len(boundary)
+                        break
+
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= length:
+                start = length
+                break
+
+            # The next chunk starts on a word boundary within the overlap
+            next_start = max(end - self.overlap, start + 1)
+            space = text.find(" ", next_start, end)
+            start = space + 1 if space != -1 else next_start
+        self._tail = text[start:]
+        return chunks
+
+
+def chunk_text(text: str, chunk_chars: int, overlap: int) -> List[str]:
+    return TextChunker(chunk_chars, overlap).feed(text, final=True)
+
+
+class Embedder(ABC):
+    """
+        Turns text into fixed size vectors whose dot product is the cosine
+        similarity. CPU bound, callers run it in a worker thread.
+    """
+    dimensions: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """(len(texts), dimensions) float32 matrix with L2 normalized rows"""
+        pass
+
+
+class HashingEmbedder(Embedder):
+    """
+        Local embedder without a model: words and word pairs are hashed into
+        `dimensions` buckets with a random sign (the hashing trick), with
+        sublinear term frequency. Finds passages that share vocabulary with
+        the query, nothing more, but needs no download and no GPU.
+    """
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                # crc32 rather than hash(), which is salted per process
+                digest = zlib.crc32(feature.encode())
+                rows.append(row)
+                columns.append(digest % self.dimensions)
+                signs.append(1.0 if digest & 0x80000000 else -1.0)
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (rows, columns), signs)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+}
+
+def get_embedder() -> Embedder:
+    return EMBEDDERS[settings.EMBEDDER](settings.EMBEDDING_DIMENSIONS)
+
+
+class VectorIndex:
+    """
+        Chunk embeddings of one document, memory-mapped from disk so an
+        index is only paged in as far as it is read:
+
+            vectors.npy   (chunks, dimensions) float16, or int8 with
+            scales.npy    the float32 scale of every int8 row
+            offsets.npy   (chunks + 1) int64 byte offsets into
+            chunks.bin    the utf-8 text of the chunks, back to back
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._text = np.memmap(os.path.join(path, "chunks.bin"), dtype=np.uint8, mode="r")
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def write(path: str, chunks: List[str], vectors: np.ndarray, quantization: str) -> None:
+        """Writes an index of at least one chunk to a temp directory next to `path` and swaps it in"""
+        writer = VectorIndexWriter(path, quantization)
+        try:
+            writer.add(chunks, vectors)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def dense(self) -> np.ndarray:
+        """All chunk vectors, dequantized to float32"""
+        if self.scales is not None:
+            return self.vectors.astype(np.float32) * self.scales[:, None]
+        return self.vectors.astype(np.float32)
+
+    def chunk(self, position: int) -> str:
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self._text[start:end].tobytes().decode()
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            Top `k` chunks by cosine similarity for each row of `queries`,
+            best first. Scored a block of rows at a time, so only one block
+            is ever dequantized and searching stays one matrix product per
+            block whatever the number of queries.
+        """
+        queries = np.atleast_2d(queries).astype(np.float32)
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.zeros((queries.shape[0], 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        best_scores = np.full((queries.shape[0], 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((queries.shape[0], 0), dtype=np.int64)
+        for start in range(0, len(self), EmbeddingConstants.SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + EmbeddingConstants.SEARCH_BLOCK_ROWS]
+            scores = queries @ block.astype(np.float32).T
+            if self.scales is not None:
+                scores *= self.scales[start:start + block.shape[0]]
+
+            # Candidates of this block merged with the best so far, then cut to k
+            scores = np.concatenate([best_scores, scores], axis=1)
+            ids = np.concatenate([best_ids, np.broadcast_to(
+                np.arange(start, start + block.shape[0]), (queries.shape[0], block.shape[0]))], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                ids = np.take_along_axis(ids, top, axis=1)
+            best_scores, best_ids = scores, ids
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+
+class VectorIndexWriter:
+    """
+        Writes a `VectorIndex` batch by batch into a temp directory next to
+        `path`, and swaps it in on `commit`. Chunk text goes to disk as it
+        is added, only the quantized vectors are held until the end.
+    """
+    def __init__(self, path: str, quantization: str):
+        self.path = path
+        self.quantization = quantization
+        self.temp_path = f"{path}.{uuid4().hex}.tmp"
+        os.makedirs(self.temp_path)
+        self._text = open(os.path.join(self.temp_path, "chunks.bin"), "wb")
+        self._vectors: List[np.ndarray] = []
+        self._scales: List[np.ndarray] = []
+        self._lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, chunks: List[str], vectors: np.ndarray) -> None:
+        if self.quantization == "int8":
+            # Symmetric per-row scale, the largest component maps to 127
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            self._vectors.append(np.round(vectors / scales[:, None]).astype(np.int8))
+            self._scales.append(scales.astype(np.float32))
+        else:
+            self._vectors.append(vectors.astype(np.float16))
+
+        for chunk in chunks:
+            encoded = chunk.encode()
+            self._text.write(encoded)
+            self._lengths.append(len(encoded))
+
+    def commit(self) -> None:
+        """Swaps in the index, which must have at least one chunk"""
+        self._text.close()
+        if self._scales:
+            np.save(os.path.join(self.temp_path, "scales.npy"), np.concatenate(self._scales))
+        np.save(os.path.join(self.temp_path, "vectors.npy"), np.concatenate(self._vectors))
+        offsets = np.zeros(len(self._lengths) + 1, dtype=np.int64)
+        np.cumsum(self._lengths, out=offsets[1:])
+        np.save(os.path.join(self.temp_path, "offsets.npy"), offsets)
+
+        # A directory cannot replace a non-empty one, the old index is moved aside first
+        old_path = f"{self.path}.{uuid4().hex}.old"
+        if os.path.exists(self.path):
+            os.rename(self.path, old_path)
+        os.rename(self.temp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def abort(self) -> None:
+        self._text.close()
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+
+class VectorIndexBuilder:
+    """
+        Chunks, embeds and writes the index of one document as its text is
+        fed, `batch` chunks at a time, so memory does not grow with the
+        size of the document. CPU bound, run it in a worker thread.
+    """
+    def __init__(self, writer: VectorIndexWriter, embedder: Embedder, chunk_chars: int, overlap: int, batch: int):
+        self.writer = writer
+        self.embedder = embedder
+        self.batch = batch
+        self._chunker = TextChunker(chunk_chars, overlap)
+        self._pending: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.writer) + len(self._pending)
+
+    def _flush(self, final: bool) -> None:
+        while len(self._pending) >= self.batch or (final and self._pending):
+            chunks, self._pending = self._pending[:self.batch], self._pending[self.batch:]
+            self.writer.add(chunks, self.embedder.embed(chunks))
+
+    def feed(self, text: str) -> None:
+        self._pending.extend(self._chunker.feed(text))
+        self._flush(final=False)
+
+    def finish(self) -> int:
+        """Embeds the remaining text, returns the number of chunks without writing anything yet"""
+        self._pending.extend(self._chunker.feed("", final=True))
+        self._flush(final=True)
+        return len(self.writer)
+
+
+class VectorIndexStore:
+    """
+        Vector indexes on local disk, keyed by the content checksum so that
+        identical uploads share one index. Opened indexes are kept in a
+        small LRU and reopened when the index on disk was rebuilt.
+    """
+    def __init__(self, base_path: str, quantization: str = "int8", max_open: int = 64):
+        self.base_path = base_path
+        self.quantization = quantization
+        self.max_open = max_open
+        self._open: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.base_path, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.base_path, key)
+
+    def build(self, key: str, chunks: List[str], vectors: np.ndarray) -> None:
+        VectorIndex.write(self._path(key), chunks, vectors, self.quantization)
+
+    def writer(self, key: str) -> VectorIndexWriter:
+        return VectorIndexWriter(self._path(key), self.quantization)
+
+    def open(self, key: str) -> Optional[VectorIndex]:
+        path = self._path(key)
+        try:
+            stat = os.stat(os.path.join(path, "vectors.npy"))
+            version = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            cached = self._open.get(key)
+            if cached and cached[0] == version:
+                self._open.move_to_end(key)
+                return cached[1]
+
+        index = VectorIndex(path)
+        with self._lock:
+            self._open[key] = (version, index)
+            self._open.move_to_end(key)
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return index
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._open.pop(key, None)
+        shutil.rmtree(self._path(key), ignore_errors=True)
@@ -0,0 +1,147 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.common.logger import logger
+from app.modules.documents import crud
+from app.modules.documents.models import Document, IngestionStatus
+
+class IngestionWorkerPool:
+    """
+        Runs the jobs of the `ingestion_jobs` table on the event loop, at
+        most `concurrency` at a time, so ingestion throughput is bounded and
+        request handlers only ever enqueue. Every worker process runs its
+        own pool, the job table is what they share.
+
+        A job that fails or runs past `timeout` is retried with exponential
+        backoff until `max_attempts`, then marked FAILED. The document's
+        `ingestion_status` follows the job through every transition, and
+        `on_status` is called with the document id and new status after
+        each one is committed.
+    """
+    def __init__(
+            self, session_factory, ingest: Callable[[Document], Awaitable],
+            concurrency: int, timeout: float, max_attempts: int,
+            retry_backoff: float, poll_interval: float,
+            on_status: Optional[Callable[[int, str], None]] = None):
+        self.session_factory = session_factory
+        self.ingest = ingest
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.on_status = on_status
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="ingestion-dispatcher")
+
+    async def stop(self):
+        """
+            Stops taking jobs and cancels the running ones. Their jobs stay
+            claimed until the lease runs out and are then picked up again.
+        """
+        if self._dispatcher is None:
+            return
+        tasks = [self._dispatcher, *self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._running.clear()
+
+    def notify(self):
+        """Called after enqueueing, so new jobs start without waiting for the next poll"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, document_id: int) -> bool:
+        """Stops the ingestion of `document_id` if this pool is running it"""
+        task = self._running.get(document_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def _dispatch(self):
+        while True:
+            # Cleared before claiming, a notification arriving meanwhile is not lost
+            self._wakeup.clear()
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    await self._claim(free)
+                except Exception:
+                    logger.exception("Could not claim ingestion jobs")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self, limit: int):
+        # The lease outlives the timeout, a job is only taken over from a worker that is gone
+        lease_until = datetime.now() + timedelta(seconds=self.timeout + self.poll_interval * 2)
+        async with self.session_factory() as db:
+            jobs = await crud.claim_ingestion_jobs(db, limit, lease_until)
+
+        for job in jobs:
+            self._status(job.document_id, IngestionStatus.IN_PROGRESS.name)
+            task = asyncio.create_task(self._run(job.id, job.document_id, job.attempts))
+            self._running[job.document_id] = task
+            task.add_done_callback(lambda _, document_id=job.document_id: self._done(document_id))
+
+    def _status(self, document_id: int, status: str):
+        if self.on_status is not None:
+            self.on_status(document_id, status)
+
+    def _done(self, document_id: int):
+        self._running.pop(document_id, None)
+        # A slot is free again
+        self.notify()
+
+    async def _run(self, job_id: int, document_id: int, attempts: int):
+        async with self.session_factory() as db:
+            document = await db.get(Document, document_id)
+            if document is None or attempts > self.max_attempts:
+                # Deleted meanwhile, or claimed again after a crash on its last attempt
+                reason = "Document was deleted" if document is None else "Too many attempts"
+                if await crud.finish_ingestion_job(db, job_id, document_id, IngestionStatus.FAILED.name, reason):
+                    self._status(document_id, IngestionStatus.FAILED.name)
+                return
+
+        try:
+            await asyncio.wait_for(self.ingest(document), self.timeout)
+        except asyncio.CancelledError:
+            logger.info(f"Ingestion of document {document_id} was cancelled")
+            raise
+        except Exception as error:
+            message = f"Timed out after {self.timeout}s" if isinstance(error, asyncio.TimeoutError) else repr(error)
+            await self._failed(job_id, document_id, attempts, message)
+            return
+
+        async with self.session_factory() as db:
+            finished = await crud.finish_ingestion_job(db, job_id, document_id, IngestionStatus.COMPLETED.name)
+        if finished:
+            self._status(document_id, IngestionStatus.COMPLETED.name)
+        logger.info(f"Document {document_id} ingested")
+
+    async def _failed(self, job_id: int, document_id: int, attempts: int, message: str):
+        async with self.session_factory() as db:
+            if attempts >= self.max_attempts:
+                logger.error(f"Ingestion of document {document_id} failed for good: {message}")
+                if await crud.finish_ingestion_job(db, job_id, document_id, IngestionStatus.FAILED.name, message):
+                    self._status(document_id, IngestionStatus.FAILED.name)
+                return
+
+            # Exponential backoff with jitter, so failing jobs do not retry in lockstep
+            delay = self.retry_backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.0)
+            logger.warning(f"Ingestion of document {document_id} failed, retrying in {delay:.1f}s: {message}")
+            if await crud.retry_ingestion_job(
+                    db, job_id, document_id, datetime.now() + timedelta(seconds=delay), message):
+                self._status(document_id, IngestionStatus.PENDING.name)
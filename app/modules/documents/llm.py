@@ -0,0 +1,225 @@
+import asyncio
+import json
+import random
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional
+
+import httpx
+
+from app.common.exceptions import LLMUnavailableException
+from app.common.logger import logger
+from app.config import settings
+from app.modules.documents.llm_simulator import LLMSimulator
+
+# Answers worth retrying: rate limited, or the backend is overloaded or restarting
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class LLMBackendError(Exception):
+    """A failed call that may succeed when retried"""
+    pass
+
+
+class LLMClient(ABC):
+    """
+        Calls to one LLM backend. At most `max_concurrency` run at a time per
+        worker process, and a call waiting longer than `queue_timeout` for a
+        slot fails with 503 rather than queueing behind a slow backend
+        indefinitely. Failed calls are retried up to `max_attempts` with
+        jittered exponential backoff, taking a slot per attempt so none is
+        held while waiting to retry, and a call, or the gap between two
+        streamed tokens, may take at most `timeout`.
+    """
+    def __init__(
+            self, max_concurrency: int, queue_timeout: float, timeout: float,
+            max_attempts: int, retry_backoff: float):
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @abstractmethod
+    async def _ingest(self, document_id: int, content: AsyncIterator[bytes]) -> None:
+        pass
+
+    @abstractmethod
+    def _generate(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        pass
+
+    @asynccontextmanager
+    async def _slot(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise LLMUnavailableException(f"no free slot within {self.queue_timeout}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _backoff(self, attempt: int, error: Exception):
+        reason = str(error) or "timed out"
+        if attempt >= self.max_attempts:
+            raise LLMUnavailableException(f"gave up after {attempt} attempts: {reason}") from error
+        # Jittered, so calls failing together do not retry in lockstep
+        delay = self.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+        logger.warning(f"LLM call failed, retrying in {delay:.2f}s: {reason}")
+        await asyncio.sleep(delay)
+
+    async def ingest(self, document_id: int, content: Callable[[], AsyncIterator[bytes]]) -> None:
+        """
+            Streams a document to the LLM. `content` opens the stream of the
+            file, once per attempt, so the file is never held in memory.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._slot():
+                try:
+                    await asyncio.wait_for(self._ingest(document_id, content()), self.timeout)
+                    return
+                except (LLMBackendError, asyncio.TimeoutError) as error:
+                    failure = error
+            await self._backoff(attempt, failure)
+
+    async def generate(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        """
+            Tokens of the answer to `query` from `passages`, as they are
+            generated. Only retried until the first token, an answer is never
+            restarted halfway through. Closing the iterator cancels the call.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            async with self._slot():
+                started = False
+                tokens = self._generate(query, passages)
+                try:
+                    while True:
+                        try:
+                            token = await asyncio.wait_for(tokens.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield token
+                except (LLMBackendError, asyncio.TimeoutError) as error:
+                    if started:
+                        raise LLMUnavailableException(f"answer cut short: {str(error) or 'timed out'}") from error
+                    failure = error
+                finally:
+                    await tokens.aclose()
+            await self._backoff(attempt, failure)
+
+    async def stream(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        """
+            `generate`, started: returns once the slot is taken and the first
+            token is in, so a backend that is overloaded or down raises here,
+            before a response is committed to streaming.
+        """
+        tokens = self.generate(query, passages)
+        try:
+            first = await tokens.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await tokens.aclose()
+            raise
+        return self._resume(first, tokens)
+
+    @staticmethod
+    async def _resume(first: Optional[str], tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+        try:
+            if first is None:
+                return
+            yield first
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
+
+    async def complete(self, query: str, passages: List[str]) -> str:
+        return "".join([token async for token in self.generate(query, passages)])
+
+    async def close(self) -> None:
+        pass
+
+
+class SimulatedLLMClient(LLMClient):
+    """The simulator called in process, for development and tests"""
+    def __init__(self, simulator: LLMSimulator, **limits):
+        super().__init__(**limits)
+        self.simulator = simulator
+
+    async def _ingest(self, document_id: int, content: AsyncIterator[bytes]) -> None:
+        if self.simulator.fails():
+            raise LLMBackendError("simulated failure")
+        async for _ in content:
+            pass
+        delay = await self.simulator.ingest()
+        logger.info(f"The LLM took {delay:.1f} seconds to ingest the document")
+
+    async def _generate(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        if self.simulator.fails():
+            raise LLMBackendError("simulated failure")
+        async for token in self.simulator.generate(query, passages):
+            yield token
+
+
+class HTTPLLMClient(LLMClient):
+    """
+        LLM backend over HTTP, the API of `create_simulator_app`, through one
+        pooled httpx connection pool so calls reuse warm connections
+    """
+    def __init__(
+            self, base_url: str, max_connections: int = 32,
+            transport: Optional[httpx.AsyncBaseTransport] = None, **limits):
+        super().__init__(**limits)
+        self.base_url = base_url.rstrip("/")
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            # Read timeouts are the per token `timeout`, applied around the client
+            timeout=httpx.Timeout(None, connect=10.0),
+            transport=transport,
+        )
+
+    @staticmethod
+    def _check(response: httpx.Response):
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise LLMBackendError(f"{response.request.url} answered {response.status_code}")
+        response.raise_for_status()
+
+    async def _ingest(self, document_id: int, content: AsyncIterator[bytes]) -> None:
+        # Sent with chunked transfer encoding, as it is read
+        try:
+            response = await self._client.post(f"{self.base_url}/v1/documents/{document_id}", content=content)
+        except httpx.TransportError as error:
+            raise LLMBackendError(repr(error)) from error
+        self._check(response)
+
+    async def _generate(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        try:
+            async with self._client.stream(
+                    "POST", f"{self.base_url}/v1/generate", json={"query": query, "passages": passages}) as response:
+                self._check(response)
+                async for line in response.aiter_lines():
+                    if line:
+                        yield json.loads(line)["token"]
+        except httpx.TransportError as error:
+            raise LLMBackendError(repr(error)) from error
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def get_llm_client() -> LLMClient:
+    limits = dict(
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+        timeout=settings.LLM_TIMEOUT_SECONDS,
+        max_attempts=settings.LLM_MAX_ATTEMPTS,
+        retry_backoff=settings.LLM_RETRY_BACKOFF_SECONDS,
+    )
+    if settings.LLM_BACKEND == "http":
+        return HTTPLLMClient(settings.LLM_URL, settings.LLM_MAX_CONNECTIONS, **limits)
+    simulator = LLMSimulator(
+        settings.LLM_SIM_INGEST_SECONDS, settings.LLM_SIM_FIRST_TOKEN_SECONDS,
+        settings.LLM_SIM_TOKENS_PER_SECOND, settings.LLM_SIM_ERROR_RATE
+    )
+    return SimulatedLLMClient(simulator, **limits)
@@ -0,0 +1,114 @@
+import asyncio
+import math
+import random
+import re
+from typing import AsyncIterator, List, Optional
+
+from faker import Faker
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# A word and the whitespace after it, or leading whitespace
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+
+class LatencyDistribution:
+    """
+        Durations in seconds, from a spec of the form "fixed:SECONDS",
+        "uniform:LOW,HIGH" or "lognormal:MEDIAN,P95". Lognormal is the
+        closest to real model latencies, mostly fast with a long tail.
+    """
+    def __init__(self, spec: str, rng: Optional[random.Random] = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, arguments = spec.partition(":")
+        self.kind = kind
+        self.arguments = [float(argument) for argument in arguments.split(",")]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if expected.get(kind) != len(self.arguments):
+            raise ValueError(f"Invalid latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.arguments[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.arguments)
+        median, p95 = self.arguments
+        if median <= 0:
+            return 0.0
+        # 1.645 standard deviations above the mean of the underlying normal is its 95th percentile
+        sigma = math.log(max(p95, median) / median) / 1.645
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+
+class LLMSimulator:
+    """
+        Stand-in for the LLM, with realistic timing but no model: ingestion
+        takes `ingest_seconds`, answers start after `first_token_seconds`
+        and stream at `tokens_per_second` (0 for no delay). An answer is the
+        retrieved passages themselves, or filler text without any. A share
+        `error_rate` of the calls fails, to exercise the retries.
+    """
+    def __init__(
+            self, ingest_seconds: str, first_token_seconds: str, tokens_per_second: float,
+            error_rate: float = 0.0, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.ingest_seconds = LatencyDistribution(ingest_seconds, self.rng)
+        self.first_token_seconds = LatencyDistribution(first_token_seconds, self.rng)
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+
+    def fails(self) -> bool:
+        return self.rng.random() < self.error_rate
+
+    async def ingest(self) -> float:
+        delay = self.ingest_seconds.sample()
+        await asyncio.sleep(delay)
+        return delay
+
+    async def generate(self, query: str, passages: List[str]) -> AsyncIterator[str]:
+        answer = "\n\n".join(passages) or Faker().paragraph(self.rng.randrange(1, 10))
+        await asyncio.sleep(self.first_token_seconds.sample())
+        token_seconds = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        for token in TOKEN_PATTERN.findall(answer):
+            yield token
+            await asyncio.sleep(token_seconds)
+
+
+class GenerateRequest(BaseModel):
+    query: str
+    passages: List[str] = []
+
+class GenerateToken(BaseModel):
+    token: str
+
+
+def create_simulator_app(simulator: LLMSimulator) -> FastAPI:
+    """
+        HTTP front of `simulator`, the API `HTTPLLMClient` speaks. Answers
+        stream as newline delimited JSON, one {"token": ...} per line.
+        Injected failures answer 503 before anything is streamed.
+    """
+    app = FastAPI(title="LLM simulator")
+
+    @app.post("/v1/documents/{document_id}", status_code=204)
+    async def ingest(document_id: int, request: Request):
+        if simulator.fails():
+            return Response(status_code=503)
+        # Read through like a real backend would, without keeping it
+        async for _ in request.stream():
+            pass
+        await simulator.ingest()
+        return Response(status_code=204)
+
+    @app.post("/v1/generate")
+    async def generate(data: GenerateRequest):
+        if simulator.fails():
+            return Response(status_code=503)
+
+        async def lines():
+            async for token in simulator.generate(data.query, data.passages):
+                yield GenerateToken(token=token).model_dump_json() + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
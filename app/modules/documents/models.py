@@ -1,5 +1,5 @@
 from enum import Enum
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, UniqueConstraint
+from sqlalchemy import BigInteger, Column, Float, Index, Integer, String, ForeignKey, DateTime, Boolean, UniqueConstraint, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.common.database import Base
@@ -11,6 +11,10 @@ class IngestionStatus(Enum):
     COMPLETED = 'completed'
     TERMINATED = 'terminated'
 
+class StorageCodec(Enum):
+    IDENTITY = 'identity'
+    GZIP = 'gzip'
+
 class Document(Base):
     __tablename__ = "documents"
 
@@ -23,8 +27,19 @@ class Document(Base):
     is_private_document = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
 
+    # Size and sha256 of the stored file, computed while the upload streams in
+    size_bytes = Column(BigInteger, nullable=True)
+    checksum = Column(String(64), nullable=True)
+
+    # Files not read for a while are compressed in place by the cold storage sweep
+    storage_codec = Column(String, default=StorageCodec.IDENTITY.name, nullable=False)
+    last_accessed_at = Column(DateTime, default=datetime.now, nullable=False)
+
     # Document Activity
-    views = Column(Integer, default=0)
+    views = Column(Integer, default=0, nullable=False)
+    # Denormalized count of DocumentStar rows, maintained by the star crud
+    # functions and repaired by `crud.reconcile_star_counts`
+    star_count = Column(Integer, default=0, nullable=False)
 
     ingestion_status = Column(String, default=IngestionStatus.PENDING.name, nullable=False)
 
@@ -34,6 +49,21 @@ class Document(Base):
     stars = relationship("DocumentStar", back_populates="document", cascade="all, delete-orphan")
     conversations = relationship("Conversation", back_populates="document")
 
+    __table_args__ = (
+        Index("ix_documents_key_version", "document_key", "version"),
+        # The head of a document key: at most one active version per key
+        Index(
+            "uq_documents_active_key", "document_key", unique=True,
+            sqlite_where=text("is_active = 1"), postgresql_where=text("is_active = true")
+        ),
+        Index("ix_documents_checksum", "checksum"),
+        Index("ix_documents_codec_accessed", "storage_codec", "last_accessed_at"),
+        Index("ix_documents_user_active_uploaded", "user_id", "is_active", "uploaded_at"),
+        # Public feeds, the trailing id is the keyset pagination tie-breaker
+        Index("ix_documents_explore", "is_active", "is_private_document", "views", "id"),
+        Index("ix_documents_latest", "is_active", "is_private_document", "uploaded_at", "id"),
+    )
+
 
 class DocumentStar(Base):
     __tablename__ = "document_stars"
@@ -46,4 +76,97 @@ class DocumentStar(Base):
 
     __table_args__ = (
         UniqueConstraint("user_id", "document_id", name="unique_user_document_star"),
+        Index("ix_document_stars_document_id", "document_id"),
+    )
+
+
+class DocumentTrending(Base):
+    """
+        Time-decayed popularity of public documents, rescored incrementally
+        by `crud.refresh_trending_scores` so the trending feed is a plain
+        index range scan on `score`
+    """
+    __tablename__ = "document_trending"
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), primary_key=True)
+    # log2 of the activity anchored to `TrendingConstants.EPOCH`, NULL without any
+    score = Column(Float, nullable=True)
+
+    # Counters as of the last refresh, the next one only scores the difference
+    star_count = Column(Integer, default=0, nullable=False)
+    views = Column(Integer, default=0, nullable=False)
+    refreshed_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index("ix_document_trending_score", "score", "document_id"),
+    )
+
+
+class UserDocumentStats(Base):
+    """
+        Per-user rollup behind `/documents/stats` and the free tier upload
+        check, kept in step with uploads, deletes, stars and views
+    """
+    __tablename__ = "user_document_stats"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    total_documents = Column(Integer, default=0, nullable=False)
+    private_documents = Column(Integer, default=0, nullable=False)
+    total_views = Column(Integer, default=0, nullable=False)
+    total_stars = Column(Integer, default=0, nullable=False)
+    total_revisions = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class IngestionJob(Base):
+    """
+        Persistent ingestion queue, one job per document version. Workers
+        claim due jobs with a conditional update and hold them for a lease,
+        so the job of a crashed worker is due again once the lease runs out.
+    """
+    __tablename__ = "ingestion_jobs"
+    id = Column(Integer, primary_key=True)
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, unique=True)
+    # Same states as Document.ingestion_status, which follows the job
+    status = Column(String, default=IngestionStatus.PENDING.name, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
+
+    # Earliest time the job may run: pushed back between retries, and to the
+    # end of the lease while a worker holds it
+    available_at = Column(DateTime, default=datetime.now, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+    document = relationship("Document")
+
+    __table_args__ = (
+        Index("ix_ingestion_jobs_status_available", "status", "available_at"),
+    )
+
+
+class UploadSession(Base):
+    """
+        Resumable upload in progress. Each accepted chunk is kept as its own
+        file until `received_bytes` reaches `total_bytes`, the assembled
+        upload then goes through the regular upload path.
+    """
+    __tablename__ = "upload_sessions"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    title = Column(String, nullable=False)
+    is_private_document = Column(Boolean, default=False, nullable=False)
+    # Set when the upload is a new version of an existing document
+    document_key = Column(String, nullable=True)
+
+    total_bytes = Column(BigInteger, nullable=False)
+    received_bytes = Column(BigInteger, default=0, nullable=False)
+    # Claimed by the request assembling the document, no chunks accepted meanwhile
+    is_completing = Column(Boolean, default=False, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    # Pushed back by every chunk, abandoned sessions are removed once it passes
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_upload_sessions_user_id", "user_id"),
+        Index("ix_upload_sessions_expires_at", "expires_at"),
     )
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Form, UploadFile, File, Depends
+from fastapi import APIRouter, Form, Query, Request, UploadFile, File, Depends
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
+from app.common.constants import IngestionConstants, PassageIndexConstants
 from app.common.dependencies import authorization_level_required
 from app.modules.users.models import AccountLevel
 from app.modules.documents.service import BasicService, DocumentService, IngestionService
-from app.modules.documents.schemas import DocumentStatsResponse, DocumentIngestionStatusResponse, DocumentResponse, PublicDocumentResponse
+from app.modules.documents.schemas import DocumentStatsResponse, DocumentIngestionStatusResponse, DocumentResponse, PublicDocumentResponse, \
+        BulkStarRequest, DocumentStarState, DocumentBatchRequest, PassageSearchResult, UploadSessionRequest, UploadSessionResponse
 from app.modules.users.schemas import MessageResponse
 
 class UserDocumentsRoutes:
@@ -16,11 +19,21 @@ class UserDocumentsRoutes:
         self.router.get(    ''                              )(self.get_user_documents)
         self.router.post(   ''                              )(self.upload_document)
         self.router.patch(  ''                              )(self.reupload_document)
+        self.router.put(    '/stream'                       )(self.stream_document)
+        self.router.post(   '/uploads', status_code=201     )(self.create_upload_session)
+        self.router.get(    '/uploads/{upload_id}'          )(self.get_upload_session)
+        self.router.put(    '/uploads/{upload_id}'          )(self.upload_chunk)
+        self.router.post(   '/uploads/{upload_id}/complete' )(self.complete_upload_session)
+        self.router.delete( '/uploads/{upload_id}'          )(self.cancel_upload_session)
         self.router.get(    '/stats'                        )(self.get_document_stats)
+        self.router.post(   '/batch'                        )(self.view_documents)
+        self.router.post(   '/stars'                        )(self.update_document_stars)
         self.router.get(    '/stars/{document_id}'          )(self.get_document_stars)
         self.router.post(   '/stars/{document_id}'          )(self.set_document_stars)
         self.router.delete( '/stars/{document_id}'          )(self.delete_document_stars)
         self.router.get(    '/{document_key}'               )(self.view_document)
+        self.router.get(    '/{document_key}/download'      )(self.download_document)
+        self.router.head(   '/{document_key}/download'      )(self.download_document)
         self.router.delete( '/{document_key}'               )(self.delete_document)
 
     async def get_user_documents(
@@ -62,12 +75,83 @@ class UserDocumentsRoutes:
             is_private=is_private,
         )
 
+    async def stream_document(
+            self,
+            request: Request,
+            title: str = Query(...),
+            is_private: bool = False,
+            document_key: Optional[str] = None,
+            service: DocumentService = Depends(DocumentService),
+            ) -> DocumentResponse:
+        """
+            Raw request body upload, written to storage chunk by chunk as it
+            arrives instead of being spooled first like multipart forms.
+            Passing `document_key` uploads a new version of that document.
+        """
+        content_length = request.headers.get("content-length")
+        return await service.process_document_stream(
+            chunks=request.stream(),
+            title=title,
+            is_private=is_private,
+            document_key=document_key,
+            content_length=int(content_length) if content_length and content_length.isdigit() else None
+        )
+
+    async def create_upload_session(
+            self, data: UploadSessionRequest,
+            service: DocumentService = Depends(DocumentService),
+            ) -> UploadSessionResponse:
+        """
+            Starts a resumable upload: the file is then sent in any number of
+            PUTs, each starting at the `received_bytes` of the session, and
+            turned into a document by `/complete` once all of it arrived
+        """
+        return await service.create_upload_session(data)
+
+    async def get_upload_session(
+            self, upload_id: str,
+            service: DocumentService = Depends(DocumentService),
+            ) -> UploadSessionResponse:
+        return await service.get_upload_session(upload_id)
+
+    async def upload_chunk(
+            self, upload_id: str, request: Request,
+            offset: int = Query(..., ge=0),
+            service: DocumentService = Depends(DocumentService),
+            ) -> UploadSessionResponse:
+        return await service.upload_chunk(upload_id, offset, request.stream())
+
+    async def complete_upload_session(
+            self, upload_id: str,
+            service: DocumentService = Depends(DocumentService),
+            ) -> DocumentResponse:
+        return await service.complete_upload_session(upload_id)
+
+    async def cancel_upload_session(
+            self, upload_id: str,
+            service: DocumentService = Depends(DocumentService),
+            ) -> MessageResponse:
+        await service.cancel_upload_session(upload_id)
+        return {'message': 'Upload cancelled'}
+
     async def view_document(
             self, document_key:str,
             service: DocumentService = Depends(DocumentService),
             ) -> DocumentResponse:
         return await service.get_document(document_key)
 
+    async def download_document(
+            self, document_key: str, request: Request,
+            service: DocumentService = Depends(DocumentService),
+            ):
+        return await service.download_document(document_key, request.headers)
+
+    async def view_documents(
+            self, data: DocumentBatchRequest,
+            service: DocumentService = Depends(DocumentService),
+            ) -> List[DocumentResponse]:
+        return await service.get_documents(data.document_keys)
+
     async def delete_document(
         self, document_key: str,
         service: DocumentService = Depends(DocumentService),
@@ -78,7 +162,7 @@ class UserDocumentsRoutes:
 
     async def get_document_stars(
             self, document_id:int,
-            service: BasicService = Depends(BasicService),
+            service: DocumentService = Depends(DocumentService),
             ):
         return await service.get_document_stars(document_id)
 
@@ -94,6 +178,12 @@ class UserDocumentsRoutes:
             ) -> MessageResponse:
         return await service.delete_document_stars(document_id)
 
+    async def update_document_stars(
+            self, data: BulkStarRequest,
+            service: DocumentService = Depends(DocumentService),
+            ) -> List[DocumentStarState]:
+        return await service.update_document_stars(data)
+
 
 class PublicDocumentsRoutes:
     def __init__(self, prefix: str = "/documents"):
@@ -104,6 +194,10 @@ class PublicDocumentsRoutes:
         self.router.get(    '/explore'                      )(self.explore_documents)
         self.router.get(    '/explore/trending'             )(self.trending_documents)
         self.router.get(    '/explore/latest'               )(self.latest_documents)
+        self.router.get(    '/search'                       )(self.search_documents)
+        self.router.get(    '/search/passages'              )(self.search_passages)
+        self.router.get(    '/{document_key}/download'      )(self.download_document)
+        self.router.head(   '/{document_key}/download'      )(self.download_document)
 
     async def list_user_documents(
             self, username: str,
@@ -115,28 +209,55 @@ class PublicDocumentsRoutes:
     async def explore_documents(
             self, page: int = 1,
             user_id: int = None,
+            cursor: Optional[str] = None,
             service: BasicService = Depends(BasicService)
             ) -> List[PublicDocumentResponse]:
-        return await service.list_explore_documents(page, user_id)
+        return await service.list_explore_documents(page, user_id, cursor)
 
     async def trending_documents(
             self, page: int = 1,
             user_id: int = None,
+            cursor: Optional[str] = None,
             service: BasicService = Depends(BasicService)
             ) -> List[PublicDocumentResponse]:
-        return await service.list_trending_documents(page, user_id)
+        return await service.list_trending_documents(page, user_id, cursor)
 
     async def latest_documents(
             self, page: int = 1,
             user_id: int = None,
+            cursor: Optional[str] = None,
+            service: BasicService = Depends(BasicService)
+            ) -> List[PublicDocumentResponse]:
+        return await service.list_latest_documents(page, user_id, cursor)
+
+    async def search_documents(
+            self, q: str = Query(..., min_length=1, max_length=256),
+            page: int = 1,
+            user_id: int = None,
             service: BasicService = Depends(BasicService)
             ) -> List[PublicDocumentResponse]:
-        return await service.list_latest_documents(page, user_id)
+        return await service.search_documents(q, page, user_id)
+
+    async def search_passages(
+            self, q: str = Query(..., min_length=1, max_length=1024),
+            k: int = Query(10, ge=1, le=PassageIndexConstants.MAX_RESULTS),
+            user_id: int = None,
+            service: BasicService = Depends(BasicService)
+            ) -> List[PassageSearchResult]:
+        """Semantic search: passages of public documents by similarity of meaning to `q`"""
+        return await service.search_passages(q, k, user_id)
+
+    async def download_document(
+            self, document_key: str,
+            service: BasicService = Depends(BasicService)
+            ):
+        return await service.download_document(document_key)
 
 class LLMRoutes:
     def __init__(self, prefix: str = "/llm"):
         self.router = APIRouter(prefix=prefix, tags=["LLM"])
 
+        self.router.get(    '/ingestion_status/stream'          )(self.stream_document_status)
         self.router.get(    '/ingestion_status/{document_id}'   )(self.get_document_status)
         self.router.delete( '/cancel_ingestion/{document_id}'   )(self.stop_document_ingestion)
 
@@ -146,8 +267,20 @@ class LLMRoutes:
             ) -> DocumentIngestionStatusResponse:
         return await service.get_document_status(document_id)
 
+    async def stream_document_status(
+            self,
+            document_id: List[int] = Query(..., min_length=1, max_length=IngestionConstants.MAX_STREAMED_DOCUMENTS),
+            service = Depends(IngestionService)
+            ) -> StreamingResponse:
+        events = await service.stream_document_status(document_id)
+        return StreamingResponse(
+            events, media_type="text/event-stream",
+            # Proxies must pass every event on as it comes
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
     async def stop_document_ingestion(
             self, document_id:int,
             service = Depends(IngestionService)
             ) -> DocumentIngestionStatusResponse:
-        return await service.get_document_status(document_id)
+        return await service.stop_document_ingestion(document_id)
@@ -0,0 +1,195 @@
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote, urlencode, urlsplit
+from xml.etree import ElementTree
+
+import httpx
+
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+def _signature(
+        method: str, url: str, canonical_headers: List[Tuple[str, str]], payload_hash: str,
+        secret_access_key: str, scope: str, amz_date: str) -> str:
+    parts = urlsplit(url)
+    query = sorted(
+        (quote(unquote(key), safe="-_.~"), quote(unquote(value), safe="-_.~"))
+        for key, _, value in (pair.partition("=") for pair in parts.query.split("&") if pair)
+    )
+    canonical_request = "\n".join([
+        method,
+        quote(parts.path or "/", safe="/-_.~"),
+        "&".join(f"{key}={value}" for key, value in query),
+        "".join(f"{name}:{value}\n" for name, value in canonical_headers),
+        ";".join(name for name, _ in canonical_headers),
+        payload_hash,
+    ])
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+
+    key = ("AWS4" + secret_access_key).encode()
+    for part in scope.split("/"):
+        key = _hmac(key, part)
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+def sign_request(
+        method: str, url: str, headers: Dict[str, str], payload_hash: str,
+        access_key_id: str, secret_access_key: str, region: str,
+        service: str = "s3", now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+        AWS Signature Version 4 for a single request. Returns `headers` plus
+        the date, payload hash and Authorization headers to send with it.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{now.strftime('%Y%m%d')}/{region}/{service}/aws4_request"
+
+    headers = {
+        **headers,
+        "host": urlsplit(url).netloc,
+        "x-amz-date": amz_date,
+        "x-amz-content-sha256": payload_hash,
+    }
+    canonical_headers = sorted((name.lower(), " ".join(str(value).split())) for name, value in headers.items())
+    signature = _signature(method, url, canonical_headers, payload_hash, secret_access_key, scope, amz_date)
+
+    headers["Authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key_id}/{scope}, "
+        f"SignedHeaders={';'.join(name for name, _ in canonical_headers)}, Signature={signature}"
+    )
+    return headers
+
+def presign_url(
+        method: str, url: str, expires_in: int, access_key_id: str, secret_access_key: str,
+        region: str, service: str = "s3", now: Optional[datetime] = None) -> str:
+    """
+        Query string authenticated URL, usable by anyone holding it until
+        it expires
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{now.strftime('%Y%m%d')}/{region}/{service}/aws4_request"
+
+    auth_query = urlencode({
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{access_key_id}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(expires_in),
+        "X-Amz-SignedHeaders": "host",
+    }, quote_via=quote, safe="-_.~")
+    url = f"{url}&{auth_query}" if urlsplit(url).query else f"{url}?{auth_query}"
+    signature = _signature(
+        method, url, [("host", urlsplit(url).netloc)], "UNSIGNED-PAYLOAD", secret_access_key, scope, amz_date)
+    return f"{url}&X-Amz-Signature={signature}"
+
+
+def _xml_text(body: bytes, tag: str) -> Optional[str]:
+    # S3 responses use a default namespace, match on the local name
+    for element in ElementTree.fromstring(body).iter():
+        if element.tag.rsplit("}", 1)[-1] == tag:
+            return element.text
+    return None
+
+
+class S3Client:
+    """
+        Minimal S3 API client over one pooled httpx connection pool, with
+        path-style addressing so it works against AWS and S3-compatible
+        servers (MinIO, Ceph, localstack) alike
+    """
+    def __init__(
+            self, endpoint_url: str, bucket: str, region: str,
+            access_key_id: str, secret_access_key: str,
+            max_connections: int = 32, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            transport=transport,
+        )
+
+    def _url(self, key: str, query: str = "") -> str:
+        url = f"{self.endpoint_url}/{self.bucket}/{quote(key, safe='/-_.~')}"
+        return f"{url}?{query}" if query else url
+
+    async def _request(
+            self, method: str, key: str, query: str = "", content: bytes = b"",
+            headers: Optional[Dict[str, str]] = None, payload_hash: Optional[str] = None) -> httpx.Response:
+        url = self._url(key, query)
+        signed = sign_request(
+            method, url, headers or {}, payload_hash or hashlib.sha256(content).hexdigest(),
+            self.access_key_id, self.secret_access_key, self.region
+        )
+        response = await self._client.request(method, url, content=content, headers=signed)
+        response.raise_for_status()
+        return response
+
+    async def put_object(self, key: str, content: bytes, payload_hash: Optional[str] = None) -> None:
+        await self._request("PUT", key, content=content, payload_hash=payload_hash)
+
+    async def create_multipart_upload(self, key: str) -> str:
+        response = await self._request("POST", key, "uploads=")
+        return _xml_text(response.content, "UploadId")
+
+    async def upload_part(self, key: str, upload_id: str, part_number: int, content: bytes,
+                          payload_hash: Optional[str] = None) -> str:
+        response = await self._request(
+            "PUT", key, f"partNumber={part_number}&uploadId={quote(upload_id, safe='')}",
+            content=content, payload_hash=payload_hash
+        )
+        return response.headers["etag"]
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(parts)
+        ) + "</CompleteMultipartUpload>"
+        response = await self._request("POST", key, f"uploadId={quote(upload_id, safe='')}", content=body.encode())
+        # A failed completion can still answer 200, with the error in the body
+        if _xml_text(response.content, "Code") is not None:
+            raise httpx.HTTPStatusError(
+                f"CompleteMultipartUpload failed: {response.text}", request=response.request, response=response)
+
+    async def abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        await self._request("DELETE", key, f"uploadId={quote(upload_id, safe='')}")
+
+    async def get_object(self, key: str) -> bytes:
+        response = await self._request("GET", key)
+        return response.content
+
+    async def stream_object(self, key: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        url = self._url(key)
+        signed = sign_request(
+            "GET", url, {}, EMPTY_PAYLOAD_HASH, self.access_key_id, self.secret_access_key, self.region)
+        async with self._client.stream("GET", url, headers=signed) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+    def presigned_url(self, key: str, expires_in: int, download_name: Optional[str] = None) -> str:
+        query = ""
+        if download_name:
+            disposition = f"attachment; filename*=utf-8''{quote(download_name, safe='')}"
+            query = f"response-content-disposition={quote(disposition, safe='')}"
+        return presign_url(
+            "GET", self._url(key, query), expires_in,
+            self.access_key_id, self.secret_access_key, self.region
+        )
+
+    async def delete_object(self, key: str) -> None:
+        try:
+            await self._request("DELETE", key)
+        except httpx.HTTPStatusError as error:
+            if error.response.status_code != 404:
+                raise
+
+    async def close(self) -> None:
+        await self._client.aclose()
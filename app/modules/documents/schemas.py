@@ -1,11 +1,34 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import AliasChoices, BaseModel, Field, model_validator
+from typing import List, Optional
 from datetime import datetime
 
+from app.common.constants import BatchLimits
+
 class UploadDocumentRequest(BaseModel):
     title: str = 'Harry Potter eBook'
     is_private_document: Optional[bool] = False
 
+class UploadSessionRequest(BaseModel):
+    title: str = 'Harry Potter eBook'
+    is_private_document: bool = False
+    # Uploads a new version of this document
+    document_key: Optional[str] = None
+    total_bytes: int = Field(default=1048576, gt=0)
+
+class UploadSessionResponse(BaseModel):
+    id: str = '2f1c9a7e4b5d4e0f8a6b3c2d1e0f9a8b'
+    title: str = 'Harry Potter eBook'
+    is_private_document: bool = False
+    document_key: Optional[str] = None
+    total_bytes: int = 1048576
+    # Offset the next chunk has to start at
+    received_bytes: int = 0
+    expires_at: datetime = datetime.now()
+
+    model_config = {
+        "from_attributes": True
+    }
+
 class DocumentResponse(BaseModel):
     id: int = 1
     document_key: str = '64aaf05e-1fd3-423b-a564-a3c0200408fd'
@@ -14,6 +37,8 @@ class DocumentResponse(BaseModel):
     version: int = 1
     uploaded_at: datetime = datetime.now()
     is_private_document: bool = False
+    size_bytes: Optional[int] = 1048576
+    checksum: Optional[str] = '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
     ingestion_status: str = 'COMPLETED'
     user_id: int = 1
     user_starred: bool = False
@@ -35,6 +60,11 @@ class PublicDocumentResponse(BaseModel):
         "from_attributes": True
     }
 
+class PassageSearchResult(BaseModel):
+    document: PublicDocumentResponse
+    passage: str = 'Mr. and Mrs. Dursley, of number four, Privet Drive, were proud to say...'
+    score: float = 0.82
+
 class DocumentStatsResponse(BaseModel):
     user_id: int = 1
     total_documents: int = 5
@@ -44,7 +74,7 @@ class DocumentStatsResponse(BaseModel):
     private_documents: int = 1
 
 class DocumentIngestionStatusResponse(BaseModel):
-    document_id: int = 1
+    document_id: int = Field(default=1, validation_alias=AliasChoices("document_id", "id"))
     document_key: str = '64aaf05e-1fd3-423b-a564-a3c0200408fd'
     title: str = 'Harry Potter eBook'
     version: int = 2
@@ -54,3 +84,30 @@ class DocumentIngestionStatusResponse(BaseModel):
     model_config = {
         "from_attributes": True
     }
+
+class IngestionStatusEvent(BaseModel):
+    document_id: int = 1
+    # None once the document was deleted
+    ingestion_status: Optional[str] = 'IN_PROGRESS'
+
+class BulkStarRequest(BaseModel):
+    star: List[int] = Field(default=[], max_length=BatchLimits.MAX_STAR_DOCUMENTS)
+    unstar: List[int] = Field(default=[], max_length=BatchLimits.MAX_STAR_DOCUMENTS)
+
+    @model_validator(mode="after")
+    def check_disjoint(self):
+        if set(self.star) & set(self.unstar):
+            raise ValueError("A document cannot be starred and unstarred in the same request")
+        return self
+
+class DocumentStarState(BaseModel):
+    document_id: int = 1
+    user_starred: bool = True
+    total_stars: int = 1
+
+class DocumentBatchRequest(BaseModel):
+    document_keys: List[str] = Field(
+        default=['64aaf05e-1fd3-423b-a564-a3c0200408fd'],
+        min_length=1,
+        max_length=BatchLimits.MAX_DOCUMENT_KEYS
+    )
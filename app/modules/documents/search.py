@@ -0,0 +1,175 @@
+import codecs
+import re
+from abc import ABC, abstractmethod
+from typing import List
+
+from sqlalchemy import DDL, event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.modules.documents.models import Document
+
+# The search table is not a mapped model, SQLite needs an FTS5 virtual table
+# and Postgres a tsvector column, so it is created alongside `documents`
+event.listen(
+    Document.__table__, "after_create",
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS document_search "
+        "USING fts5(title, content, tokenize='porter unicode61')"
+    ).execute_if(dialect="sqlite")
+)
+event.listen(
+    Document.__table__, "after_create",
+    DDL(
+        "CREATE TABLE IF NOT EXISTS document_search ("
+        "document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE, "
+        "search_vector TSVECTOR NOT NULL)"
+    ).execute_if(dialect="postgresql")
+)
+event.listen(
+    Document.__table__, "after_create",
+    DDL(
+        "CREATE INDEX IF NOT EXISTS ix_document_search_vector "
+        "ON document_search USING GIN (search_vector)"
+    ).execute_if(dialect="postgresql")
+)
+event.listen(
+    Document.__table__, "before_drop",
+    DDL("DROP TABLE IF EXISTS document_search")
+)
+
+
+def extract_text(raw: bytes) -> str:
+    """
+        Best effort text for the index, binary formats (anything with NUL
+        bytes) are only searchable by title
+    """
+    if b"\x00" in raw:
+        return ""
+    return raw.decode("utf-8", errors="ignore")
+
+
+class TextExtractor:
+    """
+        `extract_text` for a file read in chunks. A character split between
+        two chunks is decoded whole, and once a NUL byte is seen the file is
+        `binary` and no more text comes out.
+    """
+    def __init__(self):
+        self.binary = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+    def feed(self, raw: bytes, final: bool = False) -> str:
+        if self.binary or b"\x00" in raw:
+            self.binary = True
+            return ""
+        return self._decoder.decode(raw, final)
+
+
+class SearchIndex(ABC):
+    """
+        Full-text index over the titles and text of public documents. Rows
+        are keyed by document id and only exist for active public documents.
+    """
+    @abstractmethod
+    async def index_document(self, db: AsyncSession, document_id: int, title: str, content: str) -> None:
+        pass
+
+    @abstractmethod
+    async def remove_documents(self, db: AsyncSession, document_ids: List[int]) -> None:
+        pass
+
+    @abstractmethod
+    async def search(self, db: AsyncSession, query: str, limit: int, offset: int) -> List[int]:
+        """Returns the ids of matching public documents, best match first"""
+        pass
+
+    async def remove_document_key(self, db: AsyncSession, document_key: str) -> None:
+        result = await db.execute(
+            text("SELECT id FROM documents WHERE document_key = :document_key"),
+            {"document_key": document_key}
+        )
+        await self.remove_documents(db, result.scalars().all())
+
+
+class SQLiteSearchIndex(SearchIndex):
+    async def index_document(self, db, document_id, title, content):
+        await db.execute(
+            text("INSERT OR REPLACE INTO document_search (rowid, title, content) VALUES (:id, :title, :content)"),
+            {"id": document_id, "title": title, "content": content}
+        )
+        await db.commit()
+
+    async def remove_documents(self, db, document_ids):
+        if not document_ids:
+            return
+        await db.execute(
+            text("DELETE FROM document_search WHERE rowid IN (SELECT value FROM json_each(:ids))"),
+            {"ids": "[" + ",".join(str(int(doc_id)) for doc_id in document_ids) + "]"}
+        )
+        await db.commit()
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        # Every word is quoted, so user input can never be parsed as FTS5 syntax
+        return " ".join(f'"{token}"' for token in re.findall(r"\w+", query))
+
+    async def search(self, db, query, limit, offset):
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+        result = await db.execute(
+            text(
+                "SELECT documents.id FROM document_search "
+                "JOIN documents ON documents.id = document_search.rowid "
+                "WHERE document_search MATCH :expression "
+                "AND documents.is_active = 1 AND documents.is_private_document = 0 "
+                # Title hits weigh ten times more than hits in the text
+                "ORDER BY bm25(document_search, 10.0, 1.0), documents.id "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {"expression": expression, "limit": limit, "offset": offset}
+        )
+        return result.scalars().all()
+
+
+class PostgresSearchIndex(SearchIndex):
+    async def index_document(self, db, document_id, title, content):
+        await db.execute(
+            text(
+                "INSERT INTO document_search (document_id, search_vector) VALUES (:id, "
+                "setweight(to_tsvector('english', :title), 'A') || setweight(to_tsvector('english', :content), 'B')) "
+                "ON CONFLICT (document_id) DO UPDATE SET search_vector = EXCLUDED.search_vector"
+            ),
+            {"id": document_id, "title": title, "content": content}
+        )
+        await db.commit()
+
+    async def remove_documents(self, db, document_ids):
+        if not document_ids:
+            return
+        await db.execute(
+            text("DELETE FROM document_search WHERE document_id = ANY(:ids)"),
+            {"ids": list(document_ids)}
+        )
+        await db.commit()
+
+    async def search(self, db, query, limit, offset):
+        result = await db.execute(
+            text(
+                "SELECT documents.id FROM document_search "
+                "JOIN documents ON documents.id = document_search.document_id, "
+                "websearch_to_tsquery('english', :query) AS query "
+                "WHERE document_search.search_vector @@ query "
+                "AND documents.is_active AND NOT documents.is_private_document "
+                "ORDER BY ts_rank_cd(document_search.search_vector, query) DESC, documents.id "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {"query": query, "limit": limit, "offset": offset}
+        )
+        return result.scalars().all()
+
+
+def get_search_index(db: AsyncSession) -> SearchIndex:
+    if db.bind.dialect.name == "postgresql":
+        return PostgresSearchIndex()
+    return SQLiteSearchIndex()
@@ -1,32 +1,234 @@
-import random
-from faker import Faker
-from asyncio import sleep
+import asyncio
+from contextlib import aclosing
+from datetime import datetime, timedelta
 from sqlalchemy import desc
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from fastapi import Depends, Request, UploadFile
-from typing import Optional
+from fastapi import Depends, Request, Response, UploadFile
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import uuid4
 
-from app.common.database import get_db
+from app.common.cache import CacheBackend, LRUCache
+from app.common.database import async_session, get_db
 from app.common.dependencies import get_current_user, get_optional_user
 from app.common.logger import logger
+from app.common.pubsub import PubSub
 from app.modules.documents import crud
-from app.modules.documents.models import Document, IngestionStatus
-from app.modules.documents.storage import LocalStorage
+from app.modules.documents.counters import ViewCountBuffer
+from app.modules.documents.ann import PassageIndex
+from app.modules.documents.downloads import document_download_response
+from app.modules.documents.embeddings import VectorIndexBuilder, VectorIndexStore, get_embedder
+from app.modules.documents.ingestion import IngestionWorkerPool
+from app.modules.documents.llm import get_llm_client
+from app.modules.documents.models import Document, IngestionStatus, StorageCodec, UploadSession
+from app.modules.documents.schemas import BulkStarRequest, IngestionStatusEvent, PublicDocumentResponse, UploadSessionRequest
+from app.modules.documents.search import TextExtractor, extract_text, get_search_index
+from app.modules.documents.storage import get_storage
+from app.modules.documents.uploads import UploadSessionFiles
 from app.modules.users.models import AccountLevel, User
-from app.common.exceptions import DocumentIngestionException, DocumentMissingException, FreeTierException, InvalidDocumentException, InvalidUserParameters
+from app.common.exceptions import DocumentIngestionException, DocumentMissingException, FreeTierException, InvalidDocumentException, InvalidUserParameters, \
+        UploadOffsetConflictException, UploadSessionMissingException, UploadTooLargeException
 from app.config import settings
-from app.common.constants import FreeTierLimitations, PaginationConstants
+from app.common.constants import ColdStorageConstants, EmbeddingConstants, FreeTierLimitations, IngestionConstants, \
+        PaginationConstants, PassageIndexConstants, SearchConstants, TrendingConstants, UploadLimits, UploadSessionConstants
 from app.common.auth import decode_access_token
-
-#TODO: use S3/Cloud storage for Production
-storage = LocalStorage()
+from app.common.pagination import NEXT_CURSOR_HEADER, encode_cursor
+from app.common.tasks import register_periodic_task
+
+# STORAGE_BACKEND=s3 keeps documents in S3 or a compatible object store
+storage = get_storage()
+upload_files = UploadSessionFiles(settings.UPLOAD_SESSION_PATH)
+embedder = get_embedder()
+vector_store = VectorIndexStore(
+    settings.EMBEDDING_INDEX_PATH, settings.EMBEDDING_QUANTIZATION, EmbeddingConstants.MAX_OPEN_INDEXES)
+passage_index = PassageIndex(
+    settings.PASSAGE_INDEX_PATH, settings.PASSAGE_INDEX_NPROBE,
+    settings.PASSAGE_INDEX_MAX_SEGMENTS, PassageIndexConstants.MERGE_FACTOR)
+# Separate backends, so that slow ingestion never takes the slots of conversations
+ingestion_llm = get_llm_client()
+chat_llm = get_llm_client()
+view_counter = ViewCountBuffer()
+feed_cache: CacheBackend = LRUCache(settings.FEED_CACHE_MAX_ENTRIES)
+FEED_CACHE_PREFIX = "feeds:"
+
+
+async def invalidate_public_feeds(feed: str = ""):
+    await feed_cache.invalidate(FEED_CACHE_PREFIX + feed)
+
+
+async def refresh_trending_scores():
+    async with async_session() as db:
+        rescored = await crud.refresh_trending_scores(
+            db,
+            half_life_hours=settings.TRENDING_HALF_LIFE_HOURS,
+            star_weight=TrendingConstants.STAR_WEIGHT,
+            view_weight=TrendingConstants.VIEW_WEIGHT,
+        )
+    if rescored:
+        await invalidate_public_feeds("trending")
+    logger.debug(f"Trending scores refreshed for {rescored} documents")
+
+
+async def flush_view_counts():
+    async with async_session() as db:
+        flushed = await view_counter.flush(db)
+    if flushed:
+        logger.debug(f"Flushed {flushed} buffered document views")
+
+async def compress_cold_documents():
+    """
+        Gzips the files of versions nobody downloaded for
+        COLD_STORAGE_AFTER_DAYS. The row is switched to the compressed copy
+        before the original is removed, so reads never see a missing file.
+    """
+    accessed_before = datetime.now() - timedelta(days=settings.COLD_STORAGE_AFTER_DAYS)
+    async with async_session() as db:
+        documents = await crud.get_cold_documents(db, accessed_before, ColdStorageConstants.BATCH_SIZE)
+        compressed, kept = 0, []
+        for document in documents:
+            file_path = document.file_path
+            try:
+                compressed_path = await storage.compress_file(file_path)
+            except OSError:
+                logger.exception(f"Could not compress {file_path}")
+                compressed_path = None
+            if compressed_path is None:
+                # Looked at again once it has been cold for another period
+                kept.append(document.id)
+                continue
+
+            await crud.set_document_storage(db, document.id, compressed_path, StorageCodec.GZIP.name)
+            await storage.delete_file(file_path)
+            compressed += 1
+        await crud.touch_documents(db, kept)
+    if compressed:
+        logger.info(f"Compressed {compressed} cold documents")
+
+
+async def record_access(db: AsyncSession, document: Document):
+    # Throttled so that popular documents do not write on every download
+    touch_after = document.last_accessed_at + timedelta(seconds=ColdStorageConstants.TOUCH_INTERVAL_SECONDS)
+    if touch_after < datetime.now():
+        await crud.touch_documents(db, [document.id])
+
+def index_key(document) -> str:
+    # Identical content shares an index, legacy rows without a checksum get their own
+    return document.checksum or f"document-{document.id}"
+
+
+async def build_document_index(key: str, content: AsyncIterator[bytes]):
+    """
+        Indexes the text of `content` as it is read, each chunk of the file
+        extracted, chunked and embedded in a worker thread. The file is
+        never held in memory whole, and the event loop is never blocked.
+    """
+    extractor = TextExtractor()
+    builder = VectorIndexBuilder(
+        vector_store.writer(key), embedder,
+        EmbeddingConstants.CHUNK_CHARS, EmbeddingConstants.CHUNK_OVERLAP, EmbeddingConstants.EMBED_BATCH
+    )
+
+    def feed(raw: bytes, final: bool = False):
+        builder.feed(extractor.feed(raw, final))
+
+    try:
+        async with aclosing(content):
+            async for raw in content:
+                await asyncio.to_thread(feed, raw)
+                if extractor.binary:
+                    break
+        await asyncio.to_thread(feed, b"", True)
+        chunks = await asyncio.to_thread(builder.finish)
+        if chunks and not extractor.binary:
+            await asyncio.to_thread(builder.writer.commit)
+            logger.info(f"Indexed {chunks} chunks for retrieval")
+            return
+    finally:
+        # Nothing left to clean up once committed
+        builder.writer.abort()
+    # Binary formats have no text to retrieve from
+    await asyncio.to_thread(vector_store.delete, key)
+
+
+async def retrieve_passages(document: Document, query: str, k: int) -> List[str]:
+    """The `k` chunks of `document` closest to `query`, best first"""
+    def search():
+        index = vector_store.open(index_key(document))
+        if index is None:
+            return []
+        _, positions = index.search(embedder.embed([query]), k)
+        return [index.chunk(position) for position in positions[0]]
+    return await asyncio.to_thread(search)
+
+
+def index_public_passages(document: Document):
+    """Adds the chunks of a public document to the library wide passage index"""
+    index = vector_store.open(index_key(document))
+    if index is not None:
+        passage_index.add(document.id, index.dense())
+
+
+async def merge_passage_index():
+    while await asyncio.to_thread(passage_index.merge):
+        pass
+
+
+async def process_document_ingestion(document: Document):
+    await build_document_index(index_key(document), storage.read_stream(document.file_path, document.storage_codec))
+    await ingestion_llm.ingest(document.id, lambda: storage.read_stream(document.file_path, document.storage_codec))
+
+    if document.is_active and not document.is_private_document:
+        await asyncio.to_thread(index_public_passages, document)
+
+# Ingestion status transitions, published per document id
+ingestion_events = PubSub()
+
+ingestion_pool = IngestionWorkerPool(
+    async_session, process_document_ingestion,
+    concurrency=settings.INGESTION_CONCURRENCY,
+    timeout=settings.INGESTION_JOB_TIMEOUT_SECONDS,
+    max_attempts=settings.INGESTION_MAX_ATTEMPTS,
+    retry_backoff=settings.INGESTION_RETRY_BACKOFF_SECONDS,
+    poll_interval=settings.INGESTION_POLL_SECONDS,
+    on_status=ingestion_events.publish,
+)
+
+
+async def resync_ingestion_status():
+    """
+        Republishes the stored status of every followed document. Picks up
+        the transitions made by other worker processes, with one query per
+        batch of documents however many clients are following them.
+    """
+    document_ids = ingestion_events.topics()
+    for start in range(0, len(document_ids), IngestionConstants.RESYNC_BATCH_SIZE):
+        batch = document_ids[start:start + IngestionConstants.RESYNC_BATCH_SIZE]
+        async with async_session() as db:
+            statuses = await crud.get_ingestion_statuses(db, batch)
+        for document_id in batch:
+            ingestion_events.publish(document_id, statuses.get(document_id))
+
+
+async def expire_upload_sessions():
+    async with async_session() as db:
+        upload_ids = await crud.delete_expired_upload_sessions(db, UploadSessionConstants.EXPIRY_BATCH_SIZE)
+    for upload_id in upload_ids:
+        await upload_files.delete(upload_id)
+    if upload_ids:
+        logger.info(f"Removed {len(upload_ids)} abandoned upload sessions")
+
+register_periodic_task("trending-refresh", settings.TRENDING_REFRESH_SECONDS, refresh_trending_scores)
+register_periodic_task("view-count-flush", settings.VIEW_COUNT_FLUSH_SECONDS, flush_view_counts)
+register_periodic_task("cold-storage-sweep", settings.COLD_STORAGE_SWEEP_SECONDS, compress_cold_documents)
+register_periodic_task("upload-session-expiry", settings.UPLOAD_SESSION_SWEEP_SECONDS, expire_upload_sessions)
+register_periodic_task("passage-index-merge", settings.PASSAGE_INDEX_MERGE_SECONDS, merge_passage_index)
+register_periodic_task("ingestion-status-resync", settings.INGESTION_STATUS_RESYNC_SECONDS, resync_ingestion_status)
 
 class BasicService:
-    def __init__(self, request: Request, db: AsyncSession = Depends(get_db)):
+    def __init__(self, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
         self.db = db
         self.request = request
+        self.response = response
 
     @staticmethod
     def _get_limit_offset(page):
@@ -35,20 +237,91 @@ class BasicService:
         limit = PaginationConstants.DOCUMENTS_PER_PAGE
         return limit, offset
 
+    @staticmethod
+    def _get_next_cursor(documents, sort_column) -> Optional[str]:
+        # A short page means the feed is exhausted, so there is nothing to resume from
+        if len(documents) < PaginationConstants.DOCUMENTS_PER_PAGE:
+            return None
+        last = documents[-1]
+        return encode_cursor(getattr(last, sort_column.key), last.id)
+
+    async def _list_feed(self, feed: str, fetch, sort_column, page: int, user_id, cursor: Optional[str]):
+        """
+            Public feeds are identical for every caller, so the page is cached
+            without the caller's stars and `user_starred` is overlaid per request
+        """
+        cache_key = f"{FEED_CACHE_PREFIX}{feed}:" + (f"cursor={cursor}" if cursor else f"page={max(page, 1)}")
+        cached = await feed_cache.get(cache_key)
+        if cached is None:
+            limit, offset = self._get_limit_offset(page)
+            documents = await fetch(self.db, None, limit, offset, cursor)
+            cached = (
+                [PublicDocumentResponse.model_validate(doc) for doc in documents],
+                self._get_next_cursor(documents, sort_column),
+            )
+            await feed_cache.set(cache_key, cached, settings.FEED_CACHE_TTL_SECONDS)
+
+        documents, next_cursor = cached
+        if next_cursor:
+            self.response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        starred_ids = await crud.get_starred_document_ids(self.db, user_id, [doc.id for doc in documents])
+        return [doc.model_copy(update={"user_starred": doc.id in starred_ids}) for doc in documents]
+
     async def get_document_stars_public(self, document_id):
         return await crud.get_document_stars_public(self.db, document_id)
 
-    async def list_explore_documents(self, page: int, user_id):
+    async def search_documents(self, query: str, page: int, user_id):
         limit, offset = self._get_limit_offset(page)
-        return await crud.fetch_explore_documents(self.db, user_id, limit, offset)
+        document_ids = await get_search_index(self.db).search(self.db, query, limit, offset)
+        documents = await crud.get_public_documents_by_ids(self.db, document_ids)
 
-    async def list_trending_documents(self, page: int, user_id):
-        limit, offset = self._get_limit_offset(page)
-        return await crud.fetch_trending_documents(self.db, user_id, limit, offset)
+        starred_ids = await crud.get_starred_document_ids(self.db, user_id, [doc.id for doc in documents])
+        for doc in documents:
+            doc.user_starred = doc.id in starred_ids
+        return documents
 
-    async def list_latest_documents(self, page: int, user_id):
-        limit, offset = self._get_limit_offset(page)
-        return await crud.fetch_latest_documents(self.db, user_id, limit, offset)
+    async def search_passages(self, query: str, k: int, user_id):
+        """Passages of public documents closest in meaning to `query`, best first"""
+        vector = (await asyncio.to_thread(embedder.embed, [query]))[0]
+        hits = await asyncio.to_thread(passage_index.search, vector, k)
+        documents = await crud.get_public_documents_by_ids(self.db, list(dict.fromkeys(hit.document_id for hit in hits)))
+        by_id = {document.id: document for document in documents}
+
+        starred_ids = await crud.get_starred_document_ids(self.db, user_id, list(by_id))
+        for document in documents:
+            document.user_starred = document.id in starred_ids
+
+        def passages():
+            # Hits of documents that went private or inactive meanwhile are left out
+            results = []
+            for hit in hits:
+                document = by_id.get(hit.document_id)
+                index = vector_store.open(index_key(document)) if document else None
+                if index is not None:
+                    results.append({"document": document, "passage": index.chunk(hit.position), "score": hit.score})
+            return results
+        return await asyncio.to_thread(passages)
+
+    async def download_document(self, document_key: str):
+        document = await crud.get_document_by_key(self.db, document_key)
+        if not document or document.is_private_document:
+            raise DocumentMissingException(document_key)
+        response = await document_download_response(storage, document, self.request.headers, public=True)
+        await record_access(self.db, document)
+        return response
+
+    async def list_explore_documents(self, page: int, user_id, cursor: Optional[str] = None):
+        return await self._list_feed(
+            "explore", crud.fetch_explore_documents, crud.EXPLORE_FEED_ORDER, page, user_id, cursor)
+
+    async def list_trending_documents(self, page: int, user_id, cursor: Optional[str] = None):
+        return await self._list_feed(
+            "trending", crud.fetch_trending_documents, crud.TRENDING_FEED_ORDER, page, user_id, cursor)
+
+    async def list_latest_documents(self, page: int, user_id, cursor: Optional[str] = None):
+        return await self._list_feed(
+            "latest", crud.fetch_latest_documents, crud.LATEST_FEED_ORDER, page, user_id, cursor)
 
 
 class DocumentService:
@@ -64,6 +337,26 @@ class DocumentService:
         response = await crud.get_document_stats(self.db, self.user.id)
         return response
 
+    def _max_upload_bytes(self) -> int:
+        return UploadLimits.MAX_BYTES.get(self.user.account_type.upper(), UploadLimits.MAX_BYTES["BASIC"])
+
+    async def _check_upload_allowed(self, is_reupload: bool, content_length: Optional[int]) -> int:
+        """Tier limits of the user for an upload, returns the largest size it may have"""
+        current_account_type = AccountLevel[self.user.account_type.upper()]
+
+        if current_account_type <= AccountLevel.BASIC:
+            if is_reupload:
+                raise FreeTierException("Only premium users can reupload (version) documents.")
+
+            stats = await crud.get_document_stats(self.db, self.user.id)
+            if  stats.get('total_documents') >= FreeTierLimitations.MAX_UPLOAD_DOCUMENTS:
+                raise FreeTierException(f"Cannot upload more than {FreeTierLimitations.MAX_UPLOAD_DOCUMENTS} documents")
+
+        max_bytes = self._max_upload_bytes()
+        if content_length is not None and content_length > max_bytes:
+            raise UploadTooLargeException(max_bytes)
+        return max_bytes
+
     async def process_document(
         self,
         file: UploadFile,
@@ -72,43 +365,198 @@ class DocumentService:
         document_key: Optional[str] = None,
         is_reupload: bool = False
     ):
-        current_account_type = AccountLevel[self.user.account_type.upper()]
+        async def chunks():
+            while chunk := await file.read(UploadLimits.CHUNK_SIZE):
+                yield chunk
 
-        if current_account_type <= AccountLevel.BASIC:
-            if is_reupload or document_key:
-                raise FreeTierException("Only premium users can reupload (version) documents.")
+        return await self.process_document_stream(
+            chunks=chunks(),
+            title=title,
+            is_private=is_private,
+            document_key=document_key,
+            is_reupload=is_reupload,
+            content_length=file.size
+        )
 
-            stats = await crud.get_document_stats(self.db, self.user.id)
-            if  stats.get('total_documents') >= FreeTierLimitations.MAX_UPLOAD_DOCUMENTS:
-                raise FreeTierException(f"Cannot upload more than {FreeTierLimitations.MAX_UPLOAD_DOCUMENTS} documents")
+    async def process_document_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        title: str,
+        is_private: bool,
+        document_key: Optional[str] = None,
+        is_reupload: bool = False,
+        content_length: Optional[int] = None
+    ):
+        max_bytes = await self._check_upload_allowed(is_reupload or bool(document_key), content_length)
 
+        existing_version = None
         if is_reupload or document_key:
             existing_version = await crud.get_document_by_key(self.db, document_key)
 
             if not existing_version:
                 raise InvalidDocumentException("Document key not found for versioning.")
 
-            await crud.invalidate_document(self.db, existing_version.id)
-            await crud.invalidate_conversations(self.db, existing_version.id)
-
             version = existing_version.version + 1
         else:
             document_key = str(uuid4())
             version = 1
 
-        file_path = await storage.upload_file(file.file, f"{document_key}_{version}")
+        # The beginning of the file is kept for the search index as it streams past
+        head = bytearray()
+        async def indexed(chunks):
+            async for chunk in chunks:
+                if len(head) < SearchConstants.MAX_INDEXED_BYTES:
+                    head.extend(chunk[:SearchConstants.MAX_INDEXED_BYTES - len(head)])
+                yield chunk
+
+        # Unique per upload, two racing reuploads of one key never write the same file
+        stored = await storage.upload_stream(
+            indexed(chunks), f"{document_key}_{version}_{uuid4().hex[:8]}", max_bytes,
+            previous_path=existing_version.file_path if existing_version else None
+        )
+        file_path = stored.file_path
+        content = extract_text(head)
+
+        try:
+            # Content that was already ingested once is not sent to the LLM again
+            ingestion_status = IngestionStatus.PENDING.name
+            if await crud.is_content_ingested(self.db, stored.checksum):
+                ingestion_status = IngestionStatus.COMPLETED.name
+
+            if existing_version:
+                new_doc = await crud.create_document_version(
+                    db=self.db,
+                    previous=existing_version,
+                    user=self.user,
+                    title=title,
+                    file_path=file_path,
+                    is_private=is_private,
+                    checksum=stored.checksum,
+                    size_bytes=stored.size,
+                    ingestion_status=ingestion_status
+                )
+            else:
+                new_doc = await crud.create_document(
+                    db=self.db,
+                    user=self.user,
+                    document_key=document_key,
+                    title=title,
+                    file_path=file_path,
+                    version=version,
+                    is_private=is_private,
+                    checksum=stored.checksum,
+                    size_bytes=stored.size,
+                    ingestion_status=ingestion_status
+                )
+        except BaseException:
+            # Lost a version race, or any other failure: no row points to the file
+            await storage.delete_file(file_path)
+            raise
+        await crud.refresh_user_document_stats(self.db, self.user.id)
+        await invalidate_public_feeds()
+        if ingestion_status == IngestionStatus.PENDING.name:
+            ingestion_pool.notify()
+
+        search_index = get_search_index(self.db)
+        if existing_version:
+            await search_index.remove_documents(self.db, [existing_version.id])
+            await asyncio.to_thread(passage_index.remove, [existing_version.id])
+        if not is_private:
+            await search_index.index_document(self.db, new_doc.id, title, content)
+            if ingestion_status == IngestionStatus.COMPLETED.name:
+                # Same content as an ingested document, its vectors are reused
+                await asyncio.to_thread(index_public_passages, new_doc)
+
+        return new_doc
 
-        new_doc = await crud.create_document(
+    @staticmethod
+    def _upload_session_expiry() -> datetime:
+        return datetime.now() + timedelta(hours=settings.UPLOAD_SESSION_EXPIRE_HOURS)
+
+    async def _get_upload_session(self, upload_id: str) -> UploadSession:
+        upload = await crud.get_upload_session(self.db, upload_id, self.user.id)
+        if not upload:
+            raise UploadSessionMissingException(upload_id)
+        return upload
+
+    async def create_upload_session(self, data: UploadSessionRequest) -> UploadSession:
+        # Checked up front as well, so nobody sends 500 MB to be refused at the end
+        await self._check_upload_allowed(bool(data.document_key), data.total_bytes)
+        if data.document_key and not await crud.get_document_by_key(self.db, data.document_key):
+            raise InvalidDocumentException("Document key not found for versioning.")
+        if await crud.count_upload_sessions(self.db, self.user.id) >= UploadLimits.MAX_UPLOAD_SESSIONS:
+            raise FreeTierException(f"Cannot have more than {UploadLimits.MAX_UPLOAD_SESSIONS} uploads in progress")
+
+        upload = await crud.create_upload_session(
             db=self.db,
-            user=self.user,
-            document_key=document_key,
-            title=title,
-            file_path=file_path,
-            version=version,
-            is_private=is_private
+            upload_id=uuid4().hex,
+            user_id=self.user.id,
+            title=data.title,
+            is_private=data.is_private_document,
+            total_bytes=data.total_bytes,
+            expires_at=self._upload_session_expiry(),
+            document_key=data.document_key
         )
+        await upload_files.create(upload.id)
+        return upload
+
+    async def get_upload_session(self, upload_id: str) -> UploadSession:
+        return await self._get_upload_session(upload_id)
+
+    async def upload_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> UploadSession:
+        """
+            Appends a request body to the upload at `offset`, which has to be
+            the number of bytes received so far. Whatever arrived before the
+            client dropped counts, the upload resumes from there.
+        """
+        upload = await self._get_upload_session(upload_id)
+        if upload.is_completing:
+            raise UploadOffsetConflictException(upload.received_bytes, "Upload is being completed")
+        if offset != upload.received_bytes:
+            raise UploadOffsetConflictException(upload.received_bytes)
+
+        temp_path, size = await upload_files.write_chunk(upload_id, chunks, upload.total_bytes - offset)
+        if size and await crud.advance_upload_session(
+                self.db, upload_id, offset, offset + size, self._upload_session_expiry()):
+            await upload_files.commit_chunk(upload_id, temp_path, offset)
+        else:
+            await upload_files.discard(temp_path)
+            if size:
+                # A concurrent request for the same offset was accepted first
+                await self.db.refresh(upload)
+                raise UploadOffsetConflictException(upload.received_bytes)
+
+        await self.db.refresh(upload)
+        return upload
+
+    async def complete_upload_session(self, upload_id: str):
+        upload = await self._get_upload_session(upload_id)
+        if upload.received_bytes != upload.total_bytes:
+            raise UploadOffsetConflictException(upload.received_bytes, "Upload is not complete yet")
+        if not await crud.set_upload_session_completing(self.db, upload_id, True, self._upload_session_expiry()):
+            raise UploadOffsetConflictException(upload.received_bytes, "Upload is already being completed")
+
+        try:
+            document = await self.process_document_stream(
+                chunks=upload_files.read(upload_id, upload.total_bytes),
+                title=upload.title,
+                is_private=upload.is_private_document,
+                document_key=upload.document_key,
+                content_length=upload.total_bytes
+            )
+        except Exception:
+            # Kept, so the client can retry without sending the file again
+            await crud.set_upload_session_completing(self.db, upload_id, False, self._upload_session_expiry())
+            raise
+
+        await crud.delete_upload_session(self.db, upload_id)
+        await upload_files.delete(upload_id)
+        return document
 
-        return new_doc
+    async def cancel_upload_session(self, upload_id: str):
+        await self._get_upload_session(upload_id)
+        await crud.delete_upload_session(self.db, upload_id)
+        await upload_files.delete(upload_id)
 
     async def get_document(self, document_key: str):
         document = await crud.get_document_by_key(self.db, document_key)
@@ -118,73 +566,148 @@ class DocumentService:
         if document.user_id != self.user.id and document.is_private_document:
             raise InvalidDocumentException(document_key)
 
-        stars = await crud.get_document_stars(self.db, document.id, self.user.id)
-        document.total_stars = stars.get('total_stars', 0)
-        document.user_starred = stars.get('user_starred', 0)
+        starred_ids = await crud.get_starred_document_ids(self.db, self.user.id, [document.id])
+        document.total_stars = document.star_count
+        document.user_starred = document.id in starred_ids
 
         return document
 
+    async def download_document(self, document_key: str, request_headers):
+        document = await crud.get_document_by_key(self.db, document_key)
+        if not document:
+            raise DocumentMissingException(document_key)
+
+        if document.user_id != self.user.id and document.is_private_document:
+            raise InvalidDocumentException(document_key)
+
+        response = await document_download_response(
+            storage, document, request_headers, public=not document.is_private_document)
+        await record_access(self.db, document)
+        return response
+
+    async def get_documents(self, document_keys: List[str]):
+        documents = await crud.get_documents_by_keys(self.db, document_keys, self.user.id)
+
+        # Missing and inaccessible keys are left out, the rest keep the requested order
+        by_key = {document.document_key: document for document in documents}
+        return [by_key[key] for key in dict.fromkeys(document_keys) if key in by_key]
+
     async def delete_document(self, document_key: str):
         document = await crud.get_document_by_key(self.db, document_key)
         if not document or document.user_id != self.user.id:
             raise InvalidDocumentException(document_key)
-        await storage.delete_file(document.file_path)
+        versions = await crud.get_document_files(self.db, document_key)
+        for version in versions:
+            await storage.delete_file(version.file_path)
+        await get_search_index(self.db).remove_document_key(self.db, document_key)
         await crud.delete_document(self.db, document_key)
 
-    async def process_document_ingestion(self, file_path):
-        # Simulating the LLM Blackbox call
-        delay = random.randint(3, 10)
-        await sleep(delay)
-        logger.info(f"The LLM took {delay} seconds to ingest the document")
-        return True
+        await asyncio.to_thread(passage_index.remove, [version.id for version in versions])
+
+        # Vector indexes are shared by identical content, kept while other documents have it
+        checksums = {version.checksum for version in versions if version.checksum}
+        remaining = await crud.get_referenced_checksums(self.db, list(checksums))
+        for version in versions:
+            if version.checksum not in remaining:
+                await asyncio.to_thread(vector_store.delete, index_key(version))
+        await crud.refresh_user_document_stats(self.db, self.user.id)
+        await invalidate_public_feeds()
 
     async def get_document_stars(self, document_id):
-        return await crud.get_document_stars(self.db, document_id, self.user_id)
+        return await crud.get_document_stars(self.db, document_id, self.user.id)
 
     async def set_document_stars(self, document_id):
-        return await crud.set_document_stars(self.db, document_id, self.user.id)
+        response = await crud.set_document_stars(self.db, document_id, self.user.id)
+        await invalidate_public_feeds()
+        return response
 
     async def delete_document_stars(self, document_id):
-        return await crud.delete_document_stars(self.db, document_id, self.user.id)
+        response = await crud.delete_document_stars(self.db, document_id, self.user.id)
+        await invalidate_public_feeds()
+        return response
+
+    async def update_document_stars(self, data: BulkStarRequest):
+        response = await crud.update_document_stars(self.db, self.user.id, data.star, data.unstar)
+        await invalidate_public_feeds()
+        return response
 
 
 class IngestionService:
     def __init__(self, db: AsyncSession = Depends(get_db)):
         self.db = db
 
-    async def get_document_status(self, document_id) -> Document:
-        document = await self.db.execute(select(Document).where(Document.id  == document_id))
-        document = document.scalars().one_or_none()
+    async def _get_document(self, document_id) -> Document:
+        document = await self.db.get(Document, document_id)
         if not document:
             raise InvalidDocumentException(document_id)
-
-        if document.ingestion_status in (IngestionStatus.COMPLETED, IngestionStatus.FAILED):
-            return document
-
-        logger.debug("Connect to the LLM Server and get the ingestion process")
-        logger.debug("Update the latest status in the database")
-
-        response_from_llm = random.choice(list(IngestionStatus))
-        document.ingestion_status = response_from_llm.name
-        await self.db.commit()
         return document
 
+    async def get_document_status(self, document_id) -> Document:
+        # Kept current by the ingestion workers
+        return await self._get_document(document_id)
+
+    async def stream_document_status(self, document_ids: List[int]) -> AsyncIterator[str]:
+        """
+            Server-Sent Events of the ingestion status of `document_ids`: the
+            current status of each, then every transition until all of them
+            are COMPLETED, FAILED, TERMINATED or deleted.
+        """
+        document_ids = list(dict.fromkeys(document_ids))
+        statuses = await crud.get_ingestion_statuses(self.db, document_ids)
+        for document_id in document_ids:
+            if document_id not in statuses:
+                raise InvalidDocumentException(document_id)
+        # The stream may stay open for minutes, it must not hold a connection
+        await self.db.close()
+        return self._status_events(statuses)
+
     @staticmethod
-    async def query_document(document_id=None, query=None):
-        return Faker().paragraph(random.randrange(1,10))
+    async def _status_events(statuses: Dict[int, Optional[str]]) -> AsyncIterator[str]:
+        final = {
+            IngestionStatus.COMPLETED.name, IngestionStatus.FAILED.name, IngestionStatus.TERMINATED.name, None}
+        sent = {}
+        # A transition between the lookup and the subscription is caught up by the next resync
+        with ingestion_events.subscribe(statuses) as subscription:
+            changes = statuses
+            while True:
+                for document_id, status in changes.items():
+                    if document_id in sent and (sent[document_id] == status or sent[document_id] in final):
+                        continue
+                    sent[document_id] = status
+                    event = IngestionStatusEvent(document_id=document_id, ingestion_status=status)
+                    yield f"event: status\ndata: {event.model_dump_json()}\n\n"
+                if all(status in final for status in sent.values()):
+                    return
+
+                changes = await subscription.get(IngestionConstants.STREAM_HEARTBEAT_SECONDS)
+                if not changes:
+                    yield ": keep-alive\n\n"
 
-    async def stop_document_ingestion(self, document_id) -> Document:
-        document = await self.db.execute(select(Document).where(Document.id  == document_id)) \
-                .scalars().one_or_none()
-        if not document:
-            raise InvalidDocumentException(document_id)
+    @staticmethod
+    async def _retrieve(db: AsyncSession, document_id=None, query=None) -> List[str]:
+        document = await db.get(Document, document_id) if document_id else None
+        return await retrieve_passages(document, query, settings.RETRIEVAL_TOP_K) if document else []
 
-        if document.ingestion_status in (IngestionStatus.COMPLETED, IngestionStatus.FAILED):
-            return document
+    @staticmethod
+    async def query_document(db: AsyncSession, document_id=None, query=None):
+        passages = await IngestionService._retrieve(db, document_id, query)
+        return await chat_llm.complete(query, passages)
 
-        logger.debug("Connect to the LLM Server and stopped the ingestion")
-        logger.debug("Update the status in the database")
+    @staticmethod
+    async def stream_query_document(db: AsyncSession, document_id=None, query=None) -> AsyncIterator[str]:
+        """
+            Tokens of the answer to `query` as they are generated. Retrieval
+            is done and the first token is in before this returns, so an
+            unavailable LLM raises here, and `db` is not used by the stream.
+        """
+        passages = await IngestionService._retrieve(db, document_id, query)
+        return await chat_llm.stream(query, passages)
 
-        document.ingestion_status = IngestionStatus.TERMINATED.name
-        await self.db.commit()
+    async def stop_document_ingestion(self, document_id) -> Document:
+        document = await self._get_document(document_id)
+        if await crud.cancel_ingestion_job(self.db, document_id):
+            ingestion_pool.cancel(document_id)
+            ingestion_events.publish(document_id, IngestionStatus.TERMINATED.name)
+            logger.info(f"Ingestion of document {document_id} was terminated")
+        await self.db.refresh(document)
         return document
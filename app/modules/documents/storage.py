@@ -1,38 +1,631 @@
+import asyncio
+import gzip
+import hashlib
 import os
 import shutil
+import struct
+import zlib
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, NamedTuple, Optional, Tuple
 from uuid import uuid4
 from fastapi import UploadFile
 
+from app.common.exceptions import UploadTooLargeException
+from app.config import settings
+from app.common.logger import logger
+from app.modules.documents.delta import apply_delta, encode_delta
+from app.modules.documents.models import StorageCodec
+from app.modules.documents.s3 import S3Client
+
+class StoredFile(NamedTuple):
+    file_path: str
+    size: int
+    checksum: str  # sha256 hex digest of the stored bytes
+
 class Storage(ABC):
     @abstractmethod
     async def upload_file(self, file: UploadFile, filename: str) -> str:
         pass
 
+    @abstractmethod
+    async def upload_stream(
+            self, chunks: AsyncIterator[bytes], filename: str, max_bytes: Optional[int] = None,
+            previous_path: Optional[str] = None) -> StoredFile:
+        """
+            Stores `chunks` as they arrive, hashing them on the way. Raises
+            `UploadTooLargeException` as soon as more than `max_bytes` were
+            received, nothing is stored in that case. `previous_path` is the
+            file of the version this upload replaces, if any.
+        """
+        pass
+
+    @abstractmethod
+    async def read_file(self, filepath: str, codec: str = StorageCodec.IDENTITY.name) -> bytes:
+        pass
+
+    async def read_stream(self, filepath: str, codec: str = StorageCodec.IDENTITY.name) -> AsyncIterator[bytes]:
+        yield await self.read_file(filepath, codec)
+
+    async def compress_file(self, filepath: str) -> Optional[str]:
+        """
+            Writes a gzip compressed copy of `filepath` and returns its path,
+            read back with `codec=GZIP`. None when the backend does not
+            compress or the file would not shrink enough. The original is
+            left for the caller to delete once it points to the copy.
+        """
+        return None
+
+    def local_path(self, filepath: str) -> Optional[str]:
+        """Path of a file that can be sent from disk as is, None if it has to be read through the backend"""
+        return None
+
+    async def presigned_url(
+            self, filepath: str, expires_in: int, download_name: Optional[str] = None) -> Optional[str]:
+        """Temporary direct download URL, for backends that can hand one out"""
+        return None
+
     @abstractmethod
     async def delete_file(self, filepath: str) -> None:
         pass
 
+    async def close(self) -> None:
+        """Releases connections held by the backend, called on shutdown"""
+        pass
+
 class LocalStorage(Storage):
     def __init__(self, base_path: str = "uploads"):
         self.base_path = base_path
         os.makedirs(self.base_path, exist_ok=True)
 
-    async def upload_file(self, file: UploadFile, filename: str) -> str:
+    def _temp_path(self, filename: str) -> str:
+        # Same directory as the target, so the final rename never crosses filesystems
+        return os.path.join(self.base_path, f".{filename}.{uuid4().hex}.part")
+
+    def _commit(self, temp_path: str, filename: str, checksum: str) -> str:
+        """Moves a fully written temp file to its final location, runs in a worker thread"""
         file_path = os.path.join(self.base_path, f"{filename}")
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file, f)
+        os.replace(temp_path, file_path)
         return file_path
 
+    async def upload_file(self, file: UploadFile, filename: str) -> str:
+        temp_path = self._temp_path(filename)
+
+        def copy():
+            checksum = hashlib.sha256()
+            try:
+                with open(temp_path, "wb") as f:
+                    while chunk := file.read(1024 * 1024):
+                        checksum.update(chunk)
+                        f.write(chunk)
+                return self._commit(temp_path, filename, checksum.hexdigest())
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        return await asyncio.to_thread(copy)
+
+    async def _write_stream(
+            self, chunks: AsyncIterator[bytes], temp_path: str, max_bytes: Optional[int]) -> Tuple[int, str]:
+        checksum = hashlib.sha256()
+        size = 0
+
+        # Hashing and disk I/O run in the default thread pool (hashlib
+        # releases the GIL), the event loop only receives chunks and hands
+        # them over
+        f = await asyncio.to_thread(open, temp_path, "wb")
+
+        def write(chunk: bytes):
+            checksum.update(chunk)
+            f.write(chunk)
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLargeException(max_bytes)
+                await asyncio.to_thread(write, chunk)
+        finally:
+            f.close()
+
+        return size, checksum.hexdigest()
+
+    async def upload_stream(self, chunks, filename, max_bytes=None, previous_path=None):
+        temp_path = self._temp_path(filename)
+        try:
+            size, checksum = await self._write_stream(chunks, temp_path, max_bytes)
+            file_path = await asyncio.to_thread(self._commit, temp_path, filename, checksum)
+        except BaseException:
+            # Also reached when the client disconnects and the task is cancelled
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return StoredFile(file_path, size, checksum)
+
+    @staticmethod
+    def _open(filepath: str, codec: str):
+        if codec == StorageCodec.GZIP.name:
+            return gzip.open(filepath, "rb")
+        return open(filepath, "rb")
+
+    async def read_file(self, filepath: str, codec: str = StorageCodec.IDENTITY.name) -> bytes:
+        def read():
+            with self._open(filepath, codec) as f:
+                return f.read()
+        return await asyncio.to_thread(read)
+
+    def local_path(self, filepath: str) -> Optional[str]:
+        return filepath
+
+    async def read_stream(
+            self, filepath: str, codec: str = StorageCodec.IDENTITY.name,
+            chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        # Compressed files are inflated chunk by chunk in the worker thread
+        f = await asyncio.to_thread(self._open, filepath, codec)
+        try:
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+        finally:
+            f.close()
+
+    async def compress_file(self, filepath: str) -> Optional[str]:
+        compressed_path = f"{filepath}.gz"
+        temp_path = self._temp_path(os.path.basename(compressed_path))
+
+        def compress():
+            try:
+                with open(filepath, "rb") as source, gzip.open(temp_path, "wb", compresslevel=6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                if os.path.getsize(temp_path) > os.path.getsize(filepath) * settings.COLD_STORAGE_MIN_RATIO:
+                    os.remove(temp_path)
+                    return None
+                os.replace(temp_path, compressed_path)
+                return compressed_path
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        return await asyncio.to_thread(compress)
+
     async def delete_file(self, filepath: str) -> None:
         if os.path.exists(filepath):
             os.remove(filepath)
 
+class ContentAddressedStorage(LocalStorage):
+    """
+        Stores every distinct content once, as `blobs/<sha256>`. A stored
+        file is a hard link `refs/<sha256>/<filename>` to its blob, so the
+        blob's link count is the reference count and the blob goes away
+        with its last reference. Readers open `file_path` like any local file.
+    """
+    def __init__(self, base_path: str = "uploads"):
+        super().__init__(base_path)
+        self.blobs_path = os.path.join(self.base_path, "blobs")
+        self.refs_path = os.path.join(self.base_path, "refs")
+        os.makedirs(self.blobs_path, exist_ok=True)
+        os.makedirs(self.refs_path, exist_ok=True)
+
+    def _temp_path(self, filename: str) -> str:
+        return os.path.join(self.blobs_path, f".{uuid4().hex}.part")
+
+    def _blob_path(self, checksum: str) -> str:
+        return os.path.join(self.blobs_path, checksum)
+
+    def _commit(self, temp_path: str, filename: str, checksum: str) -> str:
+        blob_path = self._blob_path(checksum)
+        ref_dir = os.path.join(self.refs_path, checksum)
+        temp_ref = os.path.join(ref_dir, f".{uuid4().hex}.part")
+
+        while True:
+            try:
+                os.link(temp_path, blob_path)
+            except FileExistsError:
+                pass  # Already stored, this copy is dropped below
+            os.makedirs(ref_dir, exist_ok=True)
+            try:
+                os.link(blob_path, temp_ref)
+                break
+            except FileNotFoundError:
+                # The last reference to the blob was deleted in between
+                continue
+
+        ref_path = os.path.join(ref_dir, filename)
+        os.replace(temp_ref, ref_path)
+        os.remove(temp_path)
+        return ref_path
+
+    def reference_count(self, checksum: str) -> int:
+        try:
+            return os.stat(self._blob_path(checksum)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def _ref_checksum(self, filepath: str) -> Optional[str]:
+        ref_dir = os.path.dirname(filepath)
+        if os.path.dirname(ref_dir) != self.refs_path:
+            return None  # Stored before content addressing was enabled
+        return os.path.basename(ref_dir)
+
+    async def compress_file(self, filepath: str) -> Optional[str]:
+        # A shared blob is already stored once, compressing one of its
+        # references would store the content a second time
+        checksum = self._ref_checksum(filepath)
+        if checksum is not None and (filepath.endswith(".gz") or self.reference_count(checksum) > 1):
+            return None
+        return await super().compress_file(filepath)
+
+    async def delete_file(self, filepath: str) -> None:
+        checksum = self._ref_checksum(filepath)
+        if checksum is None:
+            return await super().delete_file(filepath)
+        ref_dir = os.path.dirname(filepath)
+
+        def unlink():
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            try:
+                os.rmdir(ref_dir)
+            except OSError:
+                pass  # Other references, or compressed copies, are left
+            blob_path = self._blob_path(checksum)
+            try:
+                if os.stat(blob_path).st_nlink == 1:
+                    os.remove(blob_path)
+            except FileNotFoundError:
+                pass
+
+        await asyncio.to_thread(unlink)
+
+class DeltaStorage(LocalStorage):
+    """
+        Stores a new version of a document as a delta against the version
+        it replaces, `<filename>.delta`, rebuilt transparently by `read_file`.
+        Every `keyframe_interval` versions, or whenever the delta would not
+        be smaller, the version is stored in full instead, which bounds a
+        read to at most that many deltas applied to one full file. Full
+        versions are zlib compressed, `<filename>.zlib`, unless that would
+        not make them smaller.
+        Encoding and applying a delta hold the base and target versions in
+        memory, so only versions up to `max_delta_bytes` are delta coded,
+        larger ones are always stored in full and streamed a chunk at a time.
+    """
+    MAGIC = b"DLT1"
+    FULL_MAGIC = b"DLZ1"
+    _HEADER = struct.Struct(">HH")  # chain depth, length of the base file name
+
+    def __init__(
+            self, base_path: str = "uploads", keyframe_interval: Optional[int] = None,
+            max_delta_bytes: Optional[int] = None):
+        super().__init__(base_path)
+        self.keyframe_interval = keyframe_interval or settings.DELTA_KEYFRAME_INTERVAL
+        self.max_delta_bytes = max_delta_bytes or settings.DELTA_MAX_SIZE_MB * 1024 * 1024
+
+    def _header(self, filepath: str):
+        """
+            (depth, base path) of a stored version read from its header alone,
+            with no base path for a compressed full version, or None for a raw one
+        """
+        with open(filepath, "rb") as f:
+            magic = f.read(len(self.MAGIC))
+            if magic == self.FULL_MAGIC:
+                return 0, None
+            if magic != self.MAGIC:
+                return None
+            depth, name_length = self._HEADER.unpack(f.read(self._HEADER.size))
+            return depth, os.path.join(self.base_path, f.read(name_length).decode())
+
+    @staticmethod
+    def _file_chunks(filepath: str, chunk_size: int, offset: int = 0, decompress: bool = False):
+        """Content of a file from `offset` on, a chunk at a time, inflated when `decompress`"""
+        decompressor = zlib.decompressobj() if decompress else None
+        with open(filepath, "rb") as f:
+            f.seek(offset)
+            while data := f.read(chunk_size):
+                if decompressor is None:
+                    yield data
+                    continue
+                # max_length keeps a highly compressed chunk from inflating all at once
+                while data:
+                    if chunk := decompressor.decompress(data, chunk_size):
+                        yield chunk
+                    data = decompressor.unconsumed_tail
+            if decompressor is not None and (chunk := decompressor.flush()):
+                yield chunk
+
+    def _full_chunks(self, filepath: str, chunk_size: int):
+        if self._header(filepath) is None:
+            return self._file_chunks(filepath, chunk_size)
+        return self._file_chunks(filepath, chunk_size, len(self.FULL_MAGIC), decompress=True)
+
+    def _delta_sized(self, filepath: str) -> bool:
+        """Whether the version stored at `filepath` is small enough to be delta coded against"""
+        header = self._header(filepath)
+        if header is None:
+            return os.path.getsize(filepath) <= self.max_delta_bytes
+        if header[1] is not None:
+            # Deltas are only ever written for versions within the limit
+            return True
+        size = 0
+        for chunk in self._full_chunks(filepath, 1024 * 1024):
+            size += len(chunk)
+            if size > self.max_delta_bytes:
+                return False
+        return True
+
+    def _parse(self, data: bytes):
+        """
+            Splits a stored file into (depth, base path, delta), with no base
+            path for a compressed full version, or None for a raw one
+        """
+        if data.startswith(self.FULL_MAGIC):
+            return 0, None, data[len(self.FULL_MAGIC):]
+        if not data.startswith(self.MAGIC):
+            return None
+        offset = len(self.MAGIC)
+        depth, name_length = self._HEADER.unpack_from(data, offset)
+        offset += self._HEADER.size
+        base_name = data[offset:offset + name_length].decode()
+        return depth, os.path.join(self.base_path, base_name), data[offset + name_length:]
+
+    def _reconstruct(self, filepath: str) -> bytes:
+        with open(filepath, "rb") as f:
+            data = f.read()
+        parsed = self._parse(data)
+        if parsed is None:
+            return data
+        _, base_path, delta = parsed
+        if base_path is None:
+            return zlib.decompress(delta)
+        return apply_delta(self._reconstruct(base_path), delta)
+
+    def _commit(self, temp_path: str, filename: str, checksum: str) -> str:
+        """Stores a full version, compressed a chunk at a time into a second temp file"""
+        compressed_path = self._temp_path(f"{filename}.zlib")
+        try:
+            compressor = zlib.compressobj(6)
+            with open(temp_path, "rb") as source, open(compressed_path, "wb") as target:
+                target.write(self.FULL_MAGIC)
+                while chunk := source.read(1024 * 1024):
+                    target.write(compressor.compress(chunk))
+                target.write(compressor.flush())
+            if os.path.getsize(compressed_path) < os.path.getsize(temp_path):
+                file_path = os.path.join(self.base_path, f"{filename}.zlib")
+                os.replace(compressed_path, file_path)
+                os.remove(temp_path)
+                return file_path
+        finally:
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+        return super()._commit(temp_path, filename, checksum)
+
+    def _commit_revision(self, temp_path: str, filename: str, checksum: str, previous_path: Optional[str]) -> str:
+        if previous_path and os.path.exists(previous_path):
+            header = self._header(previous_path)
+            depth = header[0] + 1 if header else 1
+
+            if (depth < self.keyframe_interval and os.path.getsize(temp_path) <= self.max_delta_bytes
+                    and self._delta_sized(previous_path)):
+                with open(temp_path, "rb") as f:
+                    target = f.read()
+                delta = encode_delta(self._reconstruct(previous_path), target)
+                base_name = os.path.relpath(previous_path, self.base_path).encode()
+                stored = self.MAGIC + self._HEADER.pack(depth, len(base_name)) + base_name + delta
+
+                if len(stored) < len(target):
+                    file_path = os.path.join(self.base_path, f"{filename}.delta")
+                    with open(temp_path, "wb") as f:
+                        f.write(stored)
+                    os.replace(temp_path, file_path)
+                    return file_path
+
+        return self._commit(temp_path, filename, checksum)
+
+    async def upload_stream(self, chunks, filename, max_bytes=None, previous_path=None):
+        temp_path = self._temp_path(filename)
+        try:
+            size, checksum = await self._write_stream(chunks, temp_path, max_bytes)
+            file_path = await asyncio.to_thread(
+                self._commit_revision, temp_path, filename, checksum, previous_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return StoredFile(file_path, size, checksum)
+
+    async def read_file(self, filepath: str, codec: str = StorageCodec.IDENTITY.name) -> bytes:
+        return await asyncio.to_thread(self._reconstruct, filepath)
+
+    async def read_stream(
+            self, filepath: str, codec: str = StorageCodec.IDENTITY.name,
+            chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        # Full versions are inflated chunk by chunk, a delta (bounded by
+        # max_delta_bytes) is rebuilt into a temp file in the worker thread
+        # and streamed from there
+        temp_path = None
+        try:
+            header = await asyncio.to_thread(self._header, filepath)
+            if header is not None and header[1] is not None:
+                temp_path = self._temp_path(os.path.basename(filepath))
+
+                def reconstruct():
+                    with open(temp_path, "wb") as f:
+                        f.write(self._reconstruct(filepath))
+                await asyncio.to_thread(reconstruct)
+                chunks = self._file_chunks(temp_path, chunk_size)
+            else:
+                chunks = self._full_chunks(filepath, chunk_size)
+            try:
+                while chunk := await asyncio.to_thread(next, chunks, None):
+                    yield chunk
+            finally:
+                chunks.close()
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    async def compress_file(self, filepath: str) -> Optional[str]:
+        # Versions are compressed already, and later versions refer to their base by path
+        return None
+
+    def local_path(self, filepath: str) -> Optional[str]:
+        return None if filepath.endswith((".delta", ".zlib")) else filepath
+
 class S3Storage(Storage):
+    """
+        Objects live under `<base_path>/<filename>` in an S3 (compatible)
+        bucket and are referenced as `s3://<bucket>/<key>`. Uploads larger
+        than one part go up as a multipart upload with up to `concurrency`
+        parts in flight, so memory stays bounded by `concurrency` parts.
+    """
+    def __init__(
+            self, base_path: str = "uploads", bucket: Optional[str] = None,
+            endpoint_url: Optional[str] = None, region: Optional[str] = None,
+            access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None,
+            part_size: Optional[int] = None, concurrency: Optional[int] = None, transport=None):
+        self.prefix = base_path.strip("/")
+        self.bucket = bucket or settings.S3_BUCKET
+        if not self.bucket:
+            raise ValueError("S3 storage needs a bucket, set S3_BUCKET")
+        self.part_size = part_size or settings.S3_PART_SIZE_MB * 1024 * 1024
+        self.concurrency = concurrency or settings.S3_UPLOAD_CONCURRENCY
+        region = region or settings.S3_REGION
+        self.client = S3Client(
+            endpoint_url=endpoint_url or settings.S3_ENDPOINT_URL or f"https://s3.{region}.amazonaws.com",
+            bucket=self.bucket,
+            region=region,
+            access_key_id=access_key_id or settings.S3_ACCESS_KEY_ID,
+            secret_access_key=secret_access_key or settings.S3_SECRET_ACCESS_KEY,
+            max_connections=settings.S3_MAX_CONNECTIONS,
+            transport=transport,
+        )
+
+    def _key(self, filename: str) -> str:
+        return f"{self.prefix}/{filename}" if self.prefix else filename
+
+    def _object_key(self, filepath: str) -> Optional[str]:
+        prefix = f"s3://{self.bucket}/"
+        return filepath[len(prefix):] if filepath.startswith(prefix) else None
+
     async def upload_file(self, file: UploadFile, filename: str) -> str:
-        #TODO: need to implement this while moving to production
-        pass
+        async def chunks():
+            while chunk := await asyncio.to_thread(file.read, self.part_size):
+                yield chunk
+        return (await self.upload_stream(chunks(), filename)).file_path
+
+    async def upload_stream(self, chunks, filename, max_bytes=None, previous_path=None):
+        key = self._key(filename)
+        checksum = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        upload_id = None
+        parts, tasks = [], []
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send_part(number: int, data: bytes):
+            try:
+                payload_hash = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+                etag = await self.client.upload_part(key, upload_id, number, data, payload_hash)
+                parts.append((number, etag))
+            finally:
+                slots.release()
+
+        async def start_part(data: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                upload_id = await self.client.create_multipart_upload(key)
+            # Waits for a free slot, which is what bounds memory
+            await slots.acquire()
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            tasks.append(asyncio.create_task(send_part(len(tasks) + 1, data)))
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadTooLargeException(max_bytes)
+                await asyncio.to_thread(checksum.update, chunk)
+                buffer.extend(chunk)
+                while len(buffer) >= self.part_size:
+                    await start_part(bytes(buffer[:self.part_size]))
+                    del buffer[:self.part_size]
+
+            if upload_id is None:
+                await self.client.put_object(key, bytes(buffer))
+            else:
+                if buffer:
+                    await start_part(bytes(buffer))
+                await asyncio.gather(*tasks)
+                await self.client.complete_multipart_upload(key, upload_id, parts)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await self.client.abort_multipart_upload(key, upload_id)
+                except Exception:
+                    logger.exception(f"Could not abort multipart upload {upload_id} of {key}")
+            raise
+
+        return StoredFile(f"s3://{self.bucket}/{key}", size, checksum.hexdigest())
+
+    async def read_file(self, filepath: str, codec: str = StorageCodec.IDENTITY.name) -> bytes:
+        key = self._object_key(filepath)
+        if key is None:
+            # Stored on local disk before the switch to S3
+            def read():
+                with LocalStorage._open(filepath, codec) as f:
+                    return f.read()
+            return await asyncio.to_thread(read)
+        return await self.client.get_object(key)
+
+    async def read_stream(
+            self, filepath: str, codec: str = StorageCodec.IDENTITY.name,
+            chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        key = self._object_key(filepath)
+        if key is None:
+            f = await asyncio.to_thread(LocalStorage._open, filepath, codec)
+            try:
+                while chunk := await asyncio.to_thread(f.read, chunk_size):
+                    yield chunk
+            finally:
+                f.close()
+            return
+        async for chunk in self.client.stream_object(key, chunk_size):
+            yield chunk
+
+    def local_path(self, filepath: str) -> Optional[str]:
+        return filepath if self._object_key(filepath) is None else None
+
+    async def presigned_url(self, filepath, expires_in, download_name=None):
+        key = self._object_key(filepath)
+        if key is None:
+            return None
+        return self.client.presigned_url(key, expires_in, download_name)
 
     async def delete_file(self, filepath: str) -> None:
-        #TODO: need to implement this while moving to production
-        pass
+        key = self._object_key(filepath)
+        if key is None:
+            # Stored on local disk before the switch to S3
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return
+        await self.client.delete_object(key)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+STORAGE_BACKENDS = {
+    "local": LocalStorage,
+    "content_addressed": ContentAddressedStorage,
+    "delta": DeltaStorage,
+    "s3": S3Storage,
+}
+
+def get_storage() -> Storage:
+    return STORAGE_BACKENDS[settings.STORAGE_BACKEND](settings.STORAGE_PATH)
@@ -0,0 +1,74 @@
+"""
+    In-memory stand-in for an S3 compatible server, covering the calls
+    `S3Client` makes. Mounted in the tests through `httpx.ASGITransport`.
+"""
+import asyncio
+import hashlib
+from uuid import uuid4
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+
+class S3Stub:
+    def __init__(self, part_delay: float = 0.0):
+        self.objects = {}
+        self.uploads = {}
+        self.part_delay = part_delay
+        self.parts_in_flight = 0
+        self.max_parts_in_flight = 0
+        self.completed_uploads = 0
+        self.app = Starlette(routes=[Route("/{bucket}/{key:path}", self.handle, methods=["GET", "PUT", "POST", "DELETE"])])
+
+    async def handle(self, request: Request):
+        if not request.headers.get("authorization", "").startswith("AWS4-HMAC-SHA256 Credential="):
+            return Response(status_code=403)
+
+        key = (request.path_params["bucket"], request.path_params["key"])
+        query = request.query_params
+        body = await request.body()
+        if request.headers.get("x-amz-content-sha256") != hashlib.sha256(body).hexdigest():
+            return Response(status_code=400)
+
+        if request.method == "POST" and "uploads" in query:
+            upload_id = uuid4().hex
+            self.uploads[upload_id] = {}
+            return Response(f"<InitiateMultipartUploadResult><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+
+        if request.method == "PUT" and "uploadId" in query:
+            self.parts_in_flight += 1
+            self.max_parts_in_flight = max(self.max_parts_in_flight, self.parts_in_flight)
+            await asyncio.sleep(self.part_delay)
+            self.parts_in_flight -= 1
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = (etag, body)
+            return Response(headers={"ETag": etag})
+
+        if request.method == "POST" and "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"])
+            self.objects[key] = b"".join(parts[number][1] for number in sorted(parts))
+            self.completed_uploads += 1
+            return Response("<CompleteMultipartUploadResult></CompleteMultipartUploadResult>")
+
+        if request.method == "DELETE" and "uploadId" in query:
+            self.uploads.pop(query["uploadId"], None)
+            return Response(status_code=204)
+
+        if request.method == "PUT":
+            self.objects[key] = body
+            return Response(headers={"ETag": f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if key not in self.objects:
+            return Response(status_code=404)
+
+        if request.method == "GET":
+            content = self.objects[key]
+            async def chunks():
+                for start in range(0, len(content), 1024):
+                    yield content[start:start + 1024]
+            return StreamingResponse(chunks())
+
+        del self.objects[key]
+        return Response(status_code=204)
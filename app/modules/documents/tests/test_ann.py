@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+import pytest
+
+from app.modules.documents import service
+from app.modules.documents.ann import PassageIndex
+from app.modules.documents.models import Document
+
+def test_passage_index_segments(tmp_path):
+
+    # 40 documents of 200 passages around 10 topics
+    rng = np.random.default_rng(3)
+    topics = rng.standard_normal((10, 64))
+    documents = {}
+    for document_id in range(40):
+        vectors = topics[rng.integers(0, 10, 200)] + rng.standard_normal((200, 64)) * 0.6
+        documents[document_id] = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    index = PassageIndex(str(tmp_path), nprobe=4, max_segments=4, merge_factor=8)
+    for document_id, vectors in documents.items():
+        index.add(document_id, vectors)
+
+    def top(document_id, position, **kwargs):
+        return index.search(documents[document_id][position], 1, **kwargs)[0][:2]
+
+    assert top(7, 42) == (7, 42)
+    index.remove([7])
+    assert all(hit.document_id != 7 for hit in index.search(documents[7][42], 20))
+    index.add(7, documents[7])
+    assert top(7, 42) == (7, 42)
+
+    while index.merge():
+        pass
+    manifest = json.load(open(tmp_path / "manifest.json"))
+    segments = manifest["segments"]
+    assert len(segments) <= 4
+    # No older rows are left for any tombstone to hide
+    assert manifest["tombstones"] == {}
+    # The rows hidden by the tombstone are gone, the live ones all kept
+    assert sum(segment["rows"] for segment in segments) == 40 * 200
+    assert top(7, 42) == (7, 42) and top(31, 199) == (31, 199)
+
+    # A tombstone is kept as long as the rows it hides are on disk
+    index.remove([31])
+    assert json.load(open(tmp_path / "manifest.json"))["tombstones"] == {"31": index._read_manifest()["next_seq"] - 1}
+    assert all(hit.document_id != 31 for hit in index.search(documents[31][199], 20))
+
+    # Recall of the approximate top 10 against an exact scan
+    everything = np.concatenate([documents[document_id] for document_id in range(40)])
+    queries = everything[rng.choice(len(everything), 50)] + rng.standard_normal((50, 64)) * 0.3
+    recall = []
+    for query in queries.astype(np.float32):
+        exact = set(np.argsort(-(everything @ query))[:10].tolist())
+        found = {hit.document_id * 200 + hit.position for hit in index.search(query, 10, nprobe=16)}
+        recall.append(len(exact & found) / 10)
+    assert np.mean(recall) > 0.9
+
+@pytest.mark.asyncio
+async def test_search_passages(client, db, auth_headers):
+
+    texts = {
+        "Sailing.txt": "The schooner raised its sails and left the harbour at dawn.\n\nThe crew hauled the anchor.",
+        "Baking.txt": "Knead the dough for ten minutes, then let the bread rise overnight.\n\nBake until golden.",
+        "Private.txt": "The schooner crew kept a private log of the harbour.",
+    }
+    uploaded = {}
+    for title, text in texts.items():
+        uploaded[title] = (await client.put(
+            "/documents/stream", headers=auth_headers, content=text.encode(),
+            params={"title": title, "is_private": title == "Private.txt"}
+        )).json()
+        await service.process_document_ingestion(await db.get(Document, uploaded[title]["id"]))
+
+    response = await client.get("/documents/public/search/passages", params={"q": "schooner left the harbour", "k": 3})
+    assert response.status_code == 200
+    results = response.json()
+    assert results[0]["document"]["document_key"] == uploaded["Sailing.txt"]["document_key"]
+    assert results[0]["passage"].startswith("The schooner raised its sails")
+    assert all(result["document"]["title"] != "Private.txt" for result in results)
+
+    await client.delete(f"/documents/{uploaded['Sailing.txt']['document_key']}", headers=auth_headers)
+    results = (await client.get("/documents/public/search/passages", params={"q": "schooner harbour"})).json()
+    assert all(result["document"]["title"] == "Baking.txt" for result in results)
+
+    for title in ("Baking.txt", "Private.txt"):
+        await client.delete(f"/documents/{uploaded[title]['document_key']}", headers=auth_headers)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from app.modules.documents import service
+from app.modules.documents.embeddings import HashingEmbedder, TextChunker, VectorIndexStore, chunk_text
+from app.modules.documents.models import Document
+from app.modules.documents.search import TextExtractor
+
+def test_vector_index_search(tmp_path):
+
+    text = "First paragraph about dragons.\n\n" + "word " * 400 + "\n\nLast paragraph about castles."
+    chunks = chunk_text(text, 500, 100)
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert chunks[0].startswith("First paragraph") and chunks[-1].endswith("about castles.")
+
+    # Fed piece by piece, as a file is read, the chunks are the same
+    for piece in (1, 7, 499, 500, 501, 4096):
+        chunker = TextChunker(500, 100)
+        fed = [chunk for start in range(0, len(text), piece) for chunk in chunker.feed(text[start:start + piece])]
+        assert fed + chunker.feed("", final=True) == chunks
+
+    raw = "Ünïcödé text".encode()
+    extractor = TextExtractor()
+    assert "".join(extractor.feed(raw[i:i + 1]) for i in range(len(raw))) + extractor.feed(b"", True) == "Ünïcödé text"
+    assert extractor.feed(b"binary\x00") == "" and extractor.feed(b"more text") == "" and extractor.binary
+
+    embedder = HashingEmbedder(384)
+    vectors = embedder.embed(["the dragon sleeps", "the dragon sleeps", "a castle on the hill", ""])
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0)
+    assert vectors[0] @ vectors[1] > 0.99 and vectors[0] @ vectors[2] < 0.5
+
+    # A book sized index, each chunk found again by its own embedding
+    rng = np.random.default_rng(7)
+    matrix = rng.standard_normal((40000, 384)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    for quantization in ("int8", "float16"):
+        store = VectorIndexStore(str(tmp_path / quantization), quantization)
+        store.build("book", [f"chunk {i}" for i in range(len(matrix))], matrix)
+        index = store.open("book")
+        assert index.vectors.dtype == np.dtype(quantization)
+        assert store.open("book") is index
+
+        scores, positions = index.search(matrix[[12, 39999]], 5)
+        assert positions[:, 0].tolist() == [12, 39999]
+        assert scores[0, 0] > 0.99 and scores[0, 0] >= scores[0, 1]
+        assert index.chunk(39999) == "chunk 39999"
+
+        store.delete("book")
+        assert store.open("book") is None
+
+@pytest.mark.asyncio
+async def test_conversation_retrieves_passages(client, db, auth_headers):
+
+    passages = [
+        "The lighthouse keeper counted the ships every night.",
+        "Wheat fields stretched along the river to the mill.",
+        "The orchestra tuned their violins before the overture.",
+    ]
+    body = "\n\n".join(passage + " " + "Filler sentence number %d." % i * 30 for i, passage in enumerate(passages))
+    uploaded = (await client.put(
+        "/documents/stream", headers=auth_headers, params={"title": "Anthology.txt"}, content=body.encode()
+    )).json()
+
+    await service.process_document_ingestion(await db.get(Document, uploaded["id"]))
+
+    convo = (await client.post(
+        "/conversations", headers=auth_headers, json={"document_id": uploaded["id"]})).json()
+    response = await client.post(
+        f"/conversations/{convo['id']}", headers=auth_headers,
+        json={"role": "user", "content": "How many ships did the lighthouse keeper count?"}
+    )
+    reply = response.json()["content"]
+    assert reply.startswith(passages[0])
+
+    await client.delete(f"/documents/{uploaded['document_key']}", headers=auth_headers)
+    assert service.vector_store.open(uploaded["checksum"]) is None
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+
+import pytest
+from sqlalchemy import select, update
+
+from app.modules.documents import service
+from app.modules.documents.ingestion import IngestionWorkerPool
+from app.modules.documents.models import Document, IngestionJob, IngestionStatus
+
+@pytest.mark.asyncio
+async def test_ingestion_worker_pool(client, db, auth_headers, session_factory):
+
+    uploaded = {}
+    for title in ("Ingested", "Flaky", "Stuck", "Cancelled"):
+        response = await client.put(
+            "/documents/stream", headers=auth_headers, params={"title": title}, content=os.urandom(1024))
+        assert response.json()["ingestion_status"] == IngestionStatus.PENDING.name
+        uploaded[title] = response.json()["id"]
+
+    response = await client.delete(f"/llm/cancel_ingestion/{uploaded['Cancelled']}")
+    assert response.json()["document_id"] == uploaded["Cancelled"]
+    assert response.json()["ingestion_status"] == IngestionStatus.TERMINATED.name
+
+    calls, in_flight, max_in_flight, published = {}, 0, 0, {}
+    async def ingest(document):
+        nonlocal in_flight, max_in_flight
+        calls[document.id] = calls.get(document.id, 0) + 1
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            if document.id == uploaded["Flaky"] and calls[document.id] == 1:
+                raise ConnectionError("LLM unavailable")
+            await asyncio.sleep(10 if document.id == uploaded["Stuck"] else 0.01)
+        finally:
+            in_flight -= 1
+
+    pool = IngestionWorkerPool(
+        session_factory, ingest,
+        concurrency=2, timeout=0.2, max_attempts=2, retry_backoff=0, poll_interval=0.05,
+        on_status=lambda document_id, status: published.setdefault(document_id, []).append(status)
+    )
+    pool.start()
+    final = {IngestionStatus.COMPLETED.name, IngestionStatus.FAILED.name, IngestionStatus.TERMINATED.name}
+    try:
+        for _ in range(100):
+            db.expire_all()
+            documents = (await db.execute(select(Document).where(Document.id.in_(uploaded.values())))).scalars().all()
+            if all(document.ingestion_status in final for document in documents):
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        await pool.stop()
+
+    status = {document.title: document.ingestion_status for document in documents}
+    assert status == {
+        "Ingested": IngestionStatus.COMPLETED.name,
+        "Flaky": IngestionStatus.COMPLETED.name,
+        "Stuck": IngestionStatus.FAILED.name,
+        "Cancelled": IngestionStatus.TERMINATED.name,
+    }
+    assert (calls[uploaded["Flaky"]], calls[uploaded["Stuck"]]) == (2, 2)
+    assert uploaded["Cancelled"] not in calls
+    assert max_in_flight <= 2
+    assert published[uploaded["Flaky"]] == ["IN_PROGRESS", "PENDING", "IN_PROGRESS", "COMPLETED"]
+    assert published[uploaded["Stuck"]][-1] == "FAILED"
+
+    stuck = (await db.execute(select(IngestionJob).where(IngestionJob.document_id == uploaded["Stuck"]))).scalar_one()
+    assert stuck.last_error == "Timed out after 0.2s"
+    response = await client.get(f"/llm/ingestion_status/{uploaded['Ingested']}")
+    assert response.json()["ingestion_status"] == IngestionStatus.COMPLETED.name
+
+    for document in documents:
+        await client.delete(f"/documents/{document.document_key}", headers=auth_headers)
+
+@pytest.mark.asyncio
+async def test_stream_ingestion_status(client, db, auth_headers):
+
+    uploaded = []
+    for title in ("Waiting", "Done"):
+        response = await client.put(
+            "/documents/stream", headers=auth_headers, params={"title": title}, content=os.urandom(1024))
+        uploaded.append(response.json())
+    waiting, done = (document["id"] for document in uploaded)
+    await db.execute(update(Document).where(Document.id == done).values(ingestion_status=IngestionStatus.COMPLETED.name))
+    await db.commit()
+
+    response = await client.get("/llm/ingestion_status/stream", params={"document_id": [waiting, 999999]})
+    assert response.status_code == 422
+
+    stream = asyncio.create_task(
+        client.get("/llm/ingestion_status/stream", params={"document_id": [waiting, done, waiting]}))
+    while waiting not in service.ingestion_events.topics():
+        await asyncio.sleep(0.01)
+    service.ingestion_events.publish(waiting, IngestionStatus.IN_PROGRESS.name)
+    await asyncio.sleep(0.01)
+    # Unchanged status is not sent again
+    service.ingestion_events.publish(waiting, IngestionStatus.IN_PROGRESS.name)
+    await client.delete(f"/llm/cancel_ingestion/{waiting}")
+
+    response = await asyncio.wait_for(stream, 5)
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events == [
+        {"document_id": waiting, "ingestion_status": IngestionStatus.PENDING.name},
+        {"document_id": done, "ingestion_status": IngestionStatus.COMPLETED.name},
+        {"document_id": waiting, "ingestion_status": IngestionStatus.IN_PROGRESS.name},
+        {"document_id": waiting, "ingestion_status": IngestionStatus.TERMINATED.name},
+    ]
+    assert service.ingestion_events.topics() == []
+
+    for document in uploaded:
+        await client.delete(f"/documents/{document['document_key']}", headers=auth_headers)
@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.common.exceptions import LLMUnavailableException
+from app.modules.documents.llm import HTTPLLMClient, SimulatedLLMClient
+from app.modules.documents.llm_simulator import LatencyDistribution, LLMSimulator, create_simulator_app
+
+@pytest.mark.asyncio
+async def test_llm_client():
+
+    limits = dict(max_concurrency=1, queue_timeout=0.05, timeout=1, max_attempts=3, retry_backoff=0)
+    passages = ["The keeper lit the lamp.", "Ships passed in the night."]
+    async def document():
+        for chunk in (b"first part, ", b"second part"):
+            yield chunk
+    simulator_app = create_simulator_app(LLMSimulator("fixed:0", "fixed:0", 0))
+
+    # Served by the simulator, through the pooled HTTP client
+    llm = HTTPLLMClient("http://llm", transport=httpx.ASGITransport(app=simulator_app), **limits)
+    assert await llm.complete("What did the keeper do?", passages) == "\n\n".join(passages)
+    await llm.ingest(1, document)
+    await llm.close()
+
+    # Overloaded twice, then answering
+    calls, bodies = [], []
+    async def flaky(request):
+        calls.append(request.url.path)
+        bodies.append(await request.aread())
+        if len(calls) <= 2:
+            return httpx.Response(503)
+        return await httpx.ASGITransport(app=simulator_app).handle_async_request(request)
+    llm = HTTPLLMClient("http://llm", transport=httpx.MockTransport(flaky), **limits)
+    assert await llm.complete("Again?", passages[:1]) == passages[0]
+    assert calls == ["/v1/generate"] * 3
+    # Every attempt streams the document afresh
+    calls.clear(), bodies.clear()
+    await llm.ingest(3, document)
+    assert bodies == [b"first part, second part"] * 3
+
+    # Down for good, given up after max_attempts
+    llm = HTTPLLMClient("http://llm", transport=httpx.MockTransport(lambda request: httpx.Response(503)), **limits)
+    with pytest.raises(LLMUnavailableException, match="gave up after 3 attempts"):
+        await llm.ingest(2, document)
+
+    # A call waiting to retry gives its slot up in the meantime
+    attempts = []
+    async def down_once(request):
+        attempts.append(await request.aread())
+        if len(attempts) == 1:
+            return httpx.Response(503)
+        return await httpx.ASGITransport(app=simulator_app).handle_async_request(request)
+    llm = HTTPLLMClient("http://llm", transport=httpx.MockTransport(down_once), **{**limits, "retry_backoff": 0.4})
+    retrying = asyncio.create_task(llm.ingest(4, document))
+    while not attempts:
+        await asyncio.sleep(0.01)
+    assert await llm.complete("Meanwhile?", passages[:1]) == passages[0]
+    await retrying
+    assert len(attempts) == 3
+
+    # One slot: a second call fails fast while the first is streaming
+    slow = SimulatedLLMClient(LLMSimulator("fixed:0", "fixed:0", 20), **limits)
+    tokens = slow.generate("Slowly?", ["one two three four five"])
+    assert await tokens.__anext__() == "one "
+    with pytest.raises(LLMUnavailableException) as error:
+        await slow.complete("Meanwhile?", [])
+    assert error.value.status_code == 503
+    # Started streams take the slot before returning, and give it back when closed
+    with pytest.raises(LLMUnavailableException):
+        await slow.stream("Meanwhile?", [])
+    await tokens.aclose()
+    started = await slow.stream("Now?", ["six seven"])
+    assert [token async for token in started] == ["six ", "seven"]
+    assert await slow.complete("Now?", ["six"]) == "six"
+
+    # A stalled answer times out between tokens, and is not restarted
+    stalled = SimulatedLLMClient(LLMSimulator("fixed:0", "fixed:0", 0.5), **{**limits, "timeout": 0.1})
+    with pytest.raises(LLMUnavailableException, match="cut short"):
+        await stalled.complete("Stalled?", ["one two"])
+
+    assert 0 < LatencyDistribution("lognormal:0.5,2").sample() and LatencyDistribution("uniform:1,2").sample() >= 1
+    with pytest.raises(ValueError):
+        LatencyDistribution("normal:1")
@@ -0,0 +1,62 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app.modules.documents import service
+from app.modules.documents.models import UploadSession
+
+@pytest.mark.asyncio
+async def test_resumable_upload(client, db, auth_headers, session_factory):
+
+    body = os.urandom(300 * 1024)
+    response = await client.post(
+        "/documents/uploads", headers=auth_headers,
+        json={"title": "Large Book.pdf", "total_bytes": len(body)}
+    )
+    assert response.status_code == 201
+    upload_id = response.json()["id"]
+    assert response.json()["received_bytes"] == 0
+
+    response = await client.put(
+        f"/documents/uploads/{upload_id}", headers=auth_headers, params={"offset": 0}, content=body[:100 * 1024])
+    assert response.json()["received_bytes"] == 100 * 1024
+
+    # A retried chunk is refused with the offset to resume from
+    response = await client.put(
+        f"/documents/uploads/{upload_id}", headers=auth_headers, params={"offset": 0}, content=body[:100 * 1024])
+    assert response.status_code == 409
+    assert response.headers["upload-offset"] == str(100 * 1024)
+
+    response = await client.post(f"/documents/uploads/{upload_id}/complete", headers=auth_headers)
+    assert response.status_code == 409
+
+    offset = (await client.get(f"/documents/uploads/{upload_id}", headers=auth_headers)).json()["received_bytes"]
+    response = await client.put(
+        f"/documents/uploads/{upload_id}", headers=auth_headers, params={"offset": offset}, content=body[offset:])
+    assert response.json()["received_bytes"] == len(body)
+
+    response = await client.post(f"/documents/uploads/{upload_id}/complete", headers=auth_headers)
+    assert response.status_code == 200
+    document = response.json()
+    assert document["title"] == "Large Book.pdf"
+    assert document["size_bytes"] == len(body)
+    response = await client.get(f"/documents/{document['document_key']}/download", headers=auth_headers)
+    assert response.content == body
+    assert not os.path.exists(os.path.join(service.settings.UPLOAD_SESSION_PATH, upload_id))
+    assert (await client.get(f"/documents/uploads/{upload_id}", headers=auth_headers)).status_code == 404
+    await client.delete(f"/documents/{document['document_key']}", headers=auth_headers)
+
+    # Abandoned sessions are removed with their chunks
+    abandoned = (await client.post(
+        "/documents/uploads", headers=auth_headers, json={"title": "Abandoned", "total_bytes": 1024}
+    )).json()["id"]
+    await client.put(f"/documents/uploads/{abandoned}", headers=auth_headers, params={"offset": 0}, content=b"x" * 512)
+    await db.execute(
+        update(UploadSession).where(UploadSession.id == abandoned).values(expires_at=datetime.now() - timedelta(minutes=1)))
+    await db.commit()
+    await service.expire_upload_sessions()
+    assert not os.path.exists(os.path.join(service.settings.UPLOAD_SESSION_PATH, abandoned))
+    db.expire_all()
+    assert await db.get(UploadSession, abandoned) is None
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import shutil
+from typing import AsyncIterator, Tuple
+from uuid import uuid4
+
+from starlette.requests import ClientDisconnect
+
+from app.common.exceptions import InvalidUserParameters
+
+class UploadSessionFiles:
+    """
+        Chunks of resumable uploads on local disk, one directory per session
+        and one file per accepted chunk named after its offset. A chunk is
+        written to a temp file first and only takes its offset once the
+        session row has moved past it, so a retried or concurrent request
+        for the same offset never overwrites accepted bytes.
+    """
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+
+    def _session_path(self, upload_id: str) -> str:
+        return os.path.join(self.base_path, upload_id)
+
+    def _chunk_path(self, upload_id: str, offset: int) -> str:
+        # Zero padded, so name order is offset order
+        return os.path.join(self._session_path(upload_id), f"{offset:020d}.chunk")
+
+    async def create(self, upload_id: str) -> None:
+        await asyncio.to_thread(os.makedirs, self._session_path(upload_id), exist_ok=True)
+
+    async def write_chunk(self, upload_id: str, chunks: AsyncIterator[bytes], max_bytes: int) -> Tuple[str, int]:
+        """
+            Writes a request body to a temp file of the session and returns
+            it with the number of bytes received. A body cut short by the
+            client is kept, the upload resumes after its last byte.
+        """
+        temp_path = os.path.join(self._session_path(upload_id), f".{uuid4().hex}.part")
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise InvalidUserParameters("chunk goes past the declared upload size")
+                await asyncio.to_thread(f.write, chunk)
+        except ClientDisconnect:
+            pass
+        except BaseException:
+            await asyncio.to_thread(f.close)
+            await self.discard(temp_path)
+            raise
+        await asyncio.to_thread(f.close)
+        return temp_path, size
+
+    async def commit_chunk(self, upload_id: str, temp_path: str, offset: int) -> None:
+        await asyncio.to_thread(os.replace, temp_path, self._chunk_path(upload_id, offset))
+
+    async def discard(self, temp_path: str) -> None:
+        try:
+            await asyncio.to_thread(os.remove, temp_path)
+        except FileNotFoundError:
+            pass
+
+    async def read(self, upload_id: str, total_bytes: int, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """Assembled upload, the chunks read back in offset order"""
+        offset = 0
+        while offset < total_bytes:
+            path = self._chunk_path(upload_id, offset)
+            if not os.path.exists(path):
+                raise InvalidUserParameters(f"upload is missing the chunk at offset {offset}")
+            f = await asyncio.to_thread(open, path, "rb")
+            try:
+                while chunk := await asyncio.to_thread(f.read, chunk_size):
+                    offset += len(chunk)
+                    yield chunk
+            finally:
+                f.close()
+
+    async def delete(self, upload_id: str) -> None:
+        await asyncio.to_thread(shutil.rmtree, self._session_path(upload_id), True)
@@ -1,9 +1,12 @@
+from datetime import datetime
 from fastapi import APIRouter, Depends
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import List
+from typing import List, Optional
 
 from app.common.dependencies import authorization_level_required
 from app.common.exceptions import AccountDeactivatedError
+from app.common.export import ExportFormat
+from app.modules.documents.models import IngestionStatus
 from app.modules.users.models import AccountLevel
 from app.modules.users.schemas import TokenResponse, LoginRequest, RegisterRequest, UpdateProfileResponse, UpdateProfileRequest, \
         UpdatePasswordRequest, UpgradeAccountRequest, UserProfile, MessageResponse
@@ -102,6 +105,9 @@ class SuperAdminRoutes:
         self.router.post(   '/user/{user_id}/deactivate'    )(self.deactivate_user)
         self.router.delete( '/user/{user_id}/delete'        )(self.delete_user)
         self.router.get(    '/documents'                    )(self.list_documents)
+        self.router.post(   '/documents/reconcile-stars'    )(self.reconcile_star_counts)
+        self.router.get(    '/export/users'                 )(self.export_users)
+        self.router.get(    '/export/documents'             )(self.export_documents)
 
     async def list_users(
             self, page:int = None, service: UserService = Depends(UserService)
@@ -128,3 +134,26 @@ class SuperAdminRoutes:
     async def list_documents(self, service: UserService = Depends(UserService)):
         documents = await service.list_documents()
         return documents
+
+    async def reconcile_star_counts(
+            self, service: UserService = Depends(UserService)
+            ) -> MessageResponse:
+        corrected = await service.reconcile_star_counts()
+        return {"message": f"Star counts corrected for {corrected} documents"}
+
+    async def export_users(
+            self, format: ExportFormat = ExportFormat.NDJSON,
+            account_type: Optional[str] = None, is_active: Optional[bool] = None,
+            created_after: Optional[datetime] = None, service: UserService = Depends(UserService)
+            ):
+        return service.export_users(format, account_type, is_active, created_after)
+
+    async def export_documents(
+            self, format: ExportFormat = ExportFormat.NDJSON,
+            user_id: Optional[int] = None, is_active: Optional[bool] = None,
+            is_private: Optional[bool] = None, ingestion_status: Optional[IngestionStatus] = None,
+            uploaded_after: Optional[datetime] = None, service: UserService = Depends(UserService)
+            ):
+        return service.export_documents(
+            format, user_id, is_active, is_private,
+            ingestion_status.name if ingestion_status else None, uploaded_after)
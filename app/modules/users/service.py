@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import Depends
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -6,6 +9,8 @@ from app.common.database import get_db
 from app.common.auth import hash_password, verify_password, create_access_token
 from app.common.dependencies import get_current_user, get_db
 from app.common.exceptions import InvalidCredentialsException, UserNotFoundException
+from app.common.export import ExportFormat, export_response
+from app.modules.documents import crud as document_crud
 from app.modules.documents.models import Document
 from app.modules.users import crud
 from app.modules.users.models import User
@@ -113,3 +118,47 @@ class UserService:
 
         result = await self.db.execute(paginated_query)
         return result.scalars().all()
+
+    def export_users(
+            self, export_format: ExportFormat, account_type: Optional[str] = None,
+            is_active: Optional[bool] = None, created_after: Optional[datetime] = None):
+        query = select(
+            User.id, User.username, User.email, User.full_name,
+            User.account_type, User.is_active, User.created_at
+        ).order_by(User.id)
+
+        if account_type is not None:
+            query = query.where(User.account_type == account_type)
+        if is_active is not None:
+            query = query.where(User.is_active == is_active)
+        if created_after is not None:
+            query = query.where(User.created_at >= created_after)
+
+        return export_response(self.db, query, export_format, "users")
+
+    def export_documents(
+            self, export_format: ExportFormat, user_id: Optional[int] = None,
+            is_active: Optional[bool] = None, is_private: Optional[bool] = None,
+            ingestion_status: Optional[str] = None, uploaded_after: Optional[datetime] = None):
+        query = select(
+            Document.id, Document.document_key, Document.version, Document.title,
+            Document.user_id, Document.is_active, Document.is_private_document,
+            Document.views, Document.star_count, Document.ingestion_status,
+            Document.uploaded_at, Document.file_path
+        ).order_by(Document.id)
+
+        if user_id is not None:
+            query = query.where(Document.user_id == user_id)
+        if is_active is not None:
+            query = query.where(Document.is_active == is_active)
+        if is_private is not None:
+            query = query.where(Document.is_private_document == is_private)
+        if ingestion_status is not None:
+            query = query.where(Document.ingestion_status == ingestion_status)
+        if uploaded_after is not None:
+            query = query.where(Document.uploaded_at >= uploaded_after)
+
+        return export_response(self.db, query, export_format, "documents")
+
+    async def reconcile_star_counts(self) -> int:
+        return await document_crud.reconcile_star_counts(self.db)
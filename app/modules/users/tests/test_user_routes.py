@@ -73,3 +73,36 @@ async def test_login_with_new_password(client):
     })
     assert response.status_code == 200
     assert "access_token" in response.json()
+
+@pytest.mark.asyncio
+async def test_admin_export_streams(client):
+    import csv
+    import io
+    import json
+
+    response = await client.get("/admin/export/users", headers=get_header())
+    assert response.status_code == 403
+
+    await client.post("/users/profile/account/update-account-type", headers=get_header(), json={
+        "account_type": "MODERATOR"
+    })
+
+    response = await client.get("/admin/export/users", headers=get_header(), params={"is_active": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert "newuser" in [user["username"] for user in users]
+    assert all("hashed_password" not in user for user in users)
+
+    response = await client.get(
+        "/admin/export/users", headers=get_header(),
+        params={"format": "csv", "account_type": "MODERATOR"}
+    )
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["username"] for row in rows] == ["newuser"]
+
+    response = await client.get(
+        "/admin/export/documents", headers=get_header(), params={"format": "csv", "is_private": True}
+    )
+    assert response.status_code == 200
+    assert response.text.splitlines()[0].startswith("id,document_key,version,title")
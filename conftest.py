@@ -1,4 +1,5 @@
 import os
+import pytest
 import pytest_asyncio
 import asyncio
 from httpx import AsyncClient
@@ -9,6 +10,15 @@ from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.common.database import get_db, Base
 from app.common.auth import hash_password
+from app.common.constants import EmbeddingConstants, PassageIndexConstants
+from app.modules.conversations import service as conversation_service
+from app.modules.documents import service as document_service
+from app.modules.documents.ann import PassageIndex
+from app.modules.documents.embeddings import VectorIndexStore
+from app.modules.documents.llm import SimulatedLLMClient
+from app.modules.documents.llm_simulator import LLMSimulator
+from app.modules.documents.storage import get_storage
+from app.modules.documents.uploads import UploadSessionFiles
 from app.modules.users.models import User, AccountLevel
 from app.config import settings
 
@@ -52,6 +62,54 @@ async def client(db: AsyncSession):
     async with AsyncClient(app=app, base_url=f"http://localhost/api/{settings.API_VERSION}") as ac:
         yield ac
 
+# Stored documents and resumable upload chunks go under the test's own
+# tmp_path as well, returns the storage directory
+@pytest.fixture(autouse=True)
+def isolated_storage(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "STORAGE_PATH", str(tmp_path / "uploads"))
+    monkeypatch.setattr(settings, "UPLOAD_SESSION_PATH", str(tmp_path / "uploads" / "sessions"))
+    monkeypatch.setattr(document_service, "storage", get_storage())
+    monkeypatch.setattr(document_service, "upload_files", UploadSessionFiles(settings.UPLOAD_SESSION_PATH))
+    return tmp_path / "uploads"
+
+# Sessions on the test database for the code that opens its own instead of
+# using the request's (background tasks, streamed responses)
+@pytest.fixture
+def session_factory(monkeypatch):
+    monkeypatch.setattr(document_service, "async_session", TestingSessionLocal)
+    monkeypatch.setattr(conversation_service, "async_session", TestingSessionLocal)
+    return TestingSessionLocal
+
+# Logged in as the shared test account, registered by the first test that needs it
+@pytest_asyncio.fixture
+async def auth_headers(client):
+    await client.post("/users/auth/register", json={
+        "username": "ctadel",
+        "email": "ctadel@example.com",
+        "full_name": "Test User",
+        "password": "testpass"
+    })
+    response = await client.post("/users/auth/login", json={"username": "ctadel", "password": "testpass"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+# The simulated LLM answers without any delay in tests
+@pytest.fixture(autouse=True)
+def instant_llm(monkeypatch):
+    limits = dict(max_concurrency=8, queue_timeout=5, timeout=5, max_attempts=1, retry_backoff=0)
+    for name in ("ingestion_llm", "chat_llm"):
+        client = SimulatedLLMClient(LLMSimulator("fixed:0", "fixed:0", 0), **limits)
+        monkeypatch.setattr(document_service, name, client)
+
+# Embedding and passage indexes are written under the test's own tmp_path,
+# never into the working tree
+@pytest.fixture(autouse=True)
+def isolated_indexes(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_service, "vector_store", VectorIndexStore(
+        str(tmp_path / "indexes"), settings.EMBEDDING_QUANTIZATION, EmbeddingConstants.MAX_OPEN_INDEXES))
+    monkeypatch.setattr(document_service, "passage_index", PassageIndex(
+        str(tmp_path / "passage_index"), settings.PASSAGE_INDEX_NPROBE,
+        settings.PASSAGE_INDEX_MAX_SEGMENTS, PassageIndexConstants.MERGE_FACTOR))
+
 # Create a test user
 @pytest_asyncio.fixture
 async def test_user(db: AsyncSession):
@@ -0,0 +1,129 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.modules.documents.ann import PassageIndex
+
+class ArgumentParserService:
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description="Compare recall and latency of the passage index with an exact search"
+        )
+        self._add_arguments()
+
+    def _add_arguments(self):
+        self.parser.add_argument(
+            "--documents", "-d",
+            type=int,
+            required=False,
+            default=500,
+            help="Number of indexed documents"
+        )
+        self.parser.add_argument(
+            "--passages", "-p",
+            type=int,
+            required=False,
+            default=400,
+            help="Passages per document"
+        )
+        self.parser.add_argument(
+            "--dimensions",
+            type=int,
+            required=False,
+            default=384,
+            help="Embedding dimensions"
+        )
+        self.parser.add_argument(
+            "--queries", "-q",
+            type=int,
+            required=False,
+            default=200,
+            help="Number of search queries"
+        )
+        self.parser.add_argument(
+            "--k", "-k",
+            type=int,
+            required=False,
+            default=10,
+            help="Results per query"
+        )
+        self.parser.add_argument(
+            "--nprobe",
+            type=int,
+            nargs="+",
+            required=False,
+            default=[1, 4, 8, 16, 32],
+            help="Inverted lists probed per segment"
+        )
+
+    def parse_args(self):
+        return self.parser.parse_args()
+
+
+def normalized(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+
+
+def _main(documents, passages, dimensions, queries, k, nprobe):
+    rng = np.random.default_rng(7)
+    # Passages around a few hundred topics, like a library of many subjects
+    topics = rng.standard_normal((max(1, documents // 2), dimensions))
+    corpus = [
+        normalized(topics[rng.integers(0, len(topics), passages)] + rng.standard_normal((passages, dimensions)) * 0.8)
+        for _ in range(documents)
+    ]
+    everything = np.concatenate(corpus)
+    samples = everything[rng.choice(len(everything), queries)]
+    query_vectors = normalized(samples + rng.standard_normal(samples.shape) * 0.5)
+    print(f"{len(everything)} passages in {documents} documents, {dimensions} dimensions, top {k}\n")
+
+    exact_ids, exact_latencies = [], []
+    for query in query_vectors:
+        started = time.perf_counter()
+        scores = everything @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        exact_latencies.append(time.perf_counter() - started)
+        exact_ids.append(set(top.tolist()))
+    p50, p95 = percentiles(exact_latencies)
+    print(f"{'exact':<12} recall {1:6.3f}   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = PassageIndex(index_dir, nprobe=nprobe[0], max_segments=16, merge_factor=8)
+        started = time.perf_counter()
+        for document_id, vectors in enumerate(corpus):
+            index.add(document_id, vectors)
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        while index.merge():
+            pass
+        merge_seconds = time.perf_counter() - started
+        segments = len(os.listdir(index_dir)) - 2
+        print(f"{'':<12} indexed in {build_seconds:.1f}s, merged into {segments} segments in {merge_seconds:.1f}s\n")
+
+        for probes in nprobe:
+            recall, latencies = [], []
+            for query, exact in zip(query_vectors, exact_ids):
+                started = time.perf_counter()
+                hits = index.search(query, k, nprobe=probes)
+                latencies.append(time.perf_counter() - started)
+                found = {hit.document_id * passages + hit.position for hit in hits}
+                recall.append(len(found & exact) / k)
+            p50, p95 = percentiles(latencies)
+            print(f"{f'nprobe {probes}':<12} recall {np.mean(recall):6.3f}   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+
+if __name__ == "__main__":
+    args = ArgumentParserService().parse_args()
+    _main(args.documents, args.passages, args.dimensions, args.queries, args.k, args.nprobe)
+    exit(0)
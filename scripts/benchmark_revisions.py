@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.modules.documents.storage import DeltaStorage, LocalStorage
+
+class ArgumentParserService:
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description="Compare full copies and delta storage for a long chain of document revisions"
+        )
+        self._add_arguments()
+
+    def _add_arguments(self):
+        self.parser.add_argument(
+            "--revisions", "-r",
+            type=int,
+            required=False,
+            default=50,
+            help="Number of versions in the revision chain"
+        )
+        self.parser.add_argument(
+            "--lines", "-l",
+            type=int,
+            required=False,
+            default=20000,
+            help="Lines in the first version of the document"
+        )
+        self.parser.add_argument(
+            "--edits", "-e",
+            type=int,
+            required=False,
+            default=40,
+            help="Lines inserted, replaced or deleted per revision"
+        )
+        self.parser.add_argument(
+            "--keyframe-interval", "-k",
+            type=int,
+            required=False,
+            default=10,
+            help="Delta storage keyframe interval"
+        )
+
+    def parse_args(self):
+        return self.parser.parse_args()
+
+
+def revise(lines, edits, revision):
+    lines = list(lines)
+    for _ in range(edits):
+        position = random.randrange(len(lines))
+        action = random.random()
+        if action < 0.4:
+            lines[position] = f"Rewritten in revision {revision}: {random.random()}\n".encode()
+        elif action < 0.8:
+            lines.insert(position, f"Added in revision {revision}: {random.random()}\n".encode())
+        elif len(lines) > 1:
+            del lines[position]
+    return lines
+
+
+async def store_chain(storage, versions):
+    async def chunks(body):
+        yield body
+
+    paths, previous = [], None
+    for version, body in enumerate(versions, start=1):
+        stored = await storage.upload_stream(chunks(body), f"script_{version}", previous_path=previous)
+        paths.append(stored.file_path)
+        previous = stored.file_path
+    return paths
+
+
+async def measure(name, storage, versions):
+    started = time.perf_counter()
+    paths = await store_chain(storage, versions)
+    write_seconds = time.perf_counter() - started
+
+    read_latencies = []
+    for path, body in zip(paths, versions):
+        started = time.perf_counter()
+        assert await storage.read_file(path) == body
+        read_latencies.append(time.perf_counter() - started)
+
+    stored_bytes = sum(os.path.getsize(path) for path in paths)
+    read_latencies.sort()
+    print(
+        f"{name:<8} stored {stored_bytes / 1024 / 1024:8.2f} MB   "
+        f"write {write_seconds * 1000 / len(paths):7.2f} ms/version   "
+        f"read p50 {read_latencies[len(read_latencies) // 2] * 1000:7.2f} ms   "
+        f"read max {read_latencies[-1] * 1000:7.2f} ms"
+    )
+    return stored_bytes
+
+
+async def _main(revisions, lines, edits, keyframe_interval):
+    random.seed(7)
+    document = [f"INT. LIBRARY - NIGHT. Line {i} of the screenplay, {random.random()}\n".encode() for i in range(lines)]
+    chain = [document]
+    for revision in range(2, revisions + 1):
+        chain.append(revise(chain[-1], edits, revision))
+    versions = [b"".join(version) for version in chain]
+    print(f"{revisions} revisions of a {len(versions[0]) / 1024 / 1024:.2f} MB document, {edits} edits each\n")
+
+    with tempfile.TemporaryDirectory() as full_dir, tempfile.TemporaryDirectory() as delta_dir:
+        full = await measure("full", LocalStorage(full_dir), versions)
+        delta = await measure("delta", DeltaStorage(delta_dir, keyframe_interval), versions)
+
+    print(f"\nDelta storage uses {delta / full:.1%} of the space of full copies")
+
+
+if __name__ == "__main__":
+    args = ArgumentParserService().parse_args()
+    asyncio.run(_main(args.revisions, args.lines, args.edits, args.keyframe_interval))
+    exit(0)
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.modules.documents.embeddings import VectorIndexStore
+
+class ArgumentParserService:
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description="Measure the search latency of a document vector index"
+        )
+        self._add_arguments()
+
+    def _add_arguments(self):
+        self.parser.add_argument(
+            "--chunks", "-c",
+            type=int,
+            required=False,
+            default=40000,
+            help="Chunks in the index, 40000 is about a 40 MB book"
+        )
+        self.parser.add_argument(
+            "--dimensions",
+            type=int,
+            required=False,
+            default=384,
+            help="Embedding dimensions"
+        )
+        self.parser.add_argument(
+            "--queries", "-q",
+            type=int,
+            required=False,
+            default=200,
+            help="Number of search queries"
+        )
+        self.parser.add_argument(
+            "--k", "-k",
+            type=int,
+            required=False,
+            default=5,
+            help="Results per query"
+        )
+
+    def parse_args(self):
+        return self.parser.parse_args()
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.95)] * 1000
+
+
+def _main(chunks, dimensions, queries, k):
+    rng = np.random.default_rng(7)
+    matrix = rng.standard_normal((chunks, dimensions)).astype(np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    samples = rng.choice(chunks, queries)
+    print(f"{chunks} chunks, {dimensions} dimensions, top {k}\n")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        for quantization in ("int8", "float16"):
+            store = VectorIndexStore(os.path.join(index_dir, quantization), quantization)
+            store.build("book", [f"chunk {i}" for i in range(chunks)], matrix)
+            index = store.open("book")
+
+            found, latencies = 0, []
+            for sample in samples:
+                started = time.perf_counter()
+                _, positions = index.search(matrix[sample], k)
+                latencies.append(time.perf_counter() - started)
+                found += positions[0, 0] == sample
+            p50, p95 = percentiles(latencies)
+            print(f"{quantization:<8} self found {found / queries:6.3f}   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+
+if __name__ == "__main__":
+    args = ArgumentParserService().parse_args()
+    _main(args.chunks, args.dimensions, args.queries, args.k)
+    exit(0)
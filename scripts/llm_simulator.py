@@ -0,0 +1,78 @@
+import argparse
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.modules.documents.llm_simulator import LLMSimulator, create_simulator_app
+
+class ArgumentParserService:
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(
+            description="Serve a simulated LLM backend, for LLM_BACKEND=http load tests"
+        )
+        self._add_arguments()
+
+    def _add_arguments(self):
+        self.parser.add_argument(
+            "--host",
+            type=str,
+            required=False,
+            default="127.0.0.1",
+            help="Interface to listen on"
+        )
+        self.parser.add_argument(
+            "--port", "-p",
+            type=int,
+            required=False,
+            default=8100,
+            help="Port to listen on, LLM_URL of the library"
+        )
+        self.parser.add_argument(
+            "--ingest-seconds", "-i",
+            type=str,
+            required=False,
+            default="uniform:3,10",
+            help='Ingestion time, as "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,P95"'
+        )
+        self.parser.add_argument(
+            "--first-token-seconds", "-f",
+            type=str,
+            required=False,
+            default="lognormal:0.4,1.5",
+            help="Time to the first token of an answer, same forms as --ingest-seconds"
+        )
+        self.parser.add_argument(
+            "--tokens-per-second", "-t",
+            type=float,
+            required=False,
+            default=50.0,
+            help="Rate of the answer tokens after the first, 0 for no delay"
+        )
+        self.parser.add_argument(
+            "--error-rate", "-e",
+            type=float,
+            required=False,
+            default=0.0,
+            help="Share of the calls answered 503"
+        )
+        self.parser.add_argument(
+            "--seed",
+            type=int,
+            required=False,
+            default=None,
+            help="Random seed, for repeatable runs"
+        )
+
+    def parse_args(self):
+        return self.parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = ArgumentParserService().parse_args()
+    simulator = LLMSimulator(
+        args.ingest_seconds, args.first_token_seconds, args.tokens_per_second, args.error_rate, args.seed)
+    uvicorn.run(create_simulator_app(simulator), host=args.host, port=args.port)
+    exit(0)
@@ -0,0 +1,217 @@
+"""
+    Query plan regression suite: runs every query issued by the crud
+    modules against a small seeded SQLite database and fails if any of
+    them has to fall back to a full table scan.
+
+    Without ANALYZE statistics SQLite picks an index whenever one is usable,
+    so a failure here means the query has no index to use at all.
+"""
+import re
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.common.database import Base
+from app.common.pagination import encode_cursor
+from app.modules.conversations import crud as conversation_crud
+from app.modules.conversations.models import Conversation, Message, Role
+from app.modules.conversations.schemas import ConversationCreateRequest, MessageCreate
+from app.modules.documents import crud as document_crud
+from app.modules.documents.models import Document, DocumentStar, IngestionJob
+from app.modules.users import crud as user_crud
+from app.modules.users.models import User
+from app.modules.users.schemas import RegisterRequest, UpdateProfileRequest
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+# Maintenance jobs that touch every row on purpose, mapped to the tables
+# they are allowed to scan
+MAINTENANCE_SCANS = {
+    "documents.refresh_trending_scores": {"documents", "document_trending"},
+    "documents.reconcile_star_counts": {"documents", "user_document_stats"},
+}
+
+QUERIES = {
+    # documents
+    "documents.create_document": lambda db, s: document_crud.create_document(
+        db, s.owner, "new-key", "New", "uploads/new-key_1", 1, False),
+    "documents.create_document_version": lambda db, s: document_crud.create_document_version(
+        db, s.document, s.owner, "Doc 1 v2", "uploads/key-1_2", False),
+    "documents.get_document_by_key": lambda db, s: document_crud.get_document_by_key(db, s.document_key),
+    "documents.get_document_files": lambda db, s: document_crud.get_document_files(db, s.document_key),
+    "documents.get_referenced_checksums": lambda db, s: document_crud.get_referenced_checksums(db, ["0" * 64, "1" * 64]),
+    "documents.is_content_ingested": lambda db, s: document_crud.is_content_ingested(db, "0" * 64),
+    "documents.get_cold_documents": lambda db, s: document_crud.get_cold_documents(db, datetime.now(), 100),
+    "documents.set_document_storage": lambda db, s: document_crud.set_document_storage(
+        db, s.document_id, "uploads/cold.gz", "GZIP"),
+    "documents.touch_documents": lambda db, s: document_crud.touch_documents(db, [s.document_id]),
+    "documents.create_upload_session": lambda db, s: document_crud.create_upload_session(
+        db, "a" * 32, s.owner.id, "Upload", False, 1024, datetime.now() + timedelta(hours=1)),
+    "documents.get_upload_session": lambda db, s: document_crud.get_upload_session(db, "a" * 32, s.owner.id),
+    "documents.count_upload_sessions": lambda db, s: document_crud.count_upload_sessions(db, s.owner.id),
+    "documents.advance_upload_session": lambda db, s: document_crud.advance_upload_session(
+        db, "a" * 32, 0, 512, datetime.now() + timedelta(hours=1)),
+    "documents.set_upload_session_completing": lambda db, s: document_crud.set_upload_session_completing(
+        db, "a" * 32, True, datetime.now() + timedelta(hours=1)),
+    "documents.delete_upload_session": lambda db, s: document_crud.delete_upload_session(db, "a" * 32),
+    "documents.delete_expired_upload_sessions": lambda db, s: document_crud.delete_expired_upload_sessions(db, 100),
+    "documents.claim_ingestion_jobs": lambda db, s: document_crud.claim_ingestion_jobs(
+        db, 4, datetime.now() + timedelta(minutes=5)),
+    "documents.finish_ingestion_job": lambda db, s: document_crud.finish_ingestion_job(
+        db, 1, s.document_id, "COMPLETED"),
+    "documents.retry_ingestion_job": lambda db, s: document_crud.retry_ingestion_job(
+        db, 1, s.document_id, datetime.now(), "error"),
+    "documents.cancel_ingestion_job": lambda db, s: document_crud.cancel_ingestion_job(db, s.document_id),
+    "documents.get_ingestion_statuses": lambda db, s: document_crud.get_ingestion_statuses(
+        db, [s.document_id, s.old_version_id]),
+    "documents.get_documents_by_keys": lambda db, s: document_crud.get_documents_by_keys(
+        db, [s.document_key, "key-2", "key-5"], s.reader.id),
+    "documents.get_public_documents_by_ids": lambda db, s: document_crud.get_public_documents_by_ids(
+        db, [s.document_id, s.old_version_id]),
+    "documents.get_starred_document_ids": lambda db, s: document_crud.get_starred_document_ids(
+        db, s.reader.id, [s.document_id]),
+    "documents.delete_document": lambda db, s: document_crud.delete_document(db, s.document_key),
+    "documents.get_user_documents": lambda db, s: document_crud.get_user_documents(db, s.owner.id),
+    "documents.add_views": lambda db, s: document_crud.add_views(db, {s.document_id: 3}),
+    "documents.compute_document_stats": lambda db, s: document_crud.compute_document_stats(db, s.owner.id),
+    "documents.refresh_user_document_stats": lambda db, s: document_crud.refresh_user_document_stats(db, s.owner.id),
+    "documents.get_document_stats": lambda db, s: document_crud.get_document_stats(db, s.owner.id),
+    "documents.fetch_explore_documents": lambda db, s: document_crud.fetch_explore_documents(
+        db, s.reader.id, 20, 0),
+    "documents.fetch_explore_documents[cursor]": lambda db, s: document_crud.fetch_explore_documents(
+        db, s.reader.id, 20, 0, encode_cursor(5, s.document_id)),
+    "documents.fetch_trending_documents": lambda db, s: document_crud.fetch_trending_documents(
+        db, s.reader.id, 20, 0),
+    "documents.fetch_trending_documents[cursor]": lambda db, s: document_crud.fetch_trending_documents(
+        db, s.reader.id, 20, 0, encode_cursor(1.5, s.document_id)),
+    "documents.refresh_trending_scores": lambda db, s: document_crud.refresh_trending_scores(
+        db, half_life_hours=24, star_weight=1.0, view_weight=0.2),
+    "documents.fetch_latest_documents": lambda db, s: document_crud.fetch_latest_documents(
+        db, s.reader.id, 20, 0),
+    "documents.fetch_latest_documents[cursor]": lambda db, s: document_crud.fetch_latest_documents(
+        db, s.reader.id, 20, 0, encode_cursor(datetime.now(), s.document_id)),
+    "documents.get_document_stars_public": lambda db, s: document_crud.get_document_stars_public(db, s.document_id),
+    "documents.get_document_stars": lambda db, s: document_crud.get_document_stars(db, s.document_id, s.reader.id),
+    "documents.set_document_stars": lambda db, s: document_crud.set_document_stars(db, s.document_id, s.owner.id),
+    "documents.delete_document_stars": lambda db, s: document_crud.delete_document_stars(
+        db, s.document_id, s.reader.id),
+    "documents.update_document_stars": lambda db, s: document_crud.update_document_stars(
+        db, s.owner.id, [s.document_id, s.old_version_id], [s.document_id + 1]),
+    "documents.reconcile_star_counts": lambda db, s: document_crud.reconcile_star_counts(db),
+
+    # conversations
+    "conversations.create_conversation": lambda db, s: conversation_crud.create_conversation(
+        db, s.reader.id, ConversationCreateRequest(document_id=s.document_id, title="Chat")),
+    "conversations.get_user_conversations": lambda db, s: conversation_crud.get_user_conversations(db, s.reader.id),
+    "conversations.get_conversation_by_id": lambda db, s: conversation_crud.get_conversation_by_id(db, s.convo_id),
+    "conversations.add_message": lambda db, s: conversation_crud.add_message(
+        db, s.convo_id, MessageCreate(role=Role.USER, content="Hello")),
+    "conversations.get_messages": lambda db, s: conversation_crud.get_messages(db, s.convo_id),
+    "conversations.archive_conversation": lambda db, s: conversation_crud.archive_conversation(
+        db, s.convo_id, s.reader.id),
+    "conversations.delete_conversation": lambda db, s: conversation_crud.delete_conversation(
+        db, s.convo_id, s.reader.id),
+
+    # users
+    "users.get_user_by_username": lambda db, s: user_crud.get_user_by_username(db, "reader"),
+    "users.get_user_by_id": lambda db, s: user_crud.get_user_by_id(db, s.reader.id),
+    "users.create_user": lambda db, s: user_crud.create_user(
+        db, RegisterRequest(username="plans", email="plans@example.com"), "hashed"),
+    "users.update_user": lambda db, s: user_crud.update_user(
+        db, s.reader, UpdateProfileRequest(full_name="Reader", email="reader2@example.com")),
+}
+
+
+async def _seed(db: AsyncSession) -> SimpleNamespace:
+    owner = User(username="owner", email="owner@example.com", hashed_password="x")
+    reader = User(username="reader", email="reader@example.com", hashed_password="x")
+    db.add_all([owner, reader])
+    await db.flush()
+
+    documents = []
+    now = datetime.now()
+    for index in range(30):
+        documents.append(Document(
+            user=owner, document_key=f"key-{index}", title=f"Doc {index}",
+            file_path=f"uploads/key-{index}_1", views=index, star_count=index % 3,
+            is_private_document=index % 5 == 0, uploaded_at=now - timedelta(hours=index),
+        ))
+    old_version = Document(
+        user=owner, document_key="key-0", title="Doc 0", file_path="uploads/key-0_0",
+        version=0, is_active=False,
+    )
+    db.add_all(documents + [old_version])
+    await db.flush()
+
+    db.add_all([DocumentStar(user_id=reader.id, document_id=doc.id) for doc in documents[:10]])
+    db.add_all([IngestionJob(document_id=doc.id) for doc in documents[:8]])
+    convo = Conversation(user_id=reader.id, document_id=documents[1].id, title="Seed")
+    db.add(convo)
+    await db.flush()
+    db.add_all([Message(conversation_id=convo.id, role=Role.USER, content=str(i)) for i in range(5)])
+    await db.commit()
+
+    await document_crud.refresh_trending_scores(db, half_life_hours=24, star_weight=1.0, view_weight=0.2)
+    await document_crud.refresh_user_document_stats(db, owner.id)
+
+    return SimpleNamespace(
+        owner=owner, reader=reader, convo_id=convo.id, old_version_id=old_version.id,
+        document=documents[1], document_id=documents[1].id, document_key=documents[1].document_key,
+    )
+
+
+@pytest_asyncio.fixture
+async def seeded_db():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as db:
+        seed = await _seed(db)
+        yield engine, db, seed
+    await engine.dispose()
+
+
+async def _capture_statements(engine, call):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0]
+        if statement.lstrip().split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"):
+            statements.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        await call()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+    return statements
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("query_name", QUERIES)
+async def test_query_uses_indexes(seeded_db, query_name):
+    engine, db, seed = seeded_db
+    statements = await _capture_statements(engine, lambda: QUERIES[query_name](db, seed))
+    assert statements, f"{query_name} did not issue any query"
+
+    tables = set(Base.metadata.tables)
+    allowed = MAINTENANCE_SCANS.get(query_name, set())
+    offenders = []
+    async with engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            for row in plan.all():
+                match = FULL_SCAN.match(row[-1])
+                if match and match.group(1) in tables and match.group(1) not in allowed:
+                    offenders.append(f"{row[-1]}\n    in: {statement}")
+
+    assert not offenders, f"{query_name} falls back to a full table scan:\n" + "\n".join(offenders)